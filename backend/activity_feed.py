@@ -0,0 +1,335 @@
+"""
+Activity Inbox for VotaTok
+Append-only `activities` collection (likes, comments, votes, follows, mentions)
+indexed by (recipient_id, created_at). Events are queued on the write path and
+flushed in batches by a background writer, so /users/activity/recent is one
+ranged query plus one batched user lookup.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import DeleteMany, DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Activities older than this are dropped by a TTL index
+RETENTION_DAYS = 30
+
+# Background writer batching
+FLUSH_BATCH_SIZE = 200
+QUEUE_MAX_SIZE = 10000
+
+# Backfill window when the inbox collection is first created
+BACKFILL_DAYS = 7
+
+DUPLICATE_KEY = 11000
+
+
+def _preview(text: Optional[str], length: int) -> str:
+    return (text or "")[:length]
+
+
+class ActivityFeed:
+    """
+    `activities`: {id, recipient_id, actor_id, type, source_id, content_type,
+    poll_id, content_preview, comment_preview, vote_option, mention_type,
+    mention_option, created_at, read}
+
+    (recipient_id, type, source_id) is unique, so replays and re-votes update
+    the same document instead of appending duplicates.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        # Set during backfill: operations are collected and written directly
+        self._collected: Optional[List] = None
+        self.written = 0
+        self.dropped = 0
+
+    async def initialize_indexes(self):
+        await self.db.activities.create_index(
+            [("recipient_id", 1), ("created_at", -1)], name="activity_inbox"
+        )
+        await self.db.activities.create_index(
+            [("recipient_id", 1), ("type", 1), ("source_id", 1)], unique=True, name="activity_source"
+        )
+        await self.db.activities.create_index(
+            [("created_at", 1)], expireAfterSeconds=RETENTION_DAYS * 86400, name="activity_ttl"
+        )
+        await self.db.activities.create_index("poll_id", sparse=True, name="activity_poll")
+
+    # ---- background writer ----
+
+    def _ensure_writer(self):
+        if self._writer_task is None or self._writer_task.done():
+            self._queue = self._queue or asyncio.Queue(maxsize=QUEUE_MAX_SIZE)
+            self._writer_task = asyncio.create_task(self._run_writer())
+
+    def _enqueue(self, operation):
+        if self._collected is not None:
+            self._collected.append(operation)
+            return
+        try:
+            self._ensure_writer()
+            self._queue.put_nowait(operation)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print("⚠️  Activity queue full - dropping activity event")
+        except RuntimeError:
+            # No running event loop (e.g. scripts) - nothing to flush into
+            self.dropped += 1
+
+    async def _run_writer(self):
+        while True:
+            operations = [await self._queue.get()]
+            while len(operations) < FLUSH_BATCH_SIZE and not self._queue.empty():
+                operations.append(self._queue.get_nowait())
+            try:
+                await self._write(operations)
+            except Exception as e:
+                print(f"❌ Activity batch write failed ({len(operations)} events): {str(e)}")
+            finally:
+                for _ in operations:
+                    self._queue.task_done()
+
+    async def _write(self, operations: List):
+        """
+        Ordered bulk write (an unlike queued right after a like must apply after
+        it). Ordered mode stops at the first failed op, so the rest are re-sent:
+        a duplicate-key upsert (same key upserted concurrently by another worker)
+        is retried once, where it matches the now-existing document; any other
+        failed op is dropped and logged.
+        """
+        retry_allowed = True
+        while operations:
+            try:
+                await self.db.activities.bulk_write(operations, ordered=True)
+                self.written += len(operations)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors") or []
+                if not errors:
+                    raise
+                error = errors[0]
+                position = error["index"]
+                self.written += position
+                if error.get("code") == DUPLICATE_KEY and (position > 0 or retry_allowed):
+                    operations = operations[position:]
+                    retry_allowed = False
+                else:
+                    self.dropped += 1
+                    print(f"❌ Activity event write failed: {error.get('errmsg')}")
+                    operations = operations[position + 1:]
+                    retry_allowed = True
+
+    async def flush(self):
+        """Wait until queued events are written (shutdown, tests)"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    # ---- write path (non-blocking) ----
+
+    def record(self, recipient_id: str, actor_id: str, activity_type: str, source_id: str, **fields):
+        """Queue an upsert of one activity; self-activity is ignored"""
+        if not recipient_id or not actor_id or recipient_id == actor_id:
+            return
+        created_at = fields.pop("created_at", None) or datetime.utcnow()
+        key = {"recipient_id": recipient_id, "type": activity_type, "source_id": source_id}
+        self._enqueue(UpdateOne(
+            key,
+            {
+                "$set": {"actor_id": actor_id, "created_at": created_at, "read": False, **fields},
+                "$setOnInsert": {"id": str(uuid.uuid4())}
+            },
+            upsert=True
+        ))
+
+    def retract(self, recipient_id: str, activity_type: str, source_id: str):
+        """Queue removal of an activity (unlike, unfollow, deleted comment)"""
+        if not recipient_id:
+            return
+        self._enqueue(DeleteOne({"recipient_id": recipient_id, "type": activity_type, "source_id": source_id}))
+
+    def retract_poll(self, poll_id: str):
+        """Queue removal of every activity about a deleted poll (likes, comments, votes, mentions)"""
+        self._enqueue(DeleteMany({"poll_id": poll_id}))
+
+    def record_like(self, poll: Dict, user_id: str, created_at: Optional[datetime] = None):
+        self.record(
+            poll.get("author_id"), user_id, "like", f"{poll['id']}:{user_id}",
+            content_type="poll", poll_id=poll["id"],
+            content_preview=_preview(poll.get("title"), 50), created_at=created_at
+        )
+
+    def retract_like(self, poll: Dict, user_id: str):
+        self.retract(poll.get("author_id"), "like", f"{poll['id']}:{user_id}")
+
+    def record_comment(self, poll: Dict, comment: Dict):
+        self.record(
+            poll.get("author_id"), comment["user_id"], "comment", comment["id"],
+            content_type="poll", poll_id=poll["id"],
+            content_preview=_preview(poll.get("title"), 50),
+            comment_preview=_preview(comment.get("content"), 100),
+            created_at=comment.get("created_at")
+        )
+
+    def retract_comment(self, poll_author_id: str, comment_id: str):
+        self.retract(poll_author_id, "comment", comment_id)
+
+    def record_vote(self, poll: Dict, user_id: str, option_id: str, created_at: Optional[datetime] = None):
+        option_text = next(
+            (opt.get("text", "") for opt in poll.get("options", []) if opt.get("id") == option_id), ""
+        )
+        self.record(
+            poll.get("author_id"), user_id, "vote", f"{poll['id']}:{user_id}",
+            content_type="poll", poll_id=poll["id"],
+            content_preview=_preview(poll.get("title"), 50),
+            vote_option=option_text, created_at=created_at
+        )
+
+    def record_follow(self, follower_id: str, following_id: str, created_at: Optional[datetime] = None):
+        self.record(following_id, follower_id, "follow", follower_id, content_type="user", created_at=created_at)
+
+    def retract_follow(self, follower_id: str, following_id: str):
+        self.retract(following_id, "follow", follower_id)
+
+    def record_mentions(self, poll: Dict, mentioned_user_ids: List[str], created_at: Optional[datetime] = None):
+        """General mentions (poll level) win over option mentions for the same user"""
+        general = set(poll.get("mentioned_users") or [])
+        for user_id in mentioned_user_ids:
+            fields = {
+                "content_type": "poll",
+                "poll_id": poll["id"],
+                "content_preview": _preview(poll.get("title"), 50),
+                "created_at": created_at or poll.get("created_at"),
+            }
+            if user_id in general:
+                fields["mention_type"] = "general"
+            else:
+                fields["mention_type"] = "option"
+                fields["mention_option"] = next(
+                    (opt.get("text", "") for opt in poll.get("options", [])
+                     if user_id in (opt.get("mentioned_users") or [])), ""
+                )
+            self.record(user_id, poll.get("author_id"), "mention", poll["id"], **fields)
+
+    # ---- read path ----
+
+    async def recent(self, recipient_id: str, limit: int = 30, days: int = 7) -> List[Dict]:
+        """Newest activities for a user, hydrated with one batched actor lookup"""
+        since = datetime.utcnow() - timedelta(days=days)
+        activities = await self.db.activities.find(
+            {"recipient_id": recipient_id, "created_at": {"$gte": since}}, {"_id": 0}
+        ).sort("created_at", -1).limit(limit).to_list(limit)
+
+        actor_ids = list({activity["actor_id"] for activity in activities})
+        actors = await self.db.users.find(
+            {"id": {"$in": actor_ids}},
+            {"_id": 0, "id": 1, "username": 1, "display_name": 1, "avatar_url": 1}
+        ).to_list(len(actor_ids))
+        actors_by_id = {actor["id"]: actor for actor in actors}
+
+        results = []
+        for activity in activities:
+            actor = actors_by_id.get(activity["actor_id"])
+            if not actor:
+                continue
+            item = {
+                "id": f"{activity['type']}-{activity['source_id']}",
+                "type": activity["type"],
+                "user": {
+                    "id": actor["id"],
+                    "username": actor["username"],
+                    "display_name": actor.get("display_name") or actor["username"],
+                    "avatar_url": actor.get("avatar_url")
+                },
+                "content_type": activity.get("content_type", "poll"),
+                "created_at": activity["created_at"],
+                "unread": not activity.get("read", False)
+            }
+            for field in ("poll_id", "content_preview", "comment_preview", "vote_option",
+                          "mention_type", "mention_option"):
+                if field in activity:
+                    item[field] = activity[field]
+            results.append(item)
+        return results
+
+    # ---- startup ----
+
+    async def backfill_if_empty(self):
+        """Seed the inbox from the last BACKFILL_DAYS of likes, comments, votes, follows and mentions"""
+        if await self.db.activities.estimated_document_count() > 0:
+            return
+        print("📬 Backfilling activity inbox from recent history...")
+        self._collected = []
+        try:
+            await self._collect_backfill()
+            operations, self._collected = self._collected, None
+            for start in range(0, len(operations), FLUSH_BATCH_SIZE):
+                await self._write(operations[start:start + FLUSH_BATCH_SIZE])
+        finally:
+            self._collected = None
+        print(f"✅ Activity inbox backfilled ({len(operations)} events)")
+
+    async def _collect_backfill(self):
+        since = datetime.utcnow() - timedelta(days=BACKFILL_DAYS)
+        window = {"created_at": {"$gte": since}}
+
+        likes = await self.db.poll_likes.find(window, {"_id": 0}).to_list(None)
+        comments = await self.db.comments.find(window, {"_id": 0}).to_list(None)
+        votes = await self.db.votes.find(window, {"_id": 0}).to_list(None)
+
+        poll_ids = list({doc["poll_id"] for doc in likes + comments + votes if doc.get("poll_id")})
+        projection = {"_id": 0, "id": 1, "title": 1, "author_id": 1, "options": 1,
+                      "mentioned_users": 1, "created_at": 1}
+        polls = {
+            poll["id"]: poll
+            for poll in await self.db.polls.find({"id": {"$in": poll_ids}}, projection).to_list(None)
+        }
+
+        for like in likes:
+            if like["poll_id"] in polls:
+                self.record_like(polls[like["poll_id"]], like["user_id"], like.get("created_at"))
+        for comment in comments:
+            if comment["poll_id"] in polls and comment.get("user_id"):
+                self.record_comment(polls[comment["poll_id"]], comment)
+        for vote in votes:
+            if vote["poll_id"] in polls:
+                self.record_vote(polls[vote["poll_id"]], vote["user_id"], vote["option_id"], vote.get("created_at"))
+        async for follow in self.db.follows.find(window, {"_id": 0}):
+            self.record_follow(follow["follower_id"], follow["following_id"], follow.get("created_at"))
+        async for poll in self.db.polls.find(
+            {**window, "$or": [{"mentioned_users.0": {"$exists": True}},
+                               {"options.mentioned_users.0": {"$exists": True}}]},
+            projection
+        ):
+            mentioned = set(poll.get("mentioned_users") or [])
+            for option in poll.get("options", []):
+                mentioned.update(option.get("mentioned_users") or [])
+            self.record_mentions(poll, list(mentioned))
+
+    async def start(self):
+        await self.initialize_indexes()
+        await self.backfill_if_empty()
+        self._ensure_writer()
+
+    def get_stats(self) -> Dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "written": self.written,
+            "dropped": self.dropped
+        }
+
+
+# Global instance
+activity_feed = None
+
+
+def init_activity_feed(db):
+    """Initialize activity inbox (indexes/backfill run at startup)"""
+    global activity_feed
+    activity_feed = ActivityFeed(db)
+    return activity_feed
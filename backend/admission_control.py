@@ -0,0 +1,279 @@
+"""
+Admission Control for VotaTok API
+Token-bucket rate limits per client (user id or IP) and route class, in-flight
+caps for heavy routes and priority-based load shedding driven by in-flight
+requests and event loop lag. Rejections are 429 (rate limit) or 503
+(overloaded), both with Retry-After, before the worker's latency collapses.
+"""
+import asyncio
+import ipaddress
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from auth import verify_token
+from config import config
+
+ADMISSION_CONFIG = config.ADMISSION_CONFIG
+
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+def _parse_networks(entries: List[str]) -> List:
+    networks = []
+    for entry in entries:
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            print(f"⚠️  Ignoring invalid trusted proxy: {entry}")
+    return networks
+
+
+TRUSTED_PROXY_NETWORKS = _parse_networks(ADMISSION_CONFIG['TRUSTED_PROXIES'])
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXY_NETWORKS)
+
+
+def resolve_client_ip(peer: Optional[str], forwarded_for: Optional[str]) -> str:
+    """
+    Client address behind trusted proxies. X-Forwarded-For is ignored unless the
+    peer is a trusted proxy; then hops are read right to left (the ones proxies
+    appended) and the first untrusted one is the client.
+    """
+    peer = peer or "unknown"
+    if not forwarded_for or not _is_trusted_proxy(peer):
+        return peer
+    for hop in reversed([hop.strip() for hop in forwarded_for.split(",") if hop.strip()]):
+        if not _is_trusted_proxy(hop):
+            return hop
+        peer = hop
+    return peer
+
+
+class RouteClass:
+    """A configured route class: matching rules, limits and counters"""
+
+    def __init__(self, name: str, settings: Dict):
+        self.name = name
+        self.rate = float(settings.get('RATE_PER_SECOND', 0))
+        self.burst = max(1, int(settings.get('BURST', 0)))
+        self.max_concurrent = int(settings.get('MAX_CONCURRENT', 0))
+        self.priority = int(settings.get('PRIORITY', PRIORITY_NORMAL))
+        self.rules: List[Tuple[str, str, bool]] = []
+        for rule in settings.get('RULES', []):
+            method, _, path = rule.partition(" ")
+            prefix = path.endswith("*")
+            self.rules.append((method.upper(), path.rstrip("*"), prefix))
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.admitted = 0
+        self.rate_limited = 0
+        self.concurrency_rejected = 0
+        self.shed = 0
+        self.in_flight = 0
+
+    def matches(self, method: str, path: str) -> bool:
+        for rule_method, rule_path, prefix in self.rules:
+            if rule_method != "*" and rule_method != method:
+                continue
+            if path == rule_path or (prefix and path.startswith(rule_path)):
+                return True
+        return False
+
+    @property
+    def slots(self) -> Optional[asyncio.Semaphore]:
+        if self.max_concurrent and self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        return self._slots
+
+    def to_dict(self) -> Dict:
+        return {
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "concurrency_rejected": self.concurrency_rejected,
+            "shed": self.shed,
+            "in_flight": self.in_flight
+        }
+
+
+class TokenBuckets:
+    """Token bucket per (client, route class); least recently seen clients are evicted"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        """Consume one token; returns 0 when allowed, else seconds until the next token"""
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [float(burst), now]
+            while len(self.buckets) > self.max_entries:
+                self.buckets.popitem(last=False)
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+
+class AdmissionController:
+    """Route classification, limits and the shedding decision for this worker"""
+
+    def __init__(self, settings: Dict = ADMISSION_CONFIG):
+        self.settings = settings
+        self.route_classes = [RouteClass(name, conf) for name, conf in settings['ROUTE_CLASSES'].items()]
+        self.default_class = next(
+            (route_class for route_class in self.route_classes if route_class.name == "default"),
+            RouteClass("default", {})
+        )
+        self.buckets = TokenBuckets(settings['MAX_TRACKED_CLIENTS'])
+        self.in_flight = 0
+        self.loop_lag_ms = 0.0
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def classify(self, method: str, path: str) -> RouteClass:
+        for route_class in self.route_classes:
+            if route_class.matches(method, path):
+                return route_class
+        return self.default_class
+
+    @staticmethod
+    def client_key(scope) -> str:
+        """Authenticated user id when a valid bearer token is present, otherwise client IP"""
+        headers = Headers(scope=scope)
+        authorization = headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            payload = verify_token(authorization[7:])
+            if payload and payload.get("sub"):
+                return f"user:{payload['sub']}"
+        client = scope.get("client")
+        return f"ip:{resolve_client_ip(client[0] if client else None, headers.get('x-forwarded-for'))}"
+
+    # ---- load shedding ----
+
+    def ensure_lag_monitor(self):
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = asyncio.create_task(self._monitor_lag())
+
+    async def _monitor_lag(self):
+        """Event loop lag: how late a timer fires; decays so a single spike passes"""
+        interval = self.settings['LAG_SAMPLE_INTERVAL_SECONDS']
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag_ms = max(0.0, (loop.time() - started - interval) * 1000)
+            self.loop_lag_ms = max(lag_ms, self.loop_lag_ms * 0.5)
+
+    def shed_level(self) -> int:
+        """Lowest priority value currently being shed (3 = nothing shed)"""
+        settings = self.settings
+        if (self.in_flight >= settings['SHED_NORMAL_PRIORITY_IN_FLIGHT']
+                or self.loop_lag_ms >= settings['SHED_NORMAL_PRIORITY_LAG_MS']):
+            return PRIORITY_NORMAL
+        if (self.in_flight >= settings['SHED_LOW_PRIORITY_IN_FLIGHT']
+                or self.loop_lag_ms >= settings['SHED_LOW_PRIORITY_LAG_MS']):
+            return PRIORITY_LOW
+        return PRIORITY_LOW + 1
+
+    def get_stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "loop_lag_ms": round(self.loop_lag_ms, 1),
+            "shedding_priority": self.shed_level(),
+            "tracked_clients": len(self.buckets.buckets),
+            "route_classes": {route_class.name: route_class.to_dict() for route_class in self.route_classes}
+        }
+
+
+def _reject(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware admitting /api requests: shed by priority under overload,
+    then the client's token bucket, then the route class's in-flight cap.
+    CORS preflights and websockets pass through.
+    """
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self.controller = controller or admission_controller
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not ADMISSION_CONFIG['ENABLED']
+                or scope["method"] == "OPTIONS" or not scope["path"].startswith("/api")):
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        controller.ensure_lag_monitor()
+        route_class = controller.classify(scope["method"], scope["path"])
+
+        if route_class.priority >= controller.shed_level():
+            route_class.shed += 1
+            response = _reject(503, "Server is busy. Please try again shortly.",
+                               ADMISSION_CONFIG['SHED_RETRY_AFTER_SECONDS'])
+            await response(scope, receive, send)
+            return
+
+        if route_class.rate > 0:
+            wait = controller.buckets.take(
+                f"{controller.client_key(scope)}|{route_class.name}", route_class.rate, route_class.burst
+            )
+            if wait:
+                route_class.rate_limited += 1
+                response = _reject(429, "Too many requests. Please slow down.", wait)
+                await response(scope, receive, send)
+                return
+
+        slots = route_class.slots
+        if slots is not None:
+            try:
+                await asyncio.wait_for(slots.acquire(), ADMISSION_CONFIG['CONCURRENCY_WAIT_SECONDS'])
+            except asyncio.TimeoutError:
+                route_class.concurrency_rejected += 1
+                response = _reject(503, "Server is busy. Please try again shortly.", 1)
+                await response(scope, receive, send)
+                return
+
+        route_class.admitted += 1
+        route_class.in_flight += 1
+        controller.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.in_flight -= 1
+            route_class.in_flight -= 1
+            if slots is not None:
+                slots.release()
+
+
+# Global instance (one per worker process)
+admission_controller = AdmissionController()
+
+
+def get_admission_stats() -> Dict:
+    """Admission metrics for the performance stats endpoint"""
+    return admission_controller.get_stats()
@@ -6,14 +6,27 @@ from passlib.hash import bcrypt
 import os
 from dotenv import load_dotenv
 from config import config
+from password_hashing import PasswordHashingPool, PasswordHashingBusy
 
 load_dotenv()
 
+PASSWORD_HASHING_CONFIG = config.PASSWORD_HASHING_CONFIG
+
 # Password hashing with argon2 (more robust than bcrypt)
 pwd_context = CryptContext(
     schemes=["argon2", "bcrypt"], 
     deprecated="auto",
-    argon2__default_rounds=3
+    argon2__default_rounds=PASSWORD_HASHING_CONFIG['ARGON2_TIME_COST'],
+    argon2__memory_cost=PASSWORD_HASHING_CONFIG['ARGON2_MEMORY_COST'],
+    argon2__parallelism=PASSWORD_HASHING_CONFIG['ARGON2_PARALLELISM']
+)
+
+# Hash/verify off the event loop for async endpoints
+password_pool = PasswordHashingPool(
+    pwd_context,
+    workers=PASSWORD_HASHING_CONFIG['WORKERS'],
+    max_pending=PASSWORD_HASHING_CONFIG['MAX_PENDING'],
+    queue_timeout=PASSWORD_HASHING_CONFIG['QUEUE_TIMEOUT_SECONDS']
 )
 
 # JWT settings from configuration
@@ -21,19 +34,31 @@ SECRET_KEY = config.SECRET_KEY
 ALGORITHM = config.JWT_ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = config.ACCESS_TOKEN_EXPIRE_MINUTES
 
+def _truncate_password(password: str) -> str:
+    """Truncate password to 72 bytes for bcrypt compatibility"""
+    if len(password.encode('utf-8')) > 72:
+        password = password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
+    return password
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
-    # Truncate password to 72 bytes for bcrypt compatibility
-    if len(plain_password.encode('utf-8')) > 72:
-        plain_password = plain_password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
-    return pwd_context.verify(plain_password, hashed_password)
+    return pwd_context.verify(_truncate_password(plain_password), hashed_password)
 
 def get_password_hash(password: str) -> str:
     """Hash a password (bcrypt has 72 byte limit)"""
-    # Truncate password to 72 bytes for bcrypt compatibility
-    if len(password.encode('utf-8')) > 72:
-        password = password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
-    return pwd_context.hash(password)
+    return pwd_context.hash(_truncate_password(password))
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the hashing pool (raises PasswordHashingBusy when saturated)"""
+    return await password_pool.verify(_truncate_password(plain_password), hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the hashing pool (raises PasswordHashingBusy when saturated)"""
+    return await password_pool.hash(_truncate_password(password))
+
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """(valid, new_hash): new_hash is set when the stored hash uses outdated parameters"""
+    return await password_pool.verify_and_update(_truncate_password(plain_password), hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token"""
@@ -0,0 +1,350 @@
+"""
+Autocomplete Engine for VotaTok
+In-memory sorted-array prefix index over usernames, display names, hashtags
+and sound titles, weighted by followers / usage. Answers top-K prefix queries
+without touching MongoDB; kept fresh by write hooks and periodic rebuilds.
+"""
+import asyncio
+import heapq
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import config
+from search_index import extract_poll_hashtags, fold_text
+
+SEARCH_CONFIG = config.SEARCH_CONFIG
+
+# Ranges larger than this are answered from a memoized top-K per prefix
+SCAN_LIMIT = 512
+MEMO_TOP_K = SEARCH_CONFIG['MAX_AUTOCOMPLETE_LIMIT'] + 1
+
+KEY_END = "\U0010ffff"
+
+
+class PrefixIndex:
+    """Sorted (key, entry_id) array with weighted entries and top-K prefix lookup"""
+
+    def __init__(self):
+        self.keys: List[Tuple[str, str]] = []
+        self.entries: Dict[str, Dict] = {}
+        self.entry_keys: Dict[str, List[str]] = {}
+        self._top_cache: Dict[str, List[str]] = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _invalidate(self, keys: List[str]):
+        if not self._top_cache:
+            return
+        for key in keys:
+            for length in range(1, len(key) + 1):
+                self._top_cache.pop(key[:length], None)
+
+    def load(self, records: List[Tuple[str, List[str], Dict]]):
+        """Bulk load (entry_id, keys, entry) records, sorting once"""
+        for entry_id, keys, entry in records:
+            keys = sorted({key for key in keys if key})
+            self.entries[entry_id] = entry
+            self.entry_keys[entry_id] = keys
+            self.keys.extend((key, entry_id) for key in keys)
+        self.keys.sort()
+        self._top_cache.clear()
+
+    def upsert(self, entry_id: str, keys: List[str], entry: Dict):
+        """Add or replace an entry; entry must carry a numeric 'weight'"""
+        keys = sorted({key for key in keys if key})
+        old_keys = self.entry_keys.get(entry_id, [])
+        if old_keys != keys:
+            for key in old_keys:
+                position = bisect_left(self.keys, (key, entry_id))
+                if position < len(self.keys) and self.keys[position] == (key, entry_id):
+                    self.keys.pop(position)
+            for key in keys:
+                insort(self.keys, (key, entry_id))
+            self.entry_keys[entry_id] = keys
+        self.entries[entry_id] = entry
+        self._invalidate(old_keys + keys)
+
+    def set_weight(self, entry_id: str, weight: float):
+        entry = self.entries.get(entry_id)
+        if entry is None or entry.get("weight") == weight:
+            return
+        entry["weight"] = weight
+        self._invalidate(self.entry_keys.get(entry_id, []))
+
+    def remove(self, entry_id: str):
+        keys = self.entry_keys.pop(entry_id, [])
+        for key in keys:
+            position = bisect_left(self.keys, (key, entry_id))
+            if position < len(self.keys) and self.keys[position] == (key, entry_id):
+                self.keys.pop(position)
+        self.entries.pop(entry_id, None)
+        self._invalidate(keys)
+
+    def _rank(self, lo: int, hi: int, k: int) -> List[str]:
+        entry_ids = {self.keys[i][1] for i in range(lo, hi)}
+        return heapq.nlargest(k, entry_ids, key=lambda eid: self.entries[eid].get("weight", 0))
+
+    def top_k(self, prefix: str, k: int, exclude: Optional[str] = None) -> List[Dict]:
+        """Heaviest entries having a key that starts with prefix"""
+        if not prefix or k <= 0:
+            return []
+        lo = bisect_left(self.keys, (prefix,))
+        hi = bisect_left(self.keys, (prefix + KEY_END,), lo)
+        if lo == hi:
+            return []
+
+        if hi - lo <= SCAN_LIMIT:
+            ranked = self._rank(lo, hi, k + 1)
+        else:
+            ranked = self._top_cache.get(prefix)
+            if ranked is None:
+                ranked = self._top_cache[prefix] = self._rank(lo, hi, MEMO_TOP_K)
+
+        return [self.entries[eid] for eid in ranked if eid != exclude][:k]
+
+
+class AutocompleteEngine:
+    """Users, hashtags and sounds prefix indexes with incremental maintenance"""
+
+    def __init__(self, db):
+        self.db = db
+        self.users = PrefixIndex()
+        self.hashtags = PrefixIndex()
+        self.sounds = PrefixIndex()
+        self.built_at: Optional[datetime] = None
+        self.builds = 0  # Completed builds; concurrent build() calls share one
+        self._build_lock = asyncio.Lock()
+        self._rebuild_task: Optional[asyncio.Task] = None
+        # Write hooks (name, args) called while a rebuild is running, replayed after the swap
+        self._pending_ops: Optional[List[Tuple[str, Tuple[Any, ...]]]] = None
+
+    # ---- entry builders ----
+
+    @staticmethod
+    def _user_keys(user: Dict) -> List[str]:
+        keys = [fold_text(user.get("username") or "")]
+        display_name = fold_text(user.get("display_name") or "")
+        if display_name:
+            keys.append(display_name)
+            # Also complete on later words ("garcia" finds "Ana García")
+            keys.extend(display_name.split()[1:])
+        return keys
+
+    @staticmethod
+    def _user_entry(user: Dict, followers_count: int) -> Dict:
+        username = user.get("username", "")
+        return {
+            "type": "user",
+            "id": user.get("id"),
+            "text": f"@{username}",
+            "display": f"{user.get('display_name') or username} (@{username})",
+            "avatar": user.get("avatar_url"),
+            "weight": followers_count
+        }
+
+    @staticmethod
+    def _sound_entry(audio: Dict) -> Dict:
+        return {
+            "type": "sound",
+            "id": audio.get("id"),
+            "text": audio.get("title", ""),
+            "display": f"{audio.get('title', '')} - {audio.get('artist', '')}",
+            "weight": audio.get("uses_count", 0)
+        }
+
+    # ---- build ----
+
+    async def build(self):
+        """Full rebuild from MongoDB, swapped in atomically"""
+        builds_seen = self.builds
+        async with self._build_lock:
+            if self.builds != builds_seen:
+                return  # Built by another caller while this one waited for the lock
+            started = datetime.utcnow()
+            self._pending_ops = []
+            try:
+                users, hashtags, sounds = PrefixIndex(), PrefixIndex(), PrefixIndex()
+
+                followers = {}
+                async for profile in self.db.user_profiles.find({}, {"_id": 0, "id": 1, "followers_count": 1}):
+                    if profile.get("id"):
+                        followers[profile["id"]] = profile.get("followers_count", 0)
+                await asyncio.sleep(0)
+
+                records = []
+                user_projection = {"_id": 0, "id": 1, "username": 1, "display_name": 1, "avatar_url": 1}
+                async for user in self.db.users.find({}, user_projection):
+                    if user.get("id"):
+                        entry = self._user_entry(user, followers.get(user["id"], 0))
+                        records.append((user["id"], self._user_keys(user), entry))
+                users.load(records)
+                await asyncio.sleep(0)
+
+                counts: Dict[str, int] = {}
+                displays: Dict[str, str] = {}
+                # Hashtag changes so far are in the counts read below; replaying them would count twice
+                self._pending_ops = [op for op in self._pending_ops if op[0] != "update_poll_hashtags"]
+                # Materialized hashtag statistics when available, otherwise scan polls
+                async for doc in self.db.hashtags.find({"count": {"$gt": 0}}, {"_id": 0, "tag": 1, "display": 1, "count": 1}):
+                    counts[doc["tag"]] = doc["count"]
+                    displays[doc["tag"]] = doc.get("display") or doc["tag"]
+                if not counts:
+                    poll_projection = {"_id": 0, "title": 1, "description": 1, "content": 1, "tags": 1}
+                    async for poll in self.db.polls.find({}, poll_projection):
+                        for term, display in extract_poll_hashtags(poll).items():
+                            counts[term] = counts.get(term, 0) + 1
+                            displays.setdefault(term, display)
+                hashtags.load([
+                    (term, [term], self._hashtag_entry(displays[term], count))
+                    for term, count in counts.items()
+                ])
+                await asyncio.sleep(0)
+
+                records = []
+                audio_projection = {"_id": 0, "id": 1, "title": 1, "artist": 1, "uses_count": 1}
+                async for audio in self.db.user_audio.find({"is_active": True, "privacy": "public"}, audio_projection):
+                    if audio.get("id"):
+                        records.append((audio["id"], [fold_text(audio.get("title") or "")], self._sound_entry(audio)))
+                sounds.load(records)
+
+                # Swap, then replay hooks that ran during the build (no await in between)
+                pending, self._pending_ops = self._pending_ops, None
+                self.users, self.hashtags, self.sounds = users, hashtags, sounds
+                for hook, args in pending:
+                    getattr(self, hook)(*args)
+                self.built_at = started
+                self.builds += 1
+                print(f"🔤 Autocomplete index built: users={len(users)}, hashtags={len(hashtags)}, sounds={len(sounds)}")
+            finally:
+                self._pending_ops = None
+
+    async def ensure_ready(self) -> bool:
+        """Build on first use, refresh in background once stale"""
+        if self.built_at is None:
+            try:
+                await self.build()
+            except Exception as e:
+                print(f"❌ Autocomplete index build failed: {str(e)}")
+                return False
+            return True
+
+        age = (datetime.utcnow() - self.built_at).total_seconds()
+        if age > SEARCH_CONFIG['INDEX_REBUILD_INTERVAL_SECONDS'] and (
+            self._rebuild_task is None or self._rebuild_task.done()
+        ):
+            self._rebuild_task = asyncio.create_task(self.build())
+        return True
+
+    # ---- queries ----
+
+    async def complete(
+        self,
+        query: str,
+        limit: int,
+        exclude_user_id: Optional[str] = None
+    ) -> Optional[List[Dict]]:
+        """Top-K suggestions for a typed prefix, or None when the index is unavailable"""
+        if not await self.ensure_ready():
+            return None
+
+        folded = fold_text(query.strip())
+        suggestions = []
+
+        if not folded.startswith("#"):
+            user_prefix = folded.lstrip("@")
+            suggestions.extend(self.users.top_k(user_prefix, limit // 2, exclude=exclude_user_id))
+
+        if not folded.startswith("@"):
+            hashtag_prefix = folded if folded.startswith("#") else f"#{folded}"
+            suggestions.extend(self.hashtags.top_k(hashtag_prefix, 3))
+            if not folded.startswith("#"):
+                suggestions.extend(self.sounds.top_k(folded, 2))
+
+        return [{k: v for k, v in s.items() if k != "weight"} for s in suggestions]
+
+    # ---- write hooks ----
+
+    def _record(self, hook: str, *args):
+        if self._pending_ops is not None:
+            self._pending_ops.append((hook, args))
+
+    def upsert_user(self, user: Dict):
+        self._record("upsert_user", user)
+        if not user or not user.get("id"):
+            return
+        existing = self.users.entries.get(user["id"])
+        followers_count = existing["weight"] if existing else 0
+        self.users.upsert(user["id"], self._user_keys(user), self._user_entry(user, followers_count))
+
+    def set_user_followers(self, user_id: str, followers_count: int):
+        self._record("set_user_followers", user_id, followers_count)
+        self.users.set_weight(user_id, followers_count)
+
+    @staticmethod
+    def _hashtag_entry(display: str, count: int) -> Dict:
+        return {
+            "type": "hashtag",
+            "text": display,
+            "display": f"{display} ({count} posts)",
+            "count": count,
+            "weight": count
+        }
+
+    def update_poll_hashtags(self, old_poll: Optional[Dict], new_poll: Optional[Dict]):
+        """Adjust hashtag usage counts for a created, edited or deleted poll"""
+        self._record("update_poll_hashtags", old_poll, new_poll)
+        old_tags = extract_poll_hashtags(old_poll) if old_poll else {}
+        new_tags = extract_poll_hashtags(new_poll) if new_poll else {}
+        for term in old_tags.keys() - new_tags.keys():
+            entry = self.hashtags.entries.get(term)
+            if not entry:
+                continue
+            count = entry["count"] - 1
+            if count <= 0:
+                self.hashtags.remove(term)
+            else:
+                self.hashtags.upsert(term, [term], self._hashtag_entry(entry["text"], count))
+        for term in new_tags.keys() - old_tags.keys():
+            entry = self.hashtags.entries.get(term)
+            count = entry["count"] + 1 if entry else 1
+            display = entry["text"] if entry else new_tags[term]
+            self.hashtags.upsert(term, [term], self._hashtag_entry(display, count))
+
+    def upsert_sound(self, audio: Dict):
+        self._record("upsert_sound", audio)
+        if not audio or not audio.get("id"):
+            return
+        privacy = getattr(audio.get("privacy"), "value", audio.get("privacy"))
+        if not audio.get("is_active", True) or privacy != "public":
+            self.sounds.remove(audio["id"])
+            return
+        self.sounds.upsert(audio["id"], [fold_text(audio.get("title") or "")], self._sound_entry(audio))
+
+    def set_sound_uses(self, audio_id: str, uses_count: int):
+        self._record("set_sound_uses", audio_id, uses_count)
+        self.sounds.set_weight(audio_id, uses_count)
+
+    def remove_sound(self, audio_id: str):
+        self._record("remove_sound", audio_id)
+        self.sounds.remove(audio_id)
+
+    def get_stats(self) -> Dict:
+        return {
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+            "users": len(self.users),
+            "hashtags": len(self.hashtags),
+            "sounds": len(self.sounds)
+        }
+
+
+# Global instance
+autocomplete_engine = None
+
+
+def init_autocomplete_engine(db):
+    """Initialize autocomplete engine (built lazily on first query)"""
+    global autocomplete_engine
+    autocomplete_engine = AutocompleteEngine(db)
+    return autocomplete_engine
@@ -0,0 +1,228 @@
+"""
+Comment Threads for VotaTok
+Comments carry their ancestor ids (root first, parent last) and a stored
+reply_count of all nested replies, so root comments page by (created_at, id)
+keyset and replies are read per parent on demand, or for a page of roots in a
+single ancestor query, instead of loading and rebuilding the whole thread.
+The same path lets a whole subtree be collected and deleted in bulk.
+"""
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from social_graph import PRIVATE_USER_FIELDS, decode_cursor, encode_cursor
+
+# Page size bounds
+ROOT_COMMENTS_MAX_LIMIT = 100
+REPLIES_DEFAULT_LIMIT = 20
+REPLIES_MAX_LIMIT = 100
+
+# Nested replies returned inline per root comment (oldest first); roots with
+# more are marked replies_truncated and load the rest via /comments/{id}/replies
+INLINE_REPLIES_PER_ROOT = 50
+
+BACKFILL_BATCH_SIZE = 500
+
+
+class CommentThreads:
+    """Paginated comment reads and thread bookkeeping (ancestor paths, reply counts)"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def initialize_indexes(self):
+        await self.db.comments.create_index(
+            [("poll_id", 1), ("parent_comment_id", 1), ("created_at", 1), ("id", 1)],
+            name="comment_roots_keyset"
+        )
+        await self.db.comments.create_index(
+            [("parent_comment_id", 1), ("created_at", 1), ("id", 1)], name="comment_replies_keyset"
+        )
+        # Subtree lookups ({"ancestor_ids": id}) use this index's prefix too
+        await self.db.comments.create_index(
+            [("ancestor_ids", 1), ("created_at", 1), ("id", 1)], name="comment_ancestors_keyset"
+        )
+        try:
+            # Superseded single-field index: only extra write cost per comment
+            await self.db.comments.drop_index("comment_ancestors")
+        except OperationFailure:
+            pass  # Already dropped
+
+    # ---- write path ----
+
+    @staticmethod
+    def ancestors_for(parent: Optional[Dict]) -> List[str]:
+        """ancestor_ids of a new comment replying to `parent` (None for a root comment)"""
+        if not parent:
+            return []
+        return list(parent.get("ancestor_ids") or []) + [parent["id"]]
+
+    async def add_reply(self, ancestor_ids: List[str]):
+        """Count a new reply on every ancestor"""
+        if ancestor_ids:
+            await self.db.comments.update_many(
+                {"id": {"$in": ancestor_ids}}, {"$inc": {"reply_count": 1}}
+            )
+
+    async def remove_replies(self, ancestor_ids: List[str], count: int):
+        """Uncount `count` removed replies on every ancestor"""
+        if ancestor_ids and count:
+            await self.db.comments.update_many(
+                {"id": {"$in": ancestor_ids}}, {"$inc": {"reply_count": -count}}
+            )
+
+    async def delete_subtree(self, comment: Dict) -> Tuple[List[str], Optional[Dict]]:
+        """
+        Delete a comment, every nested reply and their likes; ancestors' reply_count
+        and the poll's comments_count are adjusted alongside.
+        Returns (deleted ids, poll {"author_id"} or None).
+        """
+        descendants = await self.db.comments.find(
+            {"ancestor_ids": comment["id"]}, {"_id": 0, "id": 1}
+        ).to_list(None)
+        deleted_ids = [comment["id"]] + [reply["id"] for reply in descendants]
+
+        *_, poll = await asyncio.gather(
+            self.db.comments.delete_many({"id": {"$in": deleted_ids}}),
+            self.db.comment_likes.delete_many({"comment_id": {"$in": deleted_ids}}),
+            self.remove_replies(comment.get("ancestor_ids") or [], len(deleted_ids)),
+            self.db.polls.find_one_and_update(
+                {"id": comment["poll_id"]},
+                {"$inc": {"comments_count": -len(deleted_ids)}},
+                projection={"_id": 0, "author_id": 1}
+            )
+        )
+        return deleted_ids, poll
+
+    # ---- read path ----
+
+    async def _page(self, query: Dict, limit: int, cursor: Optional[str], offset: int = 0) -> Tuple[List[Dict], Optional[str]]:
+        position = decode_cursor(cursor) if cursor else None
+        if position is not None:
+            created_at, comment_id = position
+            query["$or"] = [
+                {"created_at": {"$gt": created_at}},
+                {"created_at": created_at, "id": {"$gt": comment_id}},
+            ]
+        find = self.db.comments.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)])
+        if position is None and offset:
+            find = find.skip(offset)
+        comments = await find.limit(limit + 1).to_list(limit + 1)
+
+        next_cursor = None
+        if len(comments) > limit:
+            comments = comments[:limit]
+            last = comments[-1]
+            next_cursor = encode_cursor(last["created_at"], last["id"])
+        return comments, next_cursor
+
+    async def root_page(
+        self,
+        poll_id: str,
+        limit: int,
+        cursor: Optional[str] = None,
+        offset: int = 0,
+        with_replies: bool = True
+    ) -> Tuple[List[Dict], List[Dict], Optional[str]]:
+        """
+        Root comments of a poll, oldest first; `offset` applies only without a cursor.
+        Returns (roots, replies, next_cursor), where replies are the nested replies
+        of those roots when with_replies is set: up to INLINE_REPLIES_PER_ROOT per
+        root (one bounded query each, run concurrently). Roots with more replies
+        than that get "replies_truncated": True.
+        """
+        roots, next_cursor = await self._page(
+            {"poll_id": poll_id, "parent_comment_id": None}, limit, cursor, offset
+        )
+        replies: List[Dict] = []
+        threaded = [root for root in roots if root.get("reply_count", 0) > 0] if with_replies else []
+        if threaded:
+            per_root = await asyncio.gather(*(
+                self.db.comments.find({"ancestor_ids": root["id"]}, {"_id": 0})
+                .sort([("created_at", 1), ("id", 1)])
+                .limit(INLINE_REPLIES_PER_ROOT + 1)
+                .to_list(INLINE_REPLIES_PER_ROOT + 1)
+                for root in threaded
+            ))
+            for root, root_replies in zip(threaded, per_root):
+                root["replies_truncated"] = len(root_replies) > INLINE_REPLIES_PER_ROOT
+                replies.extend(root_replies[:INLINE_REPLIES_PER_ROOT])
+        return roots, replies, next_cursor
+
+    async def replies_page(self, comment_id: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Direct replies of a comment, oldest first"""
+        return await self._page({"parent_comment_id": comment_id}, limit, cursor)
+
+    async def hydrate(self, comments: List[Dict], viewer_id: str) -> Tuple[Dict[str, Dict], Set[str]]:
+        """(authors_by_id, ids the viewer liked) for a set of comments, two batched queries"""
+        if not comments:
+            return {}, set()
+        user_ids = list({comment["user_id"] for comment in comments})
+        comment_ids = [comment["id"] for comment in comments]
+        users, likes = await asyncio.gather(
+            self.db.users.find({"id": {"$in": user_ids}}, PRIVATE_USER_FIELDS).to_list(len(user_ids)),
+            self.db.comment_likes.find(
+                {"comment_id": {"$in": comment_ids}, "user_id": viewer_id},
+                {"_id": 0, "comment_id": 1}
+            ).to_list(len(comment_ids))
+        )
+        return {user["id"]: user for user in users}, {like["comment_id"] for like in likes}
+
+    # ---- startup ----
+
+    async def backfill_paths(self):
+        """Derive ancestor_ids and reply_count for comments created before they were stored"""
+        poll_ids = await self.db.comments.distinct("poll_id", {"ancestor_ids": {"$exists": False}})
+        if not poll_ids:
+            return
+        print(f"🧵 Backfilling comment thread paths for {len(poll_ids)} polls...")
+        updated = 0
+        for poll_id in poll_ids:
+            comments = await self.db.comments.find(
+                {"poll_id": poll_id}, {"_id": 0, "id": 1, "parent_comment_id": 1}
+            ).to_list(None)
+            parents = {comment["id"]: comment.get("parent_comment_id") for comment in comments}
+
+            ancestors: Dict[str, List[str]] = {}
+            for comment_id in parents:
+                path, current, seen = [], parents.get(comment_id), {comment_id}
+                while current and current in parents and current not in seen:
+                    path.append(current)
+                    seen.add(current)
+                    current = parents[current]
+                ancestors[comment_id] = path[::-1]
+
+            reply_counts: Dict[str, int] = {}
+            for path in ancestors.values():
+                for ancestor_id in path:
+                    reply_counts[ancestor_id] = reply_counts.get(ancestor_id, 0) + 1
+
+            operations = [
+                UpdateOne(
+                    {"id": comment_id},
+                    {"$set": {"ancestor_ids": path, "reply_count": reply_counts.get(comment_id, 0)}}
+                )
+                for comment_id, path in ancestors.items()
+            ]
+            for start in range(0, len(operations), BACKFILL_BATCH_SIZE):
+                await self.db.comments.bulk_write(operations[start:start + BACKFILL_BATCH_SIZE], ordered=False)
+            updated += len(operations)
+            await asyncio.sleep(0)  # Yield to request handlers
+        print(f"✅ Comment thread paths backfilled ({updated} comments)")
+
+    async def start(self):
+        await self.initialize_indexes()
+        await self.backfill_paths()
+
+
+# Global instance
+comment_threads = None
+
+
+def init_comment_threads(db):
+    """Initialize comment thread queries (indexes/backfill run at startup)"""
+    global comment_threads
+    comment_threads = CommentThreads(db)
+    return comment_threads
@@ -147,11 +147,24 @@ class Config:
         # Cache configuration
         'ENABLE_SEARCH_CACHE': os.getenv("SEARCH_ENABLE_CACHE", "true").lower() == "true",
         'CACHE_TTL_SECONDS': int(os.getenv("SEARCH_CACHE_TTL", "300")),  # 5 minutes
+        # Music used in polls (ids, post counts, resolved info) for sound search
+        'POPULAR_MUSIC_TTL_SECONDS': int(os.getenv("SEARCH_POPULAR_MUSIC_TTL", "600")),  # 10 minutes
+        'POPULAR_MUSIC_LIMIT': int(os.getenv("SEARCH_POPULAR_MUSIC_LIMIT", "200")),
         
         # Performance limits
         'MAX_FUZZY_RESULTS': int(os.getenv("SEARCH_MAX_FUZZY_RESULTS", "50")),
         'FUZZY_SEARCH_MULTIPLIER': int(os.getenv("SEARCH_FUZZY_MULTIPLIER", "2")),
-        
+
+        # Full-text index (in-process inverted index with BM25 ranking)
+        'INDEX_REBUILD_INTERVAL_SECONDS': int(os.getenv("SEARCH_INDEX_REBUILD_INTERVAL", "3600")),
+        'INDEX_BUILD_BATCH_SIZE': int(os.getenv("SEARCH_INDEX_BUILD_BATCH_SIZE", "1000")),
+        'BM25_K1': float(os.getenv("SEARCH_BM25_K1", "1.2")),
+        'BM25_B': float(os.getenv("SEARCH_BM25_B", "0.75")),
+        'MAX_PREFIX_EXPANSIONS': int(os.getenv("SEARCH_MAX_PREFIX_EXPANSIONS", "50")),
+
+        # Materialized hashtag statistics (rolling 1h/24h/7d windows)
+        'HASHTAG_WINDOW_REFRESH_SECONDS': int(os.getenv("SEARCH_HASHTAG_WINDOW_REFRESH", "300")),
+
         # Sort options
         'DEFAULT_SORT': os.getenv("SEARCH_DEFAULT_SORT", "relevance"),
         'AVAILABLE_SORTS': ["relevance", "popularity", "recent"],
@@ -160,7 +173,178 @@ class Config:
         'DEFAULT_FILTER': os.getenv("SEARCH_DEFAULT_FILTER", "all"),
         'AVAILABLE_FILTERS': ["all", "users", "posts", "hashtags", "sounds"],
     }
-    
+
+    # Response Compression Configuration
+    COMPRESSION_CONFIG = {
+        'ENABLED': os.getenv("COMPRESSION_ENABLED", "true").lower() == "true",
+        # Responses smaller than this are sent as-is (compression overhead not worth it)
+        'MINIMUM_SIZE': int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024")),
+        # Server preference when the client accepts several encodings with equal q
+        'PREFERRED_ENCODINGS': os.getenv("COMPRESSION_PREFERRED_ENCODINGS", "br,zstd,gzip").split(","),
+        'GZIP_LEVEL': int(os.getenv("COMPRESSION_GZIP_LEVEL", "6")),
+        'BROTLI_QUALITY': int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4")),
+        'ZSTD_LEVEL': int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3")),
+        'COMPRESSIBLE_TYPES': ["application/json", "text/", "application/javascript", "image/svg+xml"],
+        # Pre-compressed payload cache for hot cached responses (fast feed)
+        'PAYLOAD_CACHE_MAX_ENTRIES': int(os.getenv("COMPRESSION_PAYLOAD_CACHE_MAX_ENTRIES", "512")),
+    }
+
+    # Stories Configuration
+    STORIES_CONFIG = {
+        # Diagnostic count queries and per-group logging on the stories tray
+        'DEBUG_COUNTS': os.getenv("STORIES_DEBUG_COUNTS", "false").lower() == "true",
+        'MAX_TRAY_STORIES': int(os.getenv("STORIES_MAX_TRAY_STORIES", "1000")),
+        # Expired stories are moved to stories_archive and their views pruned
+        'SWEEP_INTERVAL_SECONDS': int(os.getenv("STORIES_SWEEP_INTERVAL_SECONDS", "300")),
+        'SWEEP_BATCH_SIZE': int(os.getenv("STORIES_SWEEP_BATCH_SIZE", "500")),
+        # 0 keeps archived stories forever
+        'ARCHIVE_RETENTION_DAYS': int(os.getenv("STORIES_ARCHIVE_RETENTION_DAYS", "0")),
+    }
+
+    # Login Throttling Configuration
+    LOGIN_RATE_LIMIT_CONFIG = {
+        # "memory" (per worker) or "redis" (shared across workers/instances)
+        'BACKEND': os.getenv("LOGIN_RATE_LIMIT_BACKEND", "memory"),
+        'REDIS_URL': os.getenv("LOGIN_RATE_LIMIT_REDIS_URL", "redis://localhost:6379/1"),
+        # Failed attempts allowed per sliding window
+        'WINDOW_SECONDS': int(os.getenv("LOGIN_RATE_LIMIT_WINDOW_SECONDS", "900")),
+        'MAX_FAILURES_PER_EMAIL': int(os.getenv("LOGIN_RATE_LIMIT_MAX_FAILURES_PER_EMAIL", "5")),
+        'MAX_FAILURES_PER_IP': int(os.getenv("LOGIN_RATE_LIMIT_MAX_FAILURES_PER_IP", "10")),
+        # Keys tracked by the in-memory backend (oldest evicted first)
+        'MAX_TRACKED_KEYS': int(os.getenv("LOGIN_RATE_LIMIT_MAX_TRACKED_KEYS", "100000")),
+        # login_attempts audit trail, written in batches off the request path
+        'AUDIT_BATCH_SIZE': int(os.getenv("LOGIN_AUDIT_BATCH_SIZE", "500")),
+        'AUDIT_QUEUE_MAX_SIZE': int(os.getenv("LOGIN_AUDIT_QUEUE_MAX_SIZE", "50000")),
+    }
+
+    # Password Hashing Configuration
+    # Argon2 parameters: run `python password_hashing.py` on the host to calibrate.
+    # Hashes made with other parameters are upgraded on the user's next login.
+    PASSWORD_HASHING_CONFIG = {
+        'ARGON2_TIME_COST': int(os.getenv("ARGON2_TIME_COST", "3")),
+        'ARGON2_MEMORY_COST': int(os.getenv("ARGON2_MEMORY_COST", "65536")),  # KiB
+        'ARGON2_PARALLELISM': int(os.getenv("ARGON2_PARALLELISM", "4")),
+        # Worker threads for hash/verify (argon2 and bcrypt release the GIL)
+        'WORKERS': int(os.getenv("PASSWORD_HASHING_WORKERS", "2")),
+        # Calls waiting for a worker beyond this are rejected (503) instead of queued
+        'MAX_PENDING': int(os.getenv("PASSWORD_HASHING_MAX_PENDING", "64")),
+        'QUEUE_TIMEOUT_SECONDS': float(os.getenv("PASSWORD_HASHING_QUEUE_TIMEOUT_SECONDS", "5")),
+    }
+
+    # Admission Control Configuration (rate limiting and load shedding)
+    # Requests are matched to the first route class whose rule fits
+    # ("METHOD /path", "*" for any method, trailing "*" for a prefix); anything
+    # else is "default". Per class, per client (user id or IP):
+    #   RATE_PER_SECOND / BURST  token bucket (RATE 0 = unlimited) -> 429
+    #   MAX_CONCURRENT           in-flight cap on this worker (0 = none) -> 503
+    #   PRIORITY                 0 critical (never shed), 1 normal, 2 low
+    ADMISSION_CONFIG = {
+        'ENABLED': os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true",
+        'MAX_TRACKED_CLIENTS': int(os.getenv("ADMISSION_MAX_TRACKED_CLIENTS", "100000")),
+        # Wait this long for a concurrency slot before rejecting
+        'CONCURRENCY_WAIT_SECONDS': float(os.getenv("ADMISSION_CONCURRENCY_WAIT_SECONDS", "0.5")),
+        # Load shedding: low priority first, then normal, by in-flight requests
+        # on this worker or event loop lag
+        'SHED_LOW_PRIORITY_IN_FLIGHT': int(os.getenv("ADMISSION_SHED_LOW_PRIORITY_IN_FLIGHT", "200")),
+        'SHED_NORMAL_PRIORITY_IN_FLIGHT': int(os.getenv("ADMISSION_SHED_NORMAL_PRIORITY_IN_FLIGHT", "400")),
+        'SHED_LOW_PRIORITY_LAG_MS': float(os.getenv("ADMISSION_SHED_LOW_PRIORITY_LAG_MS", "100")),
+        'SHED_NORMAL_PRIORITY_LAG_MS': float(os.getenv("ADMISSION_SHED_NORMAL_PRIORITY_LAG_MS", "300")),
+        'LAG_SAMPLE_INTERVAL_SECONDS': float(os.getenv("ADMISSION_LAG_SAMPLE_INTERVAL_SECONDS", "0.5")),
+        'SHED_RETRY_AFTER_SECONDS': int(os.getenv("ADMISSION_SHED_RETRY_AFTER_SECONDS", "2")),
+        # X-Forwarded-For is only honoured when the peer is one of these proxies
+        # (IPs or CIDRs); the client is the right-most hop that is not a proxy
+        'TRUSTED_PROXIES': [
+            proxy.strip() for proxy in os.getenv(
+                "ADMISSION_TRUSTED_PROXIES", "127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,fc00::/7"
+            ).split(",") if proxy.strip()
+        ],
+        'ROUTE_CLASSES': {
+            'critical': {
+                'RULES': ["GET /api/system/health"],
+                'RATE_PER_SECOND': 0, 'BURST': 0, 'MAX_CONCURRENT': 0, 'PRIORITY': 0,
+            },
+            # Images, thumbnails and video Range requests: many per feed scroll and
+            # sent without a bearer token, so they are not rate limited per IP
+            'media': {
+                'RULES': ["GET /api/uploads/*", "HEAD /api/uploads/*"],
+                'RATE_PER_SECOND': 0, 'BURST': 0, 'MAX_CONCURRENT': 0, 'PRIORITY': 1,
+            },
+            'auth': {
+                'RULES': ["POST /api/auth/*"],
+                'RATE_PER_SECOND': float(os.getenv("ADMISSION_AUTH_RATE", "1")),
+                'BURST': int(os.getenv("ADMISSION_AUTH_BURST", "10")),
+                'MAX_CONCURRENT': 0, 'PRIORITY': 0,
+            },
+            'upload': {
+                'RULES': ["POST /api/upload", "POST /api/audio/upload", "POST /api/stories/upload", "* /api/fast/upload*"],
+                'RATE_PER_SECOND': float(os.getenv("ADMISSION_UPLOAD_RATE", "0.5")),
+                'BURST': int(os.getenv("ADMISSION_UPLOAD_BURST", "10")),
+                'MAX_CONCURRENT': int(os.getenv("ADMISSION_UPLOAD_MAX_CONCURRENT", "8")),
+                'PRIORITY': 2,
+            },
+            'search': {
+                'RULES': ["GET /api/search*", "GET /api/users/search", "GET /api/music/search*", "GET /api/audio/search"],
+                'RATE_PER_SECOND': float(os.getenv("ADMISSION_SEARCH_RATE", "5")),
+                'BURST': int(os.getenv("ADMISSION_SEARCH_BURST", "20")),
+                'MAX_CONCURRENT': int(os.getenv("ADMISSION_SEARCH_MAX_CONCURRENT", "32")),
+                'PRIORITY': 2,
+            },
+            'heavy_read': {
+                'RULES': ["GET /api/polls", "GET /api/users/activity/recent"],
+                'RATE_PER_SECOND': float(os.getenv("ADMISSION_HEAVY_READ_RATE", "5")),
+                'BURST': int(os.getenv("ADMISSION_HEAVY_READ_BURST", "20")),
+                'MAX_CONCURRENT': int(os.getenv("ADMISSION_HEAVY_READ_MAX_CONCURRENT", "64")),
+                'PRIORITY': 1,
+            },
+            'default': {
+                'RULES': [],
+                'RATE_PER_SECOND': float(os.getenv("ADMISSION_DEFAULT_RATE", "20")),
+                'BURST': int(os.getenv("ADMISSION_DEFAULT_BURST", "100")),
+                'MAX_CONCURRENT': 0, 'PRIORITY': 1,
+            },
+        },
+    }
+
+    # iTunes API Client Configuration
+    ITUNES_CONFIG = {
+        'BASE_URL': os.getenv("ITUNES_BASE_URL", "https://itunes.apple.com"),
+        'COUNTRY': os.getenv("ITUNES_COUNTRY", "US"),
+        'TIMEOUT_SECONDS': float(os.getenv("ITUNES_TIMEOUT_SECONDS", "8")),
+        'CONNECT_TIMEOUT_SECONDS': float(os.getenv("ITUNES_CONNECT_TIMEOUT_SECONDS", "3")),
+        # Shared keep-alive pool for the whole process
+        'MAX_CONNECTIONS': int(os.getenv("ITUNES_MAX_CONNECTIONS", "20")),
+        'MAX_KEEPALIVE_CONNECTIONS': int(os.getenv("ITUNES_MAX_KEEPALIVE_CONNECTIONS", "10")),
+        'KEEPALIVE_EXPIRY_SECONDS': float(os.getenv("ITUNES_KEEPALIVE_EXPIRY_SECONDS", "60")),
+        # Ids per lookup?id=a,b,c request
+        'LOOKUP_BATCH_SIZE': int(os.getenv("ITUNES_LOOKUP_BATCH_SIZE", "100")),
+        # Circuit breaker: stop calling iTunes after consecutive failures, retry after the cooldown
+        'BREAKER_FAILURE_THRESHOLD': int(os.getenv("ITUNES_BREAKER_FAILURE_THRESHOLD", "5")),
+        'BREAKER_RESET_SECONDS': float(os.getenv("ITUNES_BREAKER_RESET_SECONDS", "30")),
+    }
+
+    # Music Metadata Cache Configuration (iTunes track info)
+    MUSIC_CACHE_CONFIG = {
+        # Per-worker LRU in front of the `music_metadata` collection
+        'MAX_MEMORY_ENTRIES': int(os.getenv("MUSIC_CACHE_MAX_MEMORY_ENTRIES", "20000")),
+        # Entries older than this are served as-is and refreshed in the background
+        'FRESH_SECONDS': int(os.getenv("MUSIC_CACHE_FRESH_SECONDS", "86400")),
+        # ...up to this age; older entries are refetched before responding
+        'MAX_STALE_SECONDS': int(os.getenv("MUSIC_CACHE_MAX_STALE_SECONDS", "2592000")),
+        # Music ids of active polls/stories loaded at startup
+        'PREWARM_LIMIT': int(os.getenv("MUSIC_CACHE_PREWARM_LIMIT", "5000")),
+    }
+
+    # Real-time (WebSocket) Configuration
+    REALTIME_CONFIG = {
+        # "memory" (single worker) or "redis" (fan-out across workers/instances)
+        'PUBSUB_BACKEND': os.getenv("REALTIME_PUBSUB_BACKEND", "memory"),
+        'REDIS_URL': os.getenv("REALTIME_REDIS_URL", "redis://localhost:6379/0"),
+        'CHANNEL': os.getenv("REALTIME_CHANNEL", "votatok:realtime"),
+        # Extra sockets beyond this per user close the oldest one (tabs/devices)
+        'MAX_CONNECTIONS_PER_USER': int(os.getenv("REALTIME_MAX_CONNECTIONS_PER_USER", "5")),
+        'SEND_TIMEOUT_SECONDS': float(os.getenv("REALTIME_SEND_TIMEOUT_SECONDS", "5")),
+    }
+
     @classmethod
     def create_upload_directories(cls):
         """Create upload directories if they don't exist"""
@@ -0,0 +1,304 @@
+"""
+Trigram Fuzzy Matching Index for VotaTok
+Typo-tolerant user search: candidates are generated by trigram overlap and
+scored with the Dice coefficient (vectorized with NumPy when available),
+replacing per-candidate difflib.SequenceMatcher comparisons.
+
+Benchmark against SequenceMatcher:  python fuzzy_index.py [users]
+"""
+import asyncio
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import config
+from search_index import fold_text
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    print("⚠️  NumPy not available - fuzzy search scoring falls back to pure Python")
+
+SEARCH_CONFIG = config.SEARCH_CONFIG
+
+
+def trigrams(text: str) -> List[str]:
+    """Distinct padded trigrams of folded text ('ana' -> '  a', ' an', 'ana', 'na ')"""
+    folded = " ".join(fold_text(text or "").split())
+    if not folded:
+        return []
+    padded = f"  {folded} "
+    return list(dict.fromkeys(padded[i:i + 3] for i in range(len(padded) - 2)))
+
+
+def trigram_similarity(a: str, b: str) -> float:
+    """Dice coefficient over trigram sets, 0.0 - 1.0"""
+    grams_a, grams_b = set(trigrams(a)), set(trigrams(b))
+    if not grams_a or not grams_b:
+        return 0.0
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+class TrigramIndex:
+    """
+    Trigram postings over (doc_id, text) entries.
+    Entries are interned to ints so postings are compact int arrays;
+    removed entries are tombstoned and reclaimed on the next full rebuild.
+    """
+
+    def __init__(self):
+        self.entry_doc: List[Optional[str]] = []
+        self.entry_size = array("i")
+        self.doc_entries: Dict[str, List[int]] = {}
+        self.postings: Dict[str, array] = {}
+        self._sizes_np = None
+
+    def __len__(self):
+        return len(self.doc_entries)
+
+    def add(self, doc_id: str, texts: Iterable[str]):
+        """Index (or re-index) every text of a document"""
+        if doc_id in self.doc_entries:
+            self.remove(doc_id)
+        entries = []
+        for text in texts:
+            grams = trigrams(text)
+            if not grams:
+                continue
+            entry = len(self.entry_doc)
+            self.entry_doc.append(doc_id)
+            self.entry_size.append(len(grams))
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting is None:
+                    posting = self.postings[gram] = array("i")
+                posting.append(entry)
+            entries.append(entry)
+        if entries:
+            self.doc_entries[doc_id] = entries
+        self._sizes_np = None
+
+    def remove(self, doc_id: str):
+        for entry in self.doc_entries.pop(doc_id, []):
+            self.entry_doc[entry] = None
+            self.entry_size[entry] = 0
+        self._sizes_np = None
+
+    def search(self, query: str, limit: int, min_score: float) -> List[Tuple[str, float]]:
+        """Best (doc_id, similarity) pairs with similarity >= min_score"""
+        query_grams = [gram for gram in trigrams(query) if gram in self.postings]
+        total_grams = len(trigrams(query))
+        if not query_grams or not self.entry_doc:
+            return []
+        # An entry needs this many shared trigrams to possibly reach min_score
+        min_overlap = max(1, int(min_score * total_grams / 2))
+
+        if NUMPY_AVAILABLE:
+            scored = self._score_numpy(query_grams, total_grams, min_overlap, min_score)
+        else:
+            scored = self._score_python(query_grams, total_grams, min_overlap, min_score)
+
+        best: Dict[str, float] = {}
+        for entry, score in scored:
+            doc_id = self.entry_doc[entry]
+            if doc_id is not None and score > best.get(doc_id, 0.0):
+                best[doc_id] = score
+        return sorted(best.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def _score_numpy(self, query_grams, total_grams, min_overlap, min_score):
+        if self._sizes_np is None:
+            self._sizes_np = np.frombuffer(self.entry_size, dtype=np.int32).copy()
+        hits = np.concatenate([np.frombuffer(self.postings[gram], dtype=np.int32) for gram in query_grams])
+        overlap = np.bincount(hits, minlength=len(self._sizes_np))
+        candidates = np.nonzero(overlap >= min_overlap)[0]
+        if candidates.size == 0:
+            return []
+        sizes = self._sizes_np[candidates]
+        scores = 2.0 * overlap[candidates] / (total_grams + sizes)
+        keep = (scores >= min_score) & (sizes > 0)
+        candidates, scores = candidates[keep], scores[keep]
+        cap = SEARCH_CONFIG['MAX_FUZZY_RESULTS'] * 2
+        if candidates.size > cap:
+            top = np.argpartition(scores, -cap)[-cap:]
+            candidates, scores = candidates[top], scores[top]
+        return zip(candidates.tolist(), scores.tolist())
+
+    def _score_python(self, query_grams, total_grams, min_overlap, min_score):
+        overlap: Dict[int, int] = {}
+        for gram in query_grams:
+            for entry in self.postings[gram]:
+                overlap[entry] = overlap.get(entry, 0) + 1
+        scored = []
+        for entry, shared in overlap.items():
+            size = self.entry_size[entry]
+            if shared < min_overlap or size == 0:
+                continue
+            score = 2.0 * shared / (total_grams + size)
+            if score >= min_score:
+                scored.append((entry, score))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:SEARCH_CONFIG['MAX_FUZZY_RESULTS'] * 2]
+
+
+class FuzzyUserIndex:
+    """Trigram index over usernames and display names, built lazily from MongoDB"""
+
+    def __init__(self, db):
+        self.db = db
+        self.index = TrigramIndex()
+        self.built_at: Optional[datetime] = None
+        self.builds = 0  # Completed builds; concurrent build() calls share one
+        self._build_lock = asyncio.Lock()
+        self._rebuild_task: Optional[asyncio.Task] = None
+        # Writes arriving while a rebuild is running, replayed before the swap
+        self._pending_ops: Optional[List[Tuple[str, Optional[Dict]]]] = None
+
+    async def build(self):
+        """Full rebuild; the previous index keeps serving until the swap"""
+        builds_seen = self.builds
+        async with self._build_lock:
+            if self.builds != builds_seen:
+                return  # Built by another caller while this one waited for the lock
+            started = datetime.utcnow()
+            self._pending_ops = []
+            try:
+                index = TrigramIndex()
+                batch_size = SEARCH_CONFIG['INDEX_BUILD_BATCH_SIZE']
+                projection = {"_id": 0, "id": 1, "username": 1, "display_name": 1}
+                count = 0
+                async for user in self.db.users.find({}, projection).batch_size(batch_size):
+                    if user.get("id"):
+                        index.add(user["id"], [user.get("username"), user.get("display_name")])
+                    count += 1
+                    if count % batch_size == 0:
+                        await asyncio.sleep(0)  # Yield to request handlers
+
+                for user_id, user in self._pending_ops:
+                    if user is None:
+                        index.remove(user_id)
+                    else:
+                        index.add(user_id, [user.get("username"), user.get("display_name")])
+
+                self.index = index
+                self.built_at = started
+                self.builds += 1
+                print(f"🔡 Fuzzy user index built: users={len(index)}, trigrams={len(index.postings)}")
+            finally:
+                self._pending_ops = None
+
+    async def ensure_ready(self) -> bool:
+        """Build on first use, refresh in background once stale"""
+        if self.built_at is None:
+            try:
+                await self.build()
+            except Exception as e:
+                print(f"❌ Fuzzy user index build failed: {str(e)}")
+                return False
+            return True
+
+        age = (datetime.utcnow() - self.built_at).total_seconds()
+        if age > SEARCH_CONFIG['INDEX_REBUILD_INTERVAL_SECONDS'] and (
+            self._rebuild_task is None or self._rebuild_task.done()
+        ):
+            self._rebuild_task = asyncio.create_task(self.build())
+        return True
+
+    async def search(self, query: str, limit: int) -> Optional[List[Tuple[str, float]]]:
+        """(user_id, similarity) pairs above MIN_RELEVANCE_SCORE, or None when unavailable"""
+        if not await self.ensure_ready():
+            return None
+        limit = min(limit, SEARCH_CONFIG['MAX_FUZZY_RESULTS'])
+        return self.index.search(query.lstrip("@"), limit, SEARCH_CONFIG['MIN_RELEVANCE_SCORE'])
+
+    def upsert(self, user: Dict):
+        if not user or not user.get("id"):
+            return
+        if self._pending_ops is not None:
+            self._pending_ops.append((user["id"], user))
+        self.index.add(user["id"], [user.get("username"), user.get("display_name")])
+
+    def remove(self, user_id: str):
+        if self._pending_ops is not None:
+            self._pending_ops.append((user_id, None))
+        self.index.remove(user_id)
+
+    def get_stats(self) -> Dict:
+        return {
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+            "users": len(self.index),
+            "trigrams": len(self.index.postings),
+            "vectorized": NUMPY_AVAILABLE
+        }
+
+
+# Global instance
+fuzzy_user_index = None
+
+
+def init_fuzzy_user_index(db):
+    """Initialize fuzzy user index (built lazily on first fuzzy search)"""
+    global fuzzy_user_index
+    fuzzy_user_index = FuzzyUserIndex(db)
+    return fuzzy_user_index
+
+
+def _benchmark(user_count: int = 100_000, queries: int = 20):
+    """Compare trigram index lookups with the SequenceMatcher scan it replaces"""
+    import random
+    import string
+    import time
+    from difflib import SequenceMatcher
+
+    random.seed(7)
+    syllables = ["ma", "ri", "an", "to", "lu", "ca", "se", "bas", "vi", "lla", "go", "mez", "ne", "ro"]
+
+    def fake_name():
+        return "".join(random.choices(syllables, k=random.randint(2, 4)))
+
+    users = [
+        (str(i), fake_name() + str(random.randint(0, 999)), f"{fake_name().title()} {fake_name().title()}")
+        for i in range(user_count)
+    ]
+    probes = []
+    for _, username, _ in random.sample(users, queries):
+        typo = list(username)
+        typo[random.randrange(len(typo))] = random.choice(string.ascii_lowercase)
+        probes.append("".join(typo))
+
+    index = TrigramIndex()
+    started = time.perf_counter()
+    for user_id, username, display_name in users:
+        index.add(user_id, [username, display_name])
+    build_time = time.perf_counter() - started
+
+    limit = SEARCH_CONFIG['MAX_FUZZY_RESULTS']
+    min_score = SEARCH_CONFIG['MIN_RELEVANCE_SCORE']
+
+    started = time.perf_counter()
+    for probe in probes:
+        index.search(probe, limit, min_score)
+    trigram_time = (time.perf_counter() - started) / len(probes)
+
+    sample = probes[:3]
+    started = time.perf_counter()
+    for probe in sample:
+        scored = [
+            (user_id, max(SequenceMatcher(None, probe, username.lower()).ratio(),
+                          SequenceMatcher(None, probe, display_name.lower()).ratio()))
+            for user_id, username, display_name in users
+        ]
+        sorted(scored, key=lambda item: item[1], reverse=True)[:limit]
+    sequence_time = (time.perf_counter() - started) / len(sample)
+
+    print(f"users={user_count} numpy={NUMPY_AVAILABLE}")
+    print(f"trigram index build: {build_time:.2f}s")
+    print(f"trigram search:      {trigram_time * 1000:.2f} ms/query")
+    print(f"SequenceMatcher:     {sequence_time * 1000:.2f} ms/query")
+    print(f"speedup:             {sequence_time / trigram_time:.0f}x")
+
+
+if __name__ == "__main__":
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
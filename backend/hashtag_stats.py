@@ -0,0 +1,277 @@
+"""
+Materialized Hashtag Statistics for VotaTok
+Maintains a `hashtags` collection (post counts, last use, rolling 1h/24h/7d
+counts) on poll writes, so trending hashtags and suggestions are indexed
+top-K reads instead of re-parsing recent polls on every request.
+"""
+import asyncio
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from config import config
+from search_index import extract_poll_hashtags, fold_text
+
+# Rolling windows: name -> length
+WINDOWS = {
+    "1h": timedelta(hours=1),
+    "24h": timedelta(hours=24),
+    "7d": timedelta(days=7),
+}
+WINDOW_FIELDS = {name: f"count_{name}" for name in WINDOWS}
+
+# Hourly buckets are kept a little longer than the largest window
+BUCKET_RETENTION_SECONDS = int((WINDOWS["7d"] + timedelta(days=1)).total_seconds())
+
+# Writes per bulk_write during the one-time backfill
+BACKFILL_BATCH_SIZE = 500
+
+# Marker in `hashtag_stats_meta`; the worker that inserts it runs the backfill
+BACKFILL_MARKER = "backfill"
+
+# An unfinished marker older than this is an abandoned run (process killed) and is reclaimed
+BACKFILL_LEASE_SECONDS = 3600
+
+
+def hour_bucket(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.rstrip("Z"))
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+
+class HashtagStats:
+    """
+    `hashtags`: one document per folded tag
+        {tag, display, count, last_used_at, count_1h, count_24h, count_7d}
+    `hashtag_usage_hourly`: {tag, hour, count} buckets feeding the rolling windows
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.refreshed_at: Optional[datetime] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def initialize_indexes(self):
+        await self.db.hashtags.create_index([("tag", 1)], unique=True, name="hashtag_tag")
+        for field in ["count", *WINDOW_FIELDS.values()]:
+            await self.db.hashtags.create_index([(field, -1)], name=f"hashtag_{field}")
+        await self.db.hashtag_usage_hourly.create_index([("tag", 1), ("hour", 1)], unique=True, name="hashtag_hour")
+        await self.db.hashtag_usage_hourly.create_index(
+            [("hour", 1)], expireAfterSeconds=BUCKET_RETENTION_SECONDS, name="hashtag_hour_ttl"
+        )
+
+    # ---- write path ----
+
+    async def record_poll(self, old_poll: Optional[Dict], new_poll: Optional[Dict]):
+        """Apply the hashtag delta of a created (old=None), edited or deleted (new=None) poll"""
+        old_tags = extract_poll_hashtags(old_poll) if old_poll else {}
+        new_tags = extract_poll_hashtags(new_poll) if new_poll else {}
+        deltas = {term: -1 for term in old_tags.keys() - new_tags.keys()}
+        deltas.update({term: 1 for term in new_tags.keys() - old_tags.keys()})
+        if not deltas:
+            return
+
+        poll = new_poll or old_poll
+        used_at = _as_datetime(poll.get("created_at"))
+        now = datetime.utcnow()
+        in_windows = [field for name, field in WINDOW_FIELDS.items() if now - used_at <= WINDOWS[name]]
+
+        tag_ops, bucket_ops = [], []
+        for term, delta in deltas.items():
+            inc = {"count": delta, **{field: delta for field in in_windows}}
+            update = {"$inc": inc}
+            if delta > 0:
+                update["$setOnInsert"] = {"display": new_tags[term], "created_at": now}
+                update["$max"] = {"last_used_at": used_at}
+            tag_ops.append(UpdateOne({"tag": term}, update, upsert=delta > 0))
+            if now - used_at <= WINDOWS["7d"]:
+                bucket_ops.append(UpdateOne(
+                    {"tag": term, "hour": hour_bucket(used_at)},
+                    {"$inc": {"count": delta}},
+                    upsert=delta > 0
+                ))
+
+        await self.db.hashtags.bulk_write(tag_ops, ordered=False)
+        if bucket_ops:
+            await self.db.hashtag_usage_hourly.bulk_write(bucket_ops, ordered=False)
+
+    # ---- rolling windows ----
+
+    async def refresh_windows(self):
+        """Recompute rolling window counts from hourly buckets (decays old usage)"""
+        now = datetime.utcnow()
+        pipeline = [
+            {"$match": {"hour": {"$gte": hour_bucket(now - WINDOWS["7d"])}}},
+            {"$group": {
+                "_id": "$tag",
+                **{
+                    field: {"$sum": {"$cond": [
+                        {"$gte": ["$hour", hour_bucket(now - WINDOWS[name])]}, "$count", 0
+                    ]}}
+                    for name, field in WINDOW_FIELDS.items()
+                }
+            }}
+        ]
+        windows = await self.db.hashtag_usage_hourly.aggregate(pipeline).to_list(None)
+
+        active = [doc["_id"] for doc in windows]
+        ops = [
+            UpdateOne({"tag": doc["_id"]}, {"$set": {field: max(doc[field], 0) for field in WINDOW_FIELDS.values()}})
+            for doc in windows
+        ]
+        if ops:
+            await self.db.hashtags.bulk_write(ops, ordered=False)
+
+        # Tags with no usage left in any window drop to zero
+        await self.db.hashtags.update_many(
+            {"tag": {"$nin": active}, WINDOW_FIELDS["7d"]: {"$ne": 0}},
+            {"$set": {field: 0 for field in WINDOW_FIELDS.values()}}
+        )
+        self.refreshed_at = now
+
+    async def run_refresh_loop(self):
+        """Background loop keeping window counts decayed"""
+        interval = config.SEARCH_CONFIG['HASHTAG_WINDOW_REFRESH_SECONDS']
+        while True:
+            try:
+                await self.refresh_windows()
+            except Exception as e:
+                print(f"❌ Hashtag window refresh failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def backfill_if_empty(self):
+        """
+        One-time population from existing polls. Only the worker that inserts the
+        backfill marker runs it, and totals are written with $set, so a rerun
+        recomputes instead of double counting. A run that never completed is
+        claimed again by one worker once its lease expires.
+        """
+        now = datetime.utcnow()
+        try:
+            await self.db.hashtag_stats_meta.insert_one(
+                {"_id": BACKFILL_MARKER, "started_at": now, "completed_at": None}
+            )
+        except DuplicateKeyError:
+            claimed = await self.db.hashtag_stats_meta.find_one_and_update(
+                {
+                    "_id": BACKFILL_MARKER,
+                    "completed_at": None,
+                    "started_at": {"$lt": now - timedelta(seconds=BACKFILL_LEASE_SECONDS)}
+                },
+                {"$set": {"started_at": now}}
+            )
+            if claimed is None:
+                return  # Completed, or still running within its lease
+            print("🏷️ Previous hashtag backfill did not complete - running it again")
+        else:
+            if await self.db.hashtags.estimated_document_count() > 0:
+                # Populated before the marker existed
+                await self._mark_backfilled()
+                return
+
+        print("🏷️ Backfilling hashtag statistics from existing polls...")
+        try:
+            await self._backfill()
+        except Exception:
+            # Let the next startup retry
+            await self.db.hashtag_stats_meta.delete_one({"_id": BACKFILL_MARKER})
+            raise
+
+    async def _backfill(self):
+        now = datetime.utcnow()
+        tags: Dict[str, Dict] = {}
+        buckets: Dict[tuple, int] = {}
+        projection = {"_id": 0, "title": 1, "description": 1, "content": 1, "tags": 1, "created_at": 1}
+        count = 0
+        async for poll in self.db.polls.find({}, projection):
+            used_at = _as_datetime(poll.get("created_at"))
+            for term, display in extract_poll_hashtags(poll).items():
+                stats = tags.setdefault(term, {
+                    "display": display, "count": 0, "last_used_at": used_at,
+                    **{field: 0 for field in WINDOW_FIELDS.values()}
+                })
+                stats["count"] += 1
+                stats["last_used_at"] = max(stats["last_used_at"], used_at)
+                for name, field in WINDOW_FIELDS.items():
+                    if now - used_at <= WINDOWS[name]:
+                        stats[field] += 1
+                if now - used_at <= WINDOWS["7d"]:
+                    key = (term, hour_bucket(used_at))
+                    buckets[key] = buckets.get(key, 0) + 1
+            count += 1
+            if count % BACKFILL_BATCH_SIZE == 0:
+                await asyncio.sleep(0)  # Yield to request handlers
+
+        tag_ops = [
+            UpdateOne(
+                {"tag": term},
+                {"$set": {key: value for key, value in stats.items() if key != "display"},
+                 "$setOnInsert": {"display": stats["display"], "created_at": now}},
+                upsert=True
+            )
+            for term, stats in tags.items()
+        ]
+        bucket_ops = [
+            UpdateOne({"tag": term, "hour": hour}, {"$set": {"count": total}}, upsert=True)
+            for (term, hour), total in buckets.items()
+        ]
+        for collection, ops in ((self.db.hashtags, tag_ops), (self.db.hashtag_usage_hourly, bucket_ops)):
+            for start in range(0, len(ops), BACKFILL_BATCH_SIZE):
+                await collection.bulk_write(ops[start:start + BACKFILL_BATCH_SIZE], ordered=False)
+        await self._mark_backfilled()
+        print(f"✅ Hashtag statistics backfilled from {count} polls ({len(tags)} hashtags)")
+
+    async def _mark_backfilled(self):
+        await self.db.hashtag_stats_meta.update_one(
+            {"_id": BACKFILL_MARKER}, {"$set": {"completed_at": datetime.utcnow()}}
+        )
+
+    async def start(self):
+        """Indexes, backfill and the window refresh loop"""
+        await self.initialize_indexes()
+        await self.backfill_if_empty()
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.run_refresh_loop())
+
+    # ---- reads ----
+
+    async def top(self, window: str = "24h", limit: int = 10) -> List[Dict]:
+        """Trending hashtags by rolling window ('1h', '24h', '7d') or all-time ('all')"""
+        field = WINDOW_FIELDS.get(window, "count")
+        cursor = self.db.hashtags.find(
+            {field: {"$gt": 0}},
+            {"_id": 0, "tag": 1, "display": 1, "count": 1, "last_used_at": 1, **{f: 1 for f in WINDOW_FIELDS.values()}}
+        ).sort(field, -1).limit(limit)
+        return await cursor.to_list(limit)
+
+    async def suggest(self, prefix: str, limit: int = 10) -> List[Dict]:
+        """Most used hashtags starting with prefix (anchored regex is bounded by the tag index)"""
+        folded = "#" + fold_text(prefix).lstrip("#")
+        cursor = self.db.hashtags.find(
+            {"tag": {"$regex": f"^{re.escape(folded)}"}, "count": {"$gt": 0}},
+            {"_id": 0, "tag": 1, "display": 1, "count": 1}
+        ).sort("count", -1).limit(limit)
+        return await cursor.to_list(limit)
+
+
+# Global instance
+hashtag_stats = None
+
+
+def init_hashtag_stats(db):
+    """Initialize hashtag statistics (indexes/backfill run at startup)"""
+    global hashtag_stats
+    hashtag_stats = HashtagStats(db)
+    return hashtag_stats
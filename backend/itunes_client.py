@@ -0,0 +1,209 @@
+"""
+iTunes API Client for VotaTok
+One process-wide httpx client (keep-alive pool, timeouts) for the iTunes Search
+and Lookup APIs, behind a circuit breaker so an iTunes outage fails fast
+instead of stalling feed requests. Track lookups are coalesced: concurrent
+callers asking for the same id share one in-flight request, and ids are
+fetched together with the multi-id `lookup?id=a,b,c` form.
+"""
+import asyncio
+import json
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+import httpx
+
+from config import config
+
+ITUNES_CONFIG = config.ITUNES_CONFIG
+
+
+class ITunesUnavailable(Exception):
+    """The circuit breaker is open (iTunes failing); no request was made"""
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half_open (one trial) after the cooldown"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+            self._trial_in_flight = False
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        """The trial request ended without an outcome (cancelled); let the next caller try"""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                print(f"⚠️  iTunes circuit breaker open ({self.failures} consecutive failures)")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+def _parse_body(text: str) -> Dict:
+    """JSON body, unwrapping a JSONP callback if iTunes sent one"""
+    text = text.strip()
+    if not text.startswith("{"):
+        start, end = text.find("{"), text.rfind("}") + 1
+        if start >= 0 and end > start:
+            text = text[start:end]
+    return json.loads(text)
+
+
+class ITunesClient:
+    """Shared iTunes HTTP client with circuit breaker and coalesced lookups"""
+
+    def __init__(self, settings: Dict = ITUNES_CONFIG, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.settings = settings
+        self.transport = transport  # Tests pass an httpx.MockTransport
+        self.breaker = CircuitBreaker(settings['BREAKER_FAILURE_THRESHOLD'], settings['BREAKER_RESET_SECONDS'])
+        self._client: Optional[httpx.AsyncClient] = None
+        # track id -> future resolved with its lookup result (or None)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._fetch_tasks: Set[asyncio.Task] = set()
+        self.requests = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self.coalesced = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.settings['BASE_URL'],
+                timeout=httpx.Timeout(self.settings['TIMEOUT_SECONDS'], connect=self.settings['CONNECT_TIMEOUT_SECONDS']),
+                limits=httpx.Limits(
+                    max_connections=self.settings['MAX_CONNECTIONS'],
+                    max_keepalive_connections=self.settings['MAX_KEEPALIVE_CONNECTIONS'],
+                    keepalive_expiry=self.settings['KEEPALIVE_EXPIRY_SECONDS']
+                ),
+                transport=self.transport
+            )
+        return self._client
+
+    async def _get(self, path: str, params: Dict) -> Dict:
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            raise ITunesUnavailable("iTunes temporarily unavailable")
+        self.requests += 1
+        try:
+            response = await self.client.get(path, params=params)
+            # 403/429 are iTunes throttling us; count them with 5xx as failures
+            if response.status_code >= 500 or response.status_code in (403, 429):
+                response.raise_for_status()
+        except asyncio.CancelledError:
+            # Not a failure of iTunes, but a half-open trial must not stay claimed forever
+            self.breaker.release_trial()
+            raise
+        except Exception:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        response.raise_for_status()
+        return _parse_body(response.text)
+
+    async def search(self, term: str, limit: int = 20, country: Optional[str] = None) -> List[Dict]:
+        """Song results for a free-text term"""
+        data = await self._get("/search", {
+            'term': term,
+            'media': 'music',
+            'entity': 'song',
+            'limit': limit,
+            'country': country or self.settings['COUNTRY']
+        })
+        return data.get('results', [])
+
+    async def _fetch_lookup(self, track_ids: List[str]):
+        """One lookup?id=a,b,c request; resolves every id's future, None when not found or on error"""
+        found: Dict[str, Dict] = {}
+        try:
+            data = await self._get("/lookup", {'id': ",".join(track_ids)})
+            for result in data.get('results', []):
+                if result.get('trackId') is not None:
+                    found[str(result['trackId'])] = result
+        except ITunesUnavailable:
+            pass
+        except Exception as e:
+            print(f"❌ iTunes lookup failed for {len(track_ids)} ids: {str(e)}")
+        finally:
+            for track_id in track_ids:
+                future = self._in_flight.pop(track_id, None)
+                if future is not None and not future.done():
+                    future.set_result(found.get(track_id))
+
+    async def lookup_many(self, track_ids: Iterable[str]) -> Dict[str, Dict]:
+        """track id -> iTunes result for the ids that exist; ids already being fetched are shared"""
+        loop = asyncio.get_running_loop()
+        waiting: Dict[str, asyncio.Future] = {}
+        to_fetch: List[str] = []
+        for track_id in dict.fromkeys(str(track_id) for track_id in track_ids if track_id):
+            future = self._in_flight.get(track_id)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                future = self._in_flight[track_id] = loop.create_future()
+                to_fetch.append(track_id)
+            waiting[track_id] = future
+
+        # Fetch in tasks so a cancelled caller does not strand the callers sharing its request
+        batch_size = self.settings['LOOKUP_BATCH_SIZE']
+        for start in range(0, len(to_fetch), batch_size):
+            task = asyncio.create_task(self._fetch_lookup(to_fetch[start:start + batch_size]))
+            self._fetch_tasks.add(task)
+            task.add_done_callback(self._fetch_tasks.discard)
+
+        results = await asyncio.gather(*(asyncio.shield(future) for future in waiting.values()))
+        return {track_id: result for track_id, result in zip(waiting, results) if result}
+
+    async def lookup(self, track_id: str) -> Optional[Dict]:
+        return (await self.lookup_many([track_id])).get(str(track_id))
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def get_stats(self) -> Dict:
+        return {
+            "breaker_state": self.breaker.state,
+            "requests": self.requests,
+            "failures": self.failures,
+            "short_circuited": self.short_circuited,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight)
+        }
+
+
+# Global instance
+itunes_client = None
+
+
+def init_itunes_client():
+    """Initialize the shared iTunes client (HTTP pool opened on first request)"""
+    global itunes_client
+    itunes_client = ITunesClient()
+    return itunes_client
@@ -0,0 +1,225 @@
+"""
+Login Throttling for VotaTok
+Failed logins are counted in sliding windows keyed by email and by IP, held in
+memory (per worker) or in Redis sorted sets (shared), so the login path no
+longer runs count_documents over `login_attempts`. Attempts are still audited
+to `login_attempts`, by a background writer that inserts them in batches.
+"""
+import asyncio
+import bisect
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional
+
+from config import config
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+LOGIN_RATE_LIMIT_CONFIG = config.LOGIN_RATE_LIMIT_CONFIG
+
+
+class InMemorySlidingWindow:
+    """Per-key timestamps of recent events, trimmed to the window on access"""
+
+    name = "memory"
+
+    def __init__(self, window_seconds: int, max_keys: int):
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self.events: "OrderedDict[str, Deque[float]]" = OrderedDict()
+
+    def _trim(self, key: str, now: float) -> Optional[Deque[float]]:
+        events = self.events.get(key)
+        if events is None:
+            return None
+        horizon = now - self.window_seconds
+        while events and events[0] <= horizon:
+            events.popleft()
+        if not events:
+            del self.events[key]
+            return None
+        return events
+
+    async def add(self, key: str, timestamp: Optional[float] = None):
+        now = time.time()
+        timestamp = timestamp if timestamp is not None else now
+        if timestamp <= now - self.window_seconds:
+            return  # Already outside the window
+        events = self._trim(key, now)
+        if events is None:
+            events = self.events[key] = deque()
+        if events and timestamp < events[-1]:
+            # Older event (audit warm-up racing live failures): keep the deque sorted for _trim
+            events.insert(bisect.bisect_right(events, timestamp), timestamp)
+        else:
+            events.append(timestamp)
+        self.events.move_to_end(key)
+        while len(self.events) > self.max_keys:
+            self.events.popitem(last=False)
+
+    async def count(self, key: str) -> int:
+        events = self._trim(key, time.time())
+        return len(events) if events else 0
+
+    def tracked_keys(self) -> int:
+        return len(self.events)
+
+
+class RedisSlidingWindow:
+    """Sorted set per key (score = timestamp), shared by every worker"""
+
+    name = "redis"
+
+    def __init__(self, url: str, window_seconds: int, prefix: str = "votatok:login:"):
+        self.redis = aioredis.from_url(url)
+        self.window_seconds = window_seconds
+        self.prefix = prefix
+
+    async def add(self, key: str, timestamp: Optional[float] = None):
+        now = timestamp if timestamp is not None else time.time()
+        redis_key = self.prefix + key
+        pipe = self.redis.pipeline()
+        pipe.zadd(redis_key, {f"{now}:{uuid.uuid4().hex}": now})
+        pipe.zremrangebyscore(redis_key, 0, time.time() - self.window_seconds)
+        pipe.expire(redis_key, self.window_seconds)
+        await pipe.execute()
+
+    async def count(self, key: str) -> int:
+        return await self.redis.zcount(self.prefix + key, time.time() - self.window_seconds, "+inf")
+
+    def tracked_keys(self) -> int:
+        return -1  # Not tracked locally
+
+
+def create_window_backend():
+    """Backend named by LOGIN_RATE_LIMIT_CONFIG['BACKEND'], in-memory when unavailable"""
+    window = LOGIN_RATE_LIMIT_CONFIG['WINDOW_SECONDS']
+    if LOGIN_RATE_LIMIT_CONFIG['BACKEND'] == "redis":
+        if REDIS_AVAILABLE:
+            return RedisSlidingWindow(LOGIN_RATE_LIMIT_CONFIG['REDIS_URL'], window)
+        print("⚠️  redis not available - login rate limits are tracked per worker")
+    return InMemorySlidingWindow(window, LOGIN_RATE_LIMIT_CONFIG['MAX_TRACKED_KEYS'])
+
+
+class LoginGuard:
+    """Sliding-window failure limits per email / IP plus the batched login audit writer"""
+
+    def __init__(self, db, backend=None):
+        self.db = db
+        self.backend = backend or create_window_backend()
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self.blocked = 0
+        self.audited = 0
+        self.dropped = 0
+
+    # ---- rate limiting ----
+
+    async def allowed(self, email: str, ip_address: str) -> bool:
+        """True while both the email and the IP are under their failure limits"""
+        email_failures, ip_failures = await asyncio.gather(
+            self.backend.count(f"email:{email.lower()}"),
+            self.backend.count(f"ip:{ip_address}")
+        )
+        allowed = (
+            email_failures < LOGIN_RATE_LIMIT_CONFIG['MAX_FAILURES_PER_EMAIL']
+            and ip_failures < LOGIN_RATE_LIMIT_CONFIG['MAX_FAILURES_PER_IP']
+        )
+        if not allowed:
+            self.blocked += 1
+        return allowed
+
+    async def record_failure(self, email: str, ip_address: str, timestamp: Optional[float] = None):
+        await asyncio.gather(
+            self.backend.add(f"email:{email.lower()}", timestamp),
+            self.backend.add(f"ip:{ip_address}", timestamp)
+        )
+
+    # ---- audit trail ----
+
+    def _ensure_writer(self):
+        if self._writer_task is None or self._writer_task.done():
+            self._queue = self._queue or asyncio.Queue(maxsize=LOGIN_RATE_LIMIT_CONFIG['AUDIT_QUEUE_MAX_SIZE'])
+            self._writer_task = asyncio.create_task(self._run_writer())
+
+    def audit(self, attempt: Dict):
+        """Queue a login_attempts document; never blocks the login"""
+        try:
+            self._ensure_writer()
+            self._queue.put_nowait(attempt)
+        except asyncio.QueueFull:
+            self.dropped += 1
+        except RuntimeError:
+            self.dropped += 1  # No running event loop
+
+    async def _run_writer(self):
+        batch_size = LOGIN_RATE_LIMIT_CONFIG['AUDIT_BATCH_SIZE']
+        while True:
+            attempts: List[Dict] = [await self._queue.get()]
+            while len(attempts) < batch_size and not self._queue.empty():
+                attempts.append(self._queue.get_nowait())
+            try:
+                await self.db.login_attempts.insert_many(attempts, ordered=False)
+                self.audited += len(attempts)
+            except Exception as e:
+                print(f"❌ Login audit batch write failed ({len(attempts)} attempts): {str(e)}")
+            finally:
+                for _ in attempts:
+                    self._queue.task_done()
+
+    async def flush(self):
+        """Wait until queued attempts are written (shutdown, tests)"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    # ---- startup ----
+
+    async def initialize_indexes(self):
+        await self.db.login_attempts.create_index([("email", 1), ("created_at", -1)], name="login_attempts_email")
+        # Recent failures for warm_from_audit, without scanning the whole audit trail
+        await self.db.login_attempts.create_index([("success", 1), ("created_at", 1)], name="login_attempts_failures")
+
+    async def warm_from_audit(self):
+        """Seed in-memory windows with failures already in the audit trail (restarts)"""
+        if self.backend.name != "memory":
+            return
+        since = datetime.utcnow() - timedelta(seconds=LOGIN_RATE_LIMIT_CONFIG['WINDOW_SECONDS'])
+        async for attempt in self.db.login_attempts.find(
+            {"success": False, "created_at": {"$gte": since}},
+            {"_id": 0, "email": 1, "ip_address": 1, "created_at": 1}
+        ).sort("created_at", 1):
+            # created_at is naive UTC
+            timestamp = (attempt["created_at"] - datetime(1970, 1, 1)).total_seconds()
+            await self.record_failure(attempt["email"], attempt["ip_address"], timestamp)
+
+    async def start(self):
+        await self.initialize_indexes()
+        await self.warm_from_audit()
+        self._ensure_writer()
+
+    def get_stats(self) -> Dict:
+        return {
+            "backend": self.backend.name,
+            "tracked_keys": self.backend.tracked_keys(),
+            "blocked": self.blocked,
+            "audit_queued": self._queue.qsize() if self._queue else 0,
+            "audited": self.audited,
+            "audit_dropped": self.dropped
+        }
+
+
+# Global instance
+login_guard = None
+
+
+def init_login_guard(db):
+    """Initialize login throttling (windows warmed and audit writer started at startup)"""
+    global login_guard
+    login_guard = LoginGuard(db)
+    return login_guard
@@ -0,0 +1,304 @@
+"""
+Messaging Queries for VotaTok
+Conversation inbox with keyset (last_message_at, id) cursors. Conversations and
+pending chat requests are fetched concurrently and every counterpart user is
+resolved in a single batched query. Message history pages backwards on
+(created_at, id) with participants hydrated once per conversation.
+Total unread messages per user live in one `unread_counters` document.
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from pymongo import ReturnDocument
+
+from social_graph import PRIVATE_USER_FIELDS, decode_cursor, encode_cursor
+
+# Inbox page size bounds
+CONVERSATIONS_DEFAULT_LIMIT = 50
+CONVERSATIONS_MAX_LIMIT = 100
+
+# Pending chat requests sent by the user (shown on the first inbox page only)
+PENDING_REQUESTS_LIMIT = 50
+
+# Message history page size bounds
+MESSAGES_DEFAULT_LIMIT = 50
+MESSAGES_MAX_LIMIT = 200
+
+# Unread counters: per-worker read cache and background reconciliation
+UNREAD_CACHE_TTL_SECONDS = 30
+UNREAD_CACHE_MAX_ENTRIES = 50000
+UNREAD_RECONCILE_INTERVAL_SECONDS = 900
+
+
+class UnreadCounters:
+    """
+    `unread_counters`: {user_id, total, updated_at}, one document per user.
+    Kept in step with conversations.unread_count by atomic $inc on send / read;
+    users touched since the last pass are recomputed from their conversations
+    in the background, which also repairs drift from failed partial writes.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        # user_id -> (expires_at, total); writes on this worker update it in place
+        self._cache: Dict[str, Tuple[float, int]] = {}
+        self._touched: Set[str] = set()
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self.reconciled = 0
+
+    async def initialize_indexes(self):
+        await self.db.unread_counters.create_index("user_id", unique=True, name="unread_user")
+
+    def _remember(self, user_id: str, total: int):
+        if len(self._cache) >= UNREAD_CACHE_MAX_ENTRIES:
+            self._cache.clear()
+        self._cache[user_id] = (time.monotonic() + UNREAD_CACHE_TTL_SECONDS, total)
+
+    async def increment(self, user_id: str, amount: int = 1) -> int:
+        """
+        Atomically add to the user's total; returns the new total. Called after
+        the conversation's unread_count was updated, so a user without a counter
+        yet is seeded from their conversations (which already include the change).
+        """
+        counter = await self.db.unread_counters.find_one_and_update(
+            {"user_id": user_id},
+            {"$inc": {"total": amount}, "$set": {"updated_at": datetime.utcnow()}},
+            projection={"_id": 0, "total": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        self._touched.add(user_id)
+        if counter is None:
+            return await self.reconcile_user(user_id)
+        total = max(0, counter["total"])
+        self._remember(user_id, total)
+        return total
+
+    async def get(self, user_id: str) -> int:
+        """Total unread messages: cache hit or one point lookup"""
+        cached = self._cache.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        counter = await self.db.unread_counters.find_one({"user_id": user_id}, {"_id": 0, "total": 1})
+        if counter is None:
+            # First read for this user: seed from conversations
+            return await self.reconcile_user(user_id)
+        total = max(0, counter["total"])
+        self._remember(user_id, total)
+        return total
+
+    async def reconcile_user(self, user_id: str) -> int:
+        """Recompute the total from the user's conversations"""
+        rows = await self.db.conversations.aggregate([
+            {"$match": {"participants": user_id, "is_active": True}},
+            {"$group": {"_id": None, "total": {"$sum": f"$unread_count.{user_id}"}}}
+        ]).to_list(1)
+        total = rows[0]["total"] if rows else 0
+        await self.db.unread_counters.update_one(
+            {"user_id": user_id},
+            {"$set": {"total": total, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        self._remember(user_id, total)
+        self.reconciled += 1
+        return total
+
+    async def reconcile_touched(self):
+        """Recompute every user written since the previous pass, plus negative totals"""
+        users, self._touched = self._touched, set()
+        async for counter in self.db.unread_counters.find({"total": {"$lt": 0}}, {"_id": 0, "user_id": 1}):
+            users.add(counter["user_id"])
+        for user_id in users:
+            try:
+                await self.reconcile_user(user_id)
+            except Exception as e:
+                self._touched.add(user_id)
+                print(f"⚠️  Unread counter reconciliation failed for {user_id}: {str(e)}")
+            await asyncio.sleep(0)  # Yield to request handlers
+
+    async def _run_reconciler(self):
+        while True:
+            await asyncio.sleep(UNREAD_RECONCILE_INTERVAL_SECONDS)
+            await self.reconcile_touched()
+
+    def start(self):
+        if self._reconcile_task is None or self._reconcile_task.done():
+            self._reconcile_task = asyncio.create_task(self._run_reconciler())
+
+    def get_stats(self) -> Dict:
+        return {
+            "cached_users": len(self._cache),
+            "pending_reconciliation": len(self._touched),
+            "reconciled": self.reconciled
+        }
+
+
+class MessagingQueries:
+    """Read paths for conversations and messages"""
+
+    def __init__(self, db):
+        self.db = db
+        self.unread = UnreadCounters(db)
+
+    async def initialize_indexes(self):
+        await self.db.conversations.create_index(
+            [("participants", 1), ("is_active", 1), ("last_message_at", -1), ("id", -1)],
+            name="conversation_inbox"
+        )
+        await self.db.messages.create_index(
+            [("conversation_id", 1), ("created_at", -1), ("id", -1)], name="conversation_history"
+        )
+        await self.unread.initialize_indexes()
+        await self.db.chat_requests.create_index(
+            [("sender_id", 1), ("status", 1), ("created_at", -1)], name="chat_requests_sent"
+        )
+        # Conversations created before last_message_at was set on creation
+        # sort by their creation time instead of falling out of the keyset order
+        await self.db.conversations.update_many(
+            {"last_message_at": None},
+            [{"$set": {"last_message_at": "$created_at"}}]
+        )
+
+    async def conversations_page(
+        self,
+        user_id: str,
+        limit: int = CONVERSATIONS_DEFAULT_LIMIT,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict], Dict[str, Dict], Optional[str]]:
+        """
+        One inbox page, newest first.
+        Returns (items, users_by_id, next_cursor); items are conversation documents
+        and, on the first page, pending chat requests tagged with "is_chat_request".
+        """
+        query: Dict = {"participants": user_id, "is_active": True}
+        position = decode_cursor(cursor) if cursor else None
+        if position is not None:
+            last_message_at, conversation_id = position
+            query["$or"] = [
+                {"last_message_at": {"$lt": last_message_at}},
+                {"last_message_at": last_message_at, "id": {"$lt": conversation_id}},
+            ]
+
+        conversations_query = self.db.conversations.find(query, {"_id": 0}).sort(
+            [("last_message_at", -1), ("id", -1)]
+        ).limit(limit + 1).to_list(limit + 1)
+
+        if position is None:
+            requests_query = self.db.chat_requests.find(
+                {"sender_id": user_id, "status": "pending"}, {"_id": 0}
+            ).sort("created_at", -1).limit(PENDING_REQUESTS_LIMIT).to_list(PENDING_REQUESTS_LIMIT)
+            conversations, pending_requests = await asyncio.gather(conversations_query, requests_query)
+        else:
+            conversations, pending_requests = await conversations_query, []
+
+        has_more = len(conversations) > limit
+        conversations = conversations[:limit]
+
+        counterpart_ids = {
+            participant
+            for conversation in conversations
+            for participant in conversation["participants"]
+            if participant != user_id
+        }
+        counterpart_ids.update(request["receiver_id"] for request in pending_requests)
+        users = await self.db.users.find(
+            {"id": {"$in": list(counterpart_ids)}}, PRIVATE_USER_FIELDS
+        ).to_list(len(counterpart_ids))
+        users_by_id = {user["id"]: user for user in users}
+
+        items = conversations + [{**request, "is_chat_request": True} for request in pending_requests]
+
+        next_cursor = None
+        if has_more and conversations:
+            last = conversations[-1]
+            if last.get("last_message_at") is not None:
+                next_cursor = encode_cursor(last["last_message_at"], last["id"])
+
+        return items, users_by_id, next_cursor
+
+    async def start(self):
+        await self.initialize_indexes()
+        self.unread.start()
+
+    async def mark_read(self, conversation_id: str, user_id: str) -> Optional[int]:
+        """
+        Mark the user's received messages read and reset their unread counters.
+        Returns the user's new total, or None when nothing was unread.
+        """
+        _, previous = await asyncio.gather(
+            self.db.messages.update_many(
+                {"conversation_id": conversation_id, "recipient_id": user_id, "is_read": False},
+                {"$set": {"is_read": True}}
+            ),
+            self.db.conversations.find_one_and_update(
+                {"id": conversation_id},
+                {"$set": {f"unread_count.{user_id}": 0}},
+                projection={"_id": 0, "unread_count": 1},
+                return_document=ReturnDocument.BEFORE
+            )
+        )
+        cleared = (previous or {}).get("unread_count", {}).get(user_id, 0)
+        if cleared > 0:
+            return await self.unread.increment(user_id, -cleared)
+        return None
+
+    async def messages_page(
+        self,
+        conversation: Dict,
+        viewer_id: str,
+        limit: int = MESSAGES_DEFAULT_LIMIT,
+        before: Optional[str] = None
+    ) -> Tuple[List[Dict], Dict[str, Dict], Optional[str], Optional[int]]:
+        """
+        Messages older than the `before` cursor (newest page when omitted), oldest first.
+        Returns (messages, participants_by_id, next_cursor, unread_total). Read-marking
+        runs alongside the reads, and only when the viewer has unread messages;
+        unread_total is the viewer's new total when it changed, otherwise None.
+        """
+        conversation_id = conversation["id"]
+        query: Dict = {"conversation_id": conversation_id}
+        position = decode_cursor(before) if before else None
+        if position is not None:
+            created_at, message_id = position
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": message_id}},
+            ]
+
+        participant_ids = conversation.get("participants", [])
+        reads = [
+            self.db.messages.find(query, {"_id": 0}).sort(
+                [("created_at", -1), ("id", -1)]
+            ).limit(limit + 1).to_list(limit + 1),
+            self.db.users.find(
+                {"id": {"$in": participant_ids}},
+                {"_id": 0, "id": 1, "username": 1, "display_name": 1, "avatar_url": 1}
+            ).to_list(len(participant_ids)),
+        ]
+        if conversation.get("unread_count", {}).get(viewer_id, 0) > 0:
+            reads.append(self.mark_read(conversation_id, viewer_id))
+        results = await asyncio.gather(*reads)
+        messages, participants = results[0], results[1]
+        unread_total = results[2] if len(results) > 2 else None
+
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        next_cursor = None
+        if has_more:
+            oldest = messages[-1]
+            next_cursor = encode_cursor(oldest["created_at"], oldest["id"])
+
+        messages.reverse()
+        return messages, {user["id"]: user for user in participants}, next_cursor, unread_total
+
+
+# Global instance
+messaging = None
+
+
+def init_messaging(db):
+    """Initialize messaging queries (indexes and unread reconciliation start at startup)"""
+    global messaging
+    messaging = MessagingQueries(db)
+    return messaging
@@ -360,13 +360,21 @@ class FollowStatus(BaseModel):
     is_following: bool
     follow_id: Optional[str] = None
 
+class FollowListUser(UserResponse):
+    # Relationship with the requesting user (False when anonymous)
+    is_following: bool = False
+    follows_you: bool = False
+    is_mutual: bool = False
+
 class FollowingList(BaseModel):
-    following: List[UserResponse]
+    following: List[FollowListUser]
     total: int
+    next_cursor: Optional[str] = None  # Keyset cursor for the next page
 
 class FollowersList(BaseModel):
-    followers: List[UserResponse]
+    followers: List[FollowListUser]
     total: int
+    next_cursor: Optional[str] = None  # Keyset cursor for the next page
 
 # =============  STORY MODELS ============= (DISABLED - Feature removed)
 # All story models have been removed as the stories feature is disabled
@@ -379,6 +387,8 @@ class Comment(BaseModel):
     user_id: str  # ID del usuario que creó el comentario
     content: str  # Contenido del comentario
     parent_comment_id: Optional[str] = None  # ID del comentario padre (para anidamiento)
+    ancestor_ids: List[str] = []  # Ruta de ancestros (raíz primero, padre al final)
+    reply_count: int = 0  # Respuestas anidadas (mantenido al crear/eliminar)
     likes: int = 0  # Número de likes en el comentario
     is_edited: bool = False  # Si el comentario ha sido editado
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -407,6 +417,7 @@ class CommentResponse(BaseModel):
     # Para anidamiento
     replies: List["CommentResponse"] = []  # Lista de comentarios hijos
     reply_count: int = 0  # Conteo total de respuestas anidadas
+    replies_truncated: bool = False  # Hay más respuestas de las incluidas en `replies`
     user_liked: bool = False  # Si el usuario actual le dio like
 
 class CommentLike(BaseModel):
@@ -754,6 +765,12 @@ class StoryView(BaseModel):
     user_id: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+# Máximo de historias por petición de "vistas" en lote (más -> 422)
+MAX_STORY_VIEWS_BATCH = 100
+
+class StoryViewsBatch(BaseModel):
+    story_ids: List[str] = Field(..., max_length=MAX_STORY_VIEWS_BATCH)  # Stories seen while tapping through the tray
+
 class StoryResponse(BaseModel):
     id: str
     user: UserResponse
@@ -0,0 +1,196 @@
+"""
+Music Metadata Cache for VotaTok
+iTunes track info persisted in `music_metadata` ({track_id, data, fetched_at})
+with a per-worker LRU in front, so restarts and new workers do not refetch
+everything. Entries past their fresh age are served immediately and refreshed
+in the background (stale-while-revalidate); only missing or very old entries
+wait on iTunes, and very old entries are still returned when iTunes does not
+answer for them (stale-if-error). Music referenced by active polls and
+stories is loaded at startup.
+"""
+import asyncio
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Set, Tuple
+
+from pymongo import UpdateOne
+
+from config import config
+
+MUSIC_CACHE_CONFIG = config.MUSIC_CACHE_CONFIG
+
+# track ids -> {track_id: music info} for the ids that exist
+TrackFetcher = Callable[[List[str]], Awaitable[Dict[str, Dict]]]
+
+ITUNES_MUSIC_ID = re.compile(r"^itunes_")
+
+
+class MusicMetadataCache:
+    """LRU -> MongoDB -> iTunes, with background refresh of stale entries"""
+
+    def __init__(self, db, fetcher: TrackFetcher):
+        self.db = db
+        self.fetcher = fetcher
+        # track_id -> (fetched_at, data)
+        self.entries: "OrderedDict[str, Tuple[datetime, Dict]]" = OrderedDict()
+        self._refreshing: Set[str] = set()
+        self._refresh_tasks: Set[asyncio.Task] = set()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.fetched = 0
+        self.stale_served = 0
+        self.stale_if_error = 0
+        self.refreshed = 0
+
+    async def initialize_indexes(self):
+        await self.db.music_metadata.create_index("track_id", unique=True, name="music_metadata_track")
+
+    def _remember(self, track_id: str, fetched_at: datetime, data: Dict):
+        self.entries[track_id] = (fetched_at, data)
+        self.entries.move_to_end(track_id)
+        while len(self.entries) > MUSIC_CACHE_CONFIG['MAX_MEMORY_ENTRIES']:
+            self.entries.popitem(last=False)
+
+    async def _fetch_and_store(self, track_ids: List[str]) -> Dict[str, Dict]:
+        """Fetch from iTunes and persist; ids iTunes does not return are left as they were"""
+        fetched = await self.fetcher(track_ids)
+        if not fetched:
+            return {}
+        now = datetime.utcnow()
+        for track_id, data in fetched.items():
+            self._remember(track_id, now, data)
+        self.fetched += len(fetched)
+        try:
+            await self.db.music_metadata.bulk_write([
+                UpdateOne(
+                    {"track_id": track_id},
+                    {"$set": {"data": data, "fetched_at": now}},
+                    upsert=True
+                )
+                for track_id, data in fetched.items()
+            ], ordered=False)
+        except Exception as e:
+            print(f"⚠️  Music metadata write failed ({len(fetched)} tracks): {str(e)}")
+        return fetched
+
+    def _refresh_in_background(self, track_ids: List[str]):
+        track_ids = [track_id for track_id in track_ids if track_id not in self._refreshing]
+        if not track_ids:
+            return
+        self._refreshing.update(track_ids)
+
+        async def refresh():
+            try:
+                self.refreshed += len(await self._fetch_and_store(track_ids))
+            except Exception as e:
+                print(f"⚠️  Music metadata refresh failed ({len(track_ids)} tracks): {str(e)}")
+            finally:
+                self._refreshing.difference_update(track_ids)
+
+        task = asyncio.create_task(refresh())
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    async def get_many(self, track_ids: Iterable[str]) -> Dict[str, Dict]:
+        """track_id -> music info; stale entries are returned and refreshed after"""
+        now = datetime.utcnow()
+        fresh_after = now - timedelta(seconds=MUSIC_CACHE_CONFIG['FRESH_SECONDS'])
+        usable_after = now - timedelta(seconds=MUSIC_CACHE_CONFIG['MAX_STALE_SECONDS'])
+
+        found: Dict[str, Dict] = {}
+        stale: List[str] = []
+        missing: List[str] = []
+        # Entries too old to serve up front, kept in case iTunes cannot be reached
+        fallback: Dict[str, Dict] = {}
+        for track_id in dict.fromkeys(str(track_id) for track_id in track_ids if track_id):
+            entry = self.entries.get(track_id)
+            if entry is not None and entry[0] >= usable_after:
+                self.entries.move_to_end(track_id)
+                self.memory_hits += 1
+                found[track_id] = entry[1]
+                if entry[0] < fresh_after:
+                    stale.append(track_id)
+            else:
+                if entry is not None:
+                    fallback[track_id] = entry[1]
+                missing.append(track_id)
+
+        db_ids = [track_id for track_id in missing if track_id not in fallback]
+        if db_ids:
+            stored = await self.db.music_metadata.find(
+                {"track_id": {"$in": db_ids}},
+                {"_id": 0, "track_id": 1, "data": 1, "fetched_at": 1}
+            ).to_list(len(db_ids))
+            for doc in stored:
+                if doc["fetched_at"] < usable_after:
+                    fallback[doc["track_id"]] = doc["data"]
+                    continue
+                self._remember(doc["track_id"], doc["fetched_at"], doc["data"])
+                self.db_hits += 1
+                found[doc["track_id"]] = doc["data"]
+                if doc["fetched_at"] < fresh_after:
+                    stale.append(doc["track_id"])
+            missing = [track_id for track_id in missing if track_id not in found]
+
+        if stale:
+            self.stale_served += len(stale)
+            self._refresh_in_background(stale)
+        if missing:
+            try:
+                fetched = await self._fetch_and_store(missing)
+            except Exception as e:
+                if not fallback:
+                    raise
+                print(f"⚠️  Music metadata fetch failed ({len(missing)} tracks): {str(e)}")
+                fetched = {}
+            found.update(fetched)
+            for track_id in missing:
+                if track_id not in fetched and track_id in fallback:
+                    self.stale_if_error += 1
+                    found[track_id] = fallback[track_id]
+        return found
+
+    async def prewarm(self):
+        """Load music of active polls and stories into memory, fetching what was never stored"""
+        limit = MUSIC_CACHE_CONFIG['PREWARM_LIMIT']
+        poll_ids, story_ids = await asyncio.gather(
+            self.db.polls.distinct("music_id", {"is_active": True, "music_id": ITUNES_MUSIC_ID}),
+            self.db.stories.distinct("music_id", {
+                "is_active": True, "expires_at": {"$gt": datetime.utcnow()}, "music_id": ITUNES_MUSIC_ID
+            })
+        )
+        track_ids = list(dict.fromkeys(
+            ITUNES_MUSIC_ID.sub("", music_id) for music_id in story_ids + poll_ids if music_id
+        ))[:limit]
+        if not track_ids:
+            return
+        await self.get_many(track_ids)
+        print(f"🎵 Music metadata cache warmed: {len(self.entries)} tracks ({self.fetched} fetched from iTunes)")
+
+    async def start(self):
+        await self.initialize_indexes()
+        await self.prewarm()
+
+    def get_stats(self) -> Dict:
+        return {
+            "memory_entries": len(self.entries),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "fetched": self.fetched,
+            "stale_served": self.stale_served,
+            "stale_if_error": self.stale_if_error,
+            "refreshed": self.refreshed,
+            "refreshing": len(self._refreshing)
+        }
+
+
+# Global instance
+music_cache = None
+
+
+def init_music_cache(db, fetcher: TrackFetcher):
+    """Initialize the music metadata cache (indexes and prewarm run at startup)"""
+    global music_cache
+    music_cache = MusicMetadataCache(db, fetcher)
+    return music_cache
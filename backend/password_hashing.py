@@ -0,0 +1,174 @@
+"""
+Password Hashing Pool for VotaTok
+argon2/bcrypt hashing and verification run on a small dedicated thread pool so
+a burst of logins does not stall the event loop. Admission is bounded: calls
+that cannot get a slot within the queue timeout fail fast with
+PasswordHashingBusy, and queue wait / run times are exposed as stats.
+
+Run as a script to benchmark argon2 parameters on this host:
+
+    python password_hashing.py --target-ms 250 --max-memory-mib 256
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class PasswordHashingBusy(Exception):
+    """No hashing slot became free within the queue timeout"""
+
+
+class PasswordHashingPool:
+    """Bounded thread pool for CPU-heavy password work, with queue metrics"""
+
+    def __init__(self, context, workers: int, max_pending: int, queue_timeout: float):
+        self.context = context
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._capacity = workers + max_pending
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self._wait_ms_total = 0.0
+        self._run_ms_total = 0.0
+        self.max_wait_ms = 0.0
+
+    async def _run(self, func: Callable, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._capacity)
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise PasswordHashingBusy()
+        finally:
+            self.waiting -= 1
+        try:
+            loop = asyncio.get_running_loop()
+            started = [0.0]
+
+            def timed():
+                started[0] = time.perf_counter()
+                return func(*args)
+
+            self.running += 1
+            try:
+                result = await loop.run_in_executor(self._executor, timed)
+            finally:
+                self.running -= 1
+            finished = time.perf_counter()
+            wait_ms = (started[0] - queued_at) * 1000
+            self._wait_ms_total += wait_ms
+            self._run_ms_total += (finished - started[0]) * 1000
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            self.completed += 1
+            return result
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self.context.verify, password, hashed)
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        (valid, new_hash). new_hash is set when the stored hash was made with an
+        outdated scheme or parameters (passlib needs_update) and should be replaced.
+        """
+        def work():
+            if not self.context.verify(password, hashed):
+                return False, None
+            if self.context.needs_update(hashed):
+                return True, self.context.hash(password)
+            return True, None
+
+        valid, new_hash = await self._run(work)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def get_stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "avg_wait_ms": round(self._wait_ms_total / self.completed, 2) if self.completed else 0,
+            "max_wait_ms": round(self.max_wait_ms, 2),
+            "avg_run_ms": round(self._run_ms_total / self.completed, 2) if self.completed else 0
+        }
+
+
+# ---- calibration ----
+
+def benchmark_argon2(time_cost: int, memory_cost: int, parallelism: int, rounds: int = 5) -> float:
+    """Median milliseconds for one argon2id hash with the given parameters"""
+    from passlib.hash import argon2
+    hasher = argon2.using(rounds=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        hasher.hash("calibration-password")
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def calibrate_argon2(target_ms: float, max_memory_mib: int, parallelism: int) -> List[Dict]:
+    """
+    For each memory size (doubling up to max_memory_mib), the smallest time_cost
+    whose hash takes at least target_ms. The last entry is the recommendation:
+    the most memory that still fits the target.
+    """
+    results = []
+    memory_cost = 16 * 1024
+    while memory_cost <= max_memory_mib * 1024:
+        for time_cost in range(1, 11):
+            elapsed = benchmark_argon2(time_cost, memory_cost, parallelism)
+            print(f"   m={memory_cost // 1024:>4} MiB  t={time_cost:<2}  p={parallelism}  {elapsed:8.1f} ms")
+            if elapsed >= target_ms:
+                break
+        if elapsed > target_ms * 1.5 and time_cost == 1:
+            break  # More memory only gets slower from here
+        results.append({
+            "time_cost": time_cost, "memory_cost": memory_cost,
+            "parallelism": parallelism, "ms": round(elapsed, 1)
+        })
+        memory_cost *= 2
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark argon2 parameters on this host")
+    parser.add_argument("--target-ms", type=float, default=250, help="Target time for one hash")
+    parser.add_argument("--max-memory-mib", type=int, default=256, help="Largest memory cost to try")
+    parser.add_argument("--parallelism", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"🔐 Calibrating argon2id for ~{args.target_ms:.0f} ms per hash...")
+    results = calibrate_argon2(args.target_ms, args.max_memory_mib, args.parallelism)
+    if not results:
+        print("⚠️  No parameters fit the target; lower --target-ms or raise --max-memory-mib")
+        return
+    best = results[-1]
+    print(f"✅ Recommended ({best['ms']} ms):")
+    print(f"   ARGON2_TIME_COST={best['time_cost']}")
+    print(f"   ARGON2_MEMORY_COST={best['memory_cost']}")
+    print(f"   ARGON2_PARALLELISM={best['parallelism']}")
+    print("   Existing hashes are upgraded on each user's next login.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Real-time Gateway for VotaTok
+WebSocket connections per authenticated user and event fan-out for messaging
+(new messages, unread counters). Events go through a pub/sub backend so a
+publish on one worker reaches sockets held by any worker:
+
+- memory: in-process delivery (single worker, default)
+- redis:  Redis PUBLISH/SUBSCRIBE on REALTIME_CONFIG['CHANNEL']
+"""
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket
+
+from config import config
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+REALTIME_CONFIG = config.REALTIME_CONFIG
+
+EventHandler = Callable[[List[str], Dict], Awaitable[None]]
+
+
+class InMemoryPubSub:
+    """Delivers published events to the local handler (one worker)"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._handler: Optional[EventHandler] = None
+
+    async def start(self, handler: EventHandler):
+        self._handler = handler
+
+    async def publish(self, user_ids: List[str], event: Dict):
+        if self._handler:
+            await self._handler(user_ids, event)
+
+    async def close(self):
+        self._handler = None
+
+
+class RedisPubSub:
+    """Broadcasts events to every worker subscribed to the channel"""
+
+    name = "redis"
+
+    # Resubscribe backoff after the connection to Redis is lost
+    RECONNECT_MIN_SECONDS = 1
+    RECONNECT_MAX_SECONDS = 30
+
+    def __init__(self, url: str, channel: str):
+        self.url = url
+        self.channel = channel
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+        self.reconnects = 0
+
+    async def start(self, handler: EventHandler):
+        self._redis = aioredis.from_url(self.url)
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen(pubsub, handler))
+
+    async def _listen(self, pubsub, handler: EventHandler):
+        """Deliver channel messages; resubscribe with backoff whenever the connection drops"""
+        delay = self.RECONNECT_MIN_SECONDS
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self._redis.pubsub()
+                    await pubsub.subscribe(self.channel)
+                    self.reconnects += 1
+                    print("✅ Realtime Redis subscription restored")
+                delay = self.RECONNECT_MIN_SECONDS
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        payload = json.loads(message["data"])
+                        await handler(payload["user_ids"], payload["event"])
+                    except Exception as e:
+                        print(f"⚠️  Realtime event dropped: {str(e)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Events published while disconnected are not replayed (pub/sub)
+                print(f"⚠️  Realtime Redis subscription lost: {str(e)} - retrying in {delay}s")
+            if pubsub is not None:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+                pubsub = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.RECONNECT_MAX_SECONDS)
+
+    async def publish(self, user_ids: List[str], event: Dict):
+        await self._redis.publish(self.channel, json.dumps({"user_ids": user_ids, "event": event}))
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+        if self._redis:
+            await self._redis.close()
+
+
+def create_pubsub():
+    """Backend named by REALTIME_CONFIG['PUBSUB_BACKEND'], in-memory when unavailable"""
+    if REALTIME_CONFIG['PUBSUB_BACKEND'] == "redis":
+        if REDIS_AVAILABLE:
+            return RedisPubSub(REALTIME_CONFIG['REDIS_URL'], REALTIME_CONFIG['CHANNEL'])
+        print("⚠️  redis not available - realtime events stay within this worker")
+    return InMemoryPubSub()
+
+
+class ConnectionManager:
+    """Open sockets per user on this worker, and delivery of published events"""
+
+    def __init__(self, pubsub=None, json_default: Optional[Callable] = None):
+        self.pubsub = pubsub or create_pubsub()
+        self.json_default = json_default
+        self.connections: Dict[str, List[WebSocket]] = {}
+        self._started = False
+        self._start_lock = asyncio.Lock()
+        self._publish_tasks: Set[asyncio.Task] = set()
+        self.published = 0
+        self.delivered = 0
+
+    async def start(self):
+        async with self._start_lock:
+            if not self._started:
+                await self.pubsub.start(self._deliver)
+                self._started = True
+
+    async def connect(self, user_id: str, websocket: WebSocket):
+        await self.start()
+        await websocket.accept()
+        sockets = self.connections.setdefault(user_id, [])
+        sockets.append(websocket)
+        while len(sockets) > REALTIME_CONFIG['MAX_CONNECTIONS_PER_USER']:
+            oldest = sockets.pop(0)
+            try:
+                await oldest.close(code=4000)
+            except Exception:
+                pass
+
+    def disconnect(self, user_id: str, websocket: WebSocket):
+        sockets = self.connections.get(user_id)
+        if not sockets:
+            return
+        if websocket in sockets:
+            sockets.remove(websocket)
+        if not sockets:
+            del self.connections[user_id]
+
+    def is_online(self, user_id: str) -> bool:
+        return user_id in self.connections
+
+    async def publish(self, user_ids: Iterable[str], event: Dict):
+        """Send an event to every socket of the given users, on any worker"""
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return
+        # Serialize once so datetimes and the like survive any backend
+        event = json.loads(json.dumps(event, default=self.json_default))
+        self.published += 1
+        try:
+            await self.start()
+            await self.pubsub.publish(user_ids, event)
+        except Exception as e:
+            print(f"⚠️  Realtime publish failed: {str(e)}")
+
+    def publish_in_background(self, user_ids: Iterable[str], event: Dict):
+        """publish() without delaying the caller; the task is referenced until done"""
+        task = asyncio.create_task(self.publish(user_ids, event))
+        self._publish_tasks.add(task)
+        task.add_done_callback(self._publish_tasks.discard)
+
+    async def _deliver(self, user_ids: List[str], event: Dict):
+        """Send to the sockets held by this worker; dead sockets are dropped"""
+        payload = json.dumps(event)
+        targets = [
+            (user_id, websocket)
+            for user_id in user_ids
+            for websocket in list(self.connections.get(user_id, ()))
+        ]
+        if not targets:
+            return
+        results = await asyncio.gather(
+            *(asyncio.wait_for(websocket.send_text(payload), REALTIME_CONFIG['SEND_TIMEOUT_SECONDS'])
+              for _, websocket in targets),
+            return_exceptions=True
+        )
+        for (user_id, websocket), result in zip(targets, results):
+            if isinstance(result, Exception):
+                self.disconnect(user_id, websocket)
+            else:
+                self.delivered += 1
+
+    async def close(self):
+        await self.pubsub.close()
+        self._started = False
+
+    def get_stats(self) -> Dict:
+        return {
+            "backend": self.pubsub.name,
+            "online_users": len(self.connections),
+            "connections": sum(len(sockets) for sockets in self.connections.values()),
+            "published": self.published,
+            "publishing": len(self._publish_tasks),
+            "delivered": self.delivered,
+            "reconnects": getattr(self.pubsub, "reconnects", 0)
+        }
+
+
+# Global instance
+realtime = None
+
+
+def init_realtime(json_default: Optional[Callable] = None):
+    """Initialize the WebSocket connection manager (pub/sub subscribed at startup)"""
+    global realtime
+    realtime = ConnectionManager(json_default=json_default)
+    return realtime
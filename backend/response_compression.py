@@ -0,0 +1,273 @@
+"""
+Response Compression for VotaTok API
+Negotiated gzip / brotli / zstd compression with size threshold,
+pre-compressed payload cache for hot cached responses and bytes-saved metrics
+"""
+import gzip
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+from config import config
+
+# Optional codecs - gzip is always available
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+    print("⚠️  brotli not available - br response compression disabled")
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+    print("⚠️  zstandard not available - zstd response compression disabled")
+
+COMPRESSION_CONFIG = config.COMPRESSION_CONFIG
+
+
+def available_encodings() -> list:
+    """Encodings supported by this process, in server preference order"""
+    supported = {"gzip"}
+    if BROTLI_AVAILABLE:
+        supported.add("br")
+    if ZSTD_AVAILABLE:
+        supported.add("zstd")
+    return [enc.strip() for enc in COMPRESSION_CONFIG['PREFERRED_ENCODINGS'] if enc.strip() in supported]
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Pick the best encoding from an Accept-Encoding header.
+    Highest q-value wins; ties are broken by server preference.
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+
+    best, best_q = None, 0.0
+    for encoding in available_encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    """Compress data with the given content-coding"""
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESSION_CONFIG['BROTLI_QUALITY'])
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=COMPRESSION_CONFIG['ZSTD_LEVEL']).compress(data)
+    return gzip.compress(data, compresslevel=COMPRESSION_CONFIG['GZIP_LEVEL'])
+
+
+def is_compressible(content_type: str) -> bool:
+    """Only text-like payloads benefit from compression (media is already compressed)"""
+    if not content_type:
+        return False
+    content_type = content_type.lower()
+    return any(content_type.startswith(prefix) for prefix in COMPRESSION_CONFIG['COMPRESSIBLE_TYPES'])
+
+
+class CompressionStats:
+    """Bytes-saved metrics for compressed responses"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.responses_compressed = 0
+        self.responses_skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.precompressed_hits = 0
+        self.by_encoding: Dict[str, Dict[str, int]] = {}
+
+    def record(self, encoding: str, original_size: int, compressed_size: int):
+        self.responses_compressed += 1
+        self.bytes_in += original_size
+        self.bytes_out += compressed_size
+        entry = self.by_encoding.setdefault(encoding, {"responses": 0, "bytes_in": 0, "bytes_out": 0})
+        entry["responses"] += 1
+        entry["bytes_in"] += original_size
+        entry["bytes_out"] += compressed_size
+
+    def to_dict(self) -> Dict:
+        return {
+            "enabled": COMPRESSION_CONFIG['ENABLED'],
+            "available_encodings": available_encodings(),
+            "minimum_size": COMPRESSION_CONFIG['MINIMUM_SIZE'],
+            "responses_compressed": self.responses_compressed,
+            "responses_skipped": self.responses_skipped,
+            "precompressed_hits": self.precompressed_hits,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+            "by_encoding": self.by_encoding
+        }
+
+
+class PrecompressedPayloadCache:
+    """
+    LRU of compressed bodies keyed by (cache_key, encoding).
+    Each entry remembers a digest of the uncompressed body, so an entry is
+    reused only while the underlying cached payload has not changed.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[bytes, bytes]]" = OrderedDict()
+
+    def get_or_compress(self, cache_key: str, body: bytes, encoding: str) -> Tuple[bytes, bool]:
+        """Return (compressed_body, was_cache_hit)"""
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        key = (cache_key, encoding)
+
+        cached = self.entries.get(key)
+        if cached and cached[0] == digest:
+            self.entries.move_to_end(key)
+            return cached[1], True
+
+        compressed = compress_bytes(body, encoding)
+        self.entries[key] = (digest, compressed)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return compressed, False
+
+    def clear(self):
+        self.entries.clear()
+
+
+compression_stats = CompressionStats()
+payload_cache = PrecompressedPayloadCache(COMPRESSION_CONFIG['PAYLOAD_CACHE_MAX_ENTRIES'])
+
+
+def _mark_compressed(headers: MutableHeaders, encoding: str, size: int):
+    headers["content-encoding"] = encoding
+    headers["content-length"] = str(size)
+    headers.add_vary_header("Accept-Encoding")
+
+
+def precompressed_response(
+    request: Request,
+    content,
+    cache_key: str,
+    response_class=JSONResponse
+) -> Response:
+    """
+    Render content once and serve a cached compressed body for hot payloads.
+    The compression middleware leaves responses with Content-Encoding untouched.
+    """
+    response = response_class(content)
+    body = response.body
+
+    encoding = None
+    if COMPRESSION_CONFIG['ENABLED'] and len(body) >= COMPRESSION_CONFIG['MINIMUM_SIZE']:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    if not encoding:
+        return response
+
+    compressed, hit = payload_cache.get_or_compress(cache_key, body, encoding)
+    if hit:
+        compression_stats.precompressed_hits += 1
+    compression_stats.record(encoding, len(body), len(compressed))
+
+    response.body = compressed
+    _mark_compressed(response.headers, encoding, len(compressed))
+    return response
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing single-chunk responses above the size threshold.
+    Streaming responses (files, video) and already-encoded bodies pass through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_CONFIG['ENABLED']:
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if "content-encoding" in headers or not is_compressible(headers.get("content-type", "")):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is None:
+                await send(message)
+                return
+
+            if more_body or len(body) < COMPRESSION_CONFIG['MINIMUM_SIZE']:
+                # Streaming or tiny body - send uncompressed
+                compression_stats.responses_skipped += 1
+                passthrough = True
+                await send(start_message)
+                start_message = None
+                await send(message)
+                return
+
+            compressed = compress_bytes(body, encoding)
+            compression_stats.record(encoding, len(body), len(compressed))
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            _mark_compressed(headers, encoding, len(compressed))
+            await send(start_message)
+            start_message = None
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def get_compression_stats() -> Dict:
+    """Compression metrics for the performance stats endpoint"""
+    stats = compression_stats.to_dict()
+    stats["payload_cache_entries"] = len(payload_cache.entries)
+    return stats
@@ -0,0 +1,163 @@
+"""
+Search Result Cache for VotaTok
+Normalized-query cache for /search, /search/universal and /search/autocomplete,
+honoring SEARCH_CONFIG['ENABLE_SEARCH_CACHE'] and ['CACHE_TTL_SECONDS'].
+Entries hold viewer-independent results only (per-viewer filtering happens on
+read), so one computation serves every user. Entries are dropped early when
+content matching their query terms is created, edited or deleted.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from config import config
+from search_index import fold_text, tokenize, tokenize_tags
+
+SEARCH_CONFIG = config.SEARCH_CONFIG
+
+# Bound on cached queries (least recently used entries are evicted first)
+MAX_ENTRIES = 2000
+
+# Document fields whose terms can make a cached query stale
+CONTENT_FIELDS = ("title", "description", "content", "username", "display_name", "artist")
+TAG_FIELDS = ("tags",)
+
+
+def normalize_query(query: str) -> str:
+    """Folded, whitespace-collapsed form used as the cache key"""
+    return " ".join(fold_text(query or "").split())
+
+
+def _document_terms(docs: Iterable[Optional[Dict]]) -> Set[str]:
+    terms: Set[str] = set()
+    for doc in docs:
+        if not doc:
+            continue
+        for field in CONTENT_FIELDS:
+            terms.update(tokenize(doc.get(field) or ""))
+        for field in TAG_FIELDS:
+            tags = doc.get(field) or []
+            terms.update(tokenize_tags(tags))
+            terms.update(term.lstrip("#") for term in tokenize_tags(tags))
+    return terms
+
+
+class SearchResultCache:
+    """TTL + LRU cache of search results keyed by (namespace, normalized query, params)"""
+
+    def __init__(self):
+        self.enabled = SEARCH_CONFIG['ENABLE_SEARCH_CACHE']
+        self.ttl = SEARCH_CONFIG['CACHE_TTL_SECONDS']
+        # key -> (expires_at, value, query terms)
+        self.entries: "OrderedDict[Tuple, Tuple[float, Any, Tuple[str, ...]]]" = OrderedDict()
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Bumped on every content write so results computed across a write are not stored
+        self._generation = 0
+
+    def _get(self, key: Tuple):
+        cached = self.entries.get(key)
+        if cached is None:
+            return None
+        expires_at, value, _ = cached
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def _set(self, key: Tuple, value: Any, query: str):
+        terms = tuple(term.lstrip("#") for term in tokenize(query)) or (query,)
+        self.entries[key] = (time.monotonic() + self.ttl, value, terms)
+        self.entries.move_to_end(key)
+        while len(self.entries) > MAX_ENTRIES:
+            self.entries.popitem(last=False)
+
+    async def get_or_compute(
+        self,
+        namespace: str,
+        query: str,
+        params: Tuple,
+        compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Cached viewer-independent value for a query, computing it on a miss.
+        Concurrent misses for the same key share a single computation.
+        """
+        if not self.enabled:
+            return await compute()
+
+        key = (namespace, normalize_query(query), params)
+        value = self._get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await compute()
+            future.set_result(value)
+            if generation == self._generation:
+                self._set(key, value, key[1])
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when nobody else was waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            if not future.done():
+                future.cancel()
+
+    def invalidate_for(self, *docs: Optional[Dict]):
+        """Drop entries whose query terms prefix-match terms of created/edited/deleted documents"""
+        self._generation += 1
+        if not self.entries:
+            return
+        content_terms = _document_terms(docs)
+        if not content_terms:
+            return
+        stale = [
+            key for key, (_, _, terms) in self.entries.items()
+            if any(content.startswith(term) for term in terms for content in content_terms)
+        ]
+        for key in stale:
+            del self.entries[key]
+        self.invalidations += len(stale)
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "ttl_seconds": self.ttl,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "invalidated_entries": self.invalidations
+        }
+
+
+# Global instance
+search_cache = None
+
+
+def init_search_cache():
+    """Initialize search result cache"""
+    global search_cache
+    search_cache = SearchResultCache()
+    return search_cache
@@ -0,0 +1,367 @@
+"""
+Full-Text Search Index for VotaTok
+In-process inverted index with accent folding, prefix matching and BM25 ranking.
+Replaces unanchored $regex collection scans in the search endpoints.
+"""
+import asyncio
+import heapq
+import math
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import config
+
+SEARCH_CONFIG = config.SEARCH_CONFIG
+MULTIPLIERS = SEARCH_CONFIG['MULTIPLIERS']
+
+# Score multiplier for terms matched by prefix instead of exactly
+PREFIX_MATCH_PENALTY = 0.8
+
+TOKEN_PATTERN = re.compile(r"#?\w+")
+
+
+def fold_text(text: str) -> str:
+    """Lowercase and strip accents ('Canción' -> 'cancion')"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into folded terms.
+    Hashtags yield both the word ('pizza') and the hashtag term ('#pizza').
+    """
+    if not text:
+        return []
+    terms = []
+    for token in TOKEN_PATTERN.findall(fold_text(str(text))):
+        if token.startswith("#"):
+            if len(token) > 1:
+                terms.append(token)
+                terms.append(token[1:])
+        else:
+            terms.append(token)
+    return terms
+
+
+def tokenize_tags(tags: Iterable[str]) -> List[str]:
+    """Tags are indexed as hashtag terms only"""
+    terms = []
+    for tag in tags or []:
+        for token in TOKEN_PATTERN.findall(fold_text(str(tag).lstrip("#"))):
+            terms.append("#" + token.lstrip("#"))
+    return terms
+
+
+def extract_poll_hashtags(poll: Dict) -> Dict[str, str]:
+    """Hashtags of a poll (tags + #words in title/description) as folded term -> display form"""
+    hashtags = {}
+    for tag in poll.get("tags") or []:
+        display = "#" + str(tag).lstrip("#").strip()
+        for term in tokenize_tags([tag]):
+            hashtags.setdefault(term, display)
+    for field in ("title", "description", "content"):
+        for match in re.findall(r"#\w+", poll.get(field) or ""):
+            for term in tokenize_tags([match]):
+                hashtags.setdefault(term, match)
+    return hashtags
+
+
+class InvertedIndex:
+    """BM25-ranked inverted index over one document type"""
+
+    def __init__(self, field_weights: Dict[str, float], tag_fields: Tuple[str, ...] = ()):
+        self.field_weights = field_weights
+        self.tag_fields = tag_fields
+        self.k1 = SEARCH_CONFIG['BM25_K1']
+        self.b = SEARCH_CONFIG['BM25_B']
+
+        self.postings: Dict[str, Dict[str, float]] = {}   # term -> {doc_id: weighted tf}
+        self.doc_terms: Dict[str, Dict[str, float]] = {}  # doc_id -> {term: weighted tf}
+        self.doc_lengths: Dict[str, float] = {}
+        self.total_length = 0.0
+        self.vocabulary: List[str] = []  # Sorted, for prefix lookups
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def add(self, doc_id: str, doc: Dict, bulk: bool = False):
+        """
+        Index (or re-index) a document. Bulk adds (full builds) leave the
+        vocabulary unsorted; finish_bulk() sorts it once at the end.
+        """
+        if doc_id in self.doc_terms:
+            self.remove(doc_id)
+
+        weighted_tf: Dict[str, float] = {}
+        length = 0.0
+        for field, weight in self.field_weights.items():
+            value = doc.get(field)
+            if not value:
+                continue
+            terms = tokenize_tags(value) if field in self.tag_fields else tokenize(value)
+            for term in terms:
+                weighted_tf[term] = weighted_tf.get(term, 0.0) + weight
+            length += len(terms) * weight
+
+        if not weighted_tf:
+            return
+
+        self.doc_terms[doc_id] = weighted_tf
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+        for term, tf in weighted_tf.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                if not bulk:
+                    insort(self.vocabulary, term)
+            posting[doc_id] = tf
+
+    def finish_bulk(self):
+        """Sort the vocabulary once after bulk adds"""
+        self.vocabulary = sorted(self.postings)
+
+    def remove(self, doc_id: str):
+        """Drop a document from the index"""
+        weighted_tf = self.doc_terms.pop(doc_id, None)
+        if weighted_tf is None:
+            return
+        self.total_length -= self.doc_lengths.pop(doc_id, 0.0)
+        for term in weighted_tf:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+                position = bisect_left(self.vocabulary, term)
+                if position < len(self.vocabulary) and self.vocabulary[position] == term:
+                    self.vocabulary.pop(position)
+
+    def prefix_terms(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        """Vocabulary terms starting with prefix, most frequent first, as (term, doc_freq)"""
+        matches = []
+        position = bisect_left(self.vocabulary, prefix)
+        scan_limit = limit * 4
+        while position < len(self.vocabulary) and len(matches) < scan_limit:
+            term = self.vocabulary[position]
+            if not term.startswith(prefix):
+                break
+            matches.append((term, len(self.postings[term])))
+            position += 1
+        return heapq.nlargest(limit, matches, key=lambda item: item[1])
+
+    def _term_scores(self, term: str, multiplier: float) -> Dict[str, float]:
+        posting = self.postings.get(term)
+        if not posting:
+            return {}
+        doc_count = len(self.doc_terms)
+        avg_length = self.total_length / doc_count if doc_count else 1.0
+        idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+        scores = {}
+        for doc_id, tf in posting.items():
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+            scores[doc_id] = multiplier * idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, limit: int, prefix: bool = True) -> List[Tuple[str, float]]:
+        """
+        Rank documents containing every query term.
+        The last term also matches by prefix (search-as-you-type).
+        """
+        query_terms = tokenize_tags([query]) if query.startswith("#") else tokenize(query)
+        # Drop hashtag duplicates for plain queries, keep order
+        if not query.startswith("#"):
+            query_terms = [term for term in query_terms if not term.startswith("#")]
+        query_terms = list(dict.fromkeys(query_terms))
+        if not query_terms:
+            return []
+
+        combined: Optional[Dict[str, float]] = None
+        for position, term in enumerate(query_terms):
+            term_scores = self._term_scores(term, 1.0)
+            if prefix and position == len(query_terms) - 1:
+                for expansion, _ in self.prefix_terms(term, SEARCH_CONFIG['MAX_PREFIX_EXPANSIONS']):
+                    if expansion == term:
+                        continue
+                    for doc_id, score in self._term_scores(expansion, PREFIX_MATCH_PENALTY).items():
+                        if score > term_scores.get(doc_id, 0.0):
+                            term_scores[doc_id] = score
+
+            if combined is None:
+                combined = term_scores
+            else:
+                combined = {
+                    doc_id: score + term_scores[doc_id]
+                    for doc_id, score in combined.items()
+                    if doc_id in term_scores
+                }
+            if not combined:
+                return []
+
+        return heapq.nlargest(limit, combined.items(), key=lambda item: item[1])
+
+
+class SearchIndexManager:
+    """Builds, refreshes and queries the per-type search indexes"""
+
+    # kind -> (collection, filter, field weights, tag fields)
+    INDEX_SPECS = {
+        "posts": (
+            "polls",
+            {},
+            {
+                "title": MULTIPLIERS['TITLE_MATCH'],
+                "description": MULTIPLIERS['CONTENT_MATCH'],
+                "content": MULTIPLIERS['CONTENT_MATCH'],
+                "tags": MULTIPLIERS['HASHTAG_MATCH'],
+            },
+            ("tags",),
+        ),
+        "users": (
+            "users",
+            {},
+            {
+                "username": MULTIPLIERS['USERNAME_MATCH'],
+                "display_name": MULTIPLIERS['DISPLAY_NAME_MATCH'],
+            },
+            (),
+        ),
+        "sounds": (
+            "user_audio",
+            {"is_active": {"$ne": False}},
+            {
+                "title": MULTIPLIERS['TITLE_MATCH'],
+                "artist": MULTIPLIERS['CONTENT_MATCH'],
+            },
+            (),
+        ),
+    }
+
+    def __init__(self, db):
+        self.db = db
+        self.indexes: Dict[str, InvertedIndex] = {}
+        self.built_at: Optional[datetime] = None
+        self.builds = 0  # Completed builds; concurrent build() calls share one
+        self._build_lock = asyncio.Lock()
+        self._rebuild_task: Optional[asyncio.Task] = None
+        # Writes arriving while a rebuild is running, replayed before the swap
+        self._pending_ops: Optional[List[Tuple[str, str, Optional[Dict]]]] = None
+
+    def _new_index(self, kind: str) -> InvertedIndex:
+        _, _, weights, tag_fields = self.INDEX_SPECS[kind]
+        return InvertedIndex(weights, tag_fields)
+
+    async def build(self):
+        """Full (re)build from MongoDB; the previous index keeps serving until the swap"""
+        builds_seen = self.builds
+        async with self._build_lock:
+            if self.builds != builds_seen:
+                return  # Built by another caller while this one waited for the lock
+            started = datetime.utcnow()
+            self._pending_ops = []
+            try:
+                fresh = {}
+                batch_size = SEARCH_CONFIG['INDEX_BUILD_BATCH_SIZE']
+                for kind, (collection, query, weights, _) in self.INDEX_SPECS.items():
+                    index = self._new_index(kind)
+                    projection = {"_id": 0, "id": 1, **{field: 1 for field in weights}}
+                    cursor = self.db[collection].find(query, projection).batch_size(batch_size)
+                    count = 0
+                    async for doc in cursor:
+                        if doc.get("id"):
+                            index.add(doc["id"], doc, bulk=True)
+                        count += 1
+                        if count % batch_size == 0:
+                            await asyncio.sleep(0)  # Yield to request handlers
+                    index.finish_bulk()
+                    fresh[kind] = index
+
+                for kind, doc_id, doc in self._pending_ops:
+                    if doc is None:
+                        fresh[kind].remove(doc_id)
+                    else:
+                        fresh[kind].add(doc_id, doc)
+
+                self.indexes = fresh
+                self.built_at = started
+                self.builds += 1
+                print(f"🔎 Search index built: " + ", ".join(f"{k}={len(v)}" for k, v in fresh.items()))
+            finally:
+                self._pending_ops = None
+
+    async def ensure_ready(self) -> bool:
+        """Build on first use, refresh in background once stale"""
+        if self.built_at is None:
+            try:
+                await self.build()
+            except Exception as e:
+                print(f"❌ Search index build failed: {str(e)}")
+                return False
+            return True
+
+        age = (datetime.utcnow() - self.built_at).total_seconds()
+        if age > SEARCH_CONFIG['INDEX_REBUILD_INTERVAL_SECONDS'] and (
+            self._rebuild_task is None or self._rebuild_task.done()
+        ):
+            self._rebuild_task = asyncio.create_task(self.build())
+        return True
+
+    async def search(self, kind: str, query: str, limit: int) -> Optional[List[Tuple[str, float]]]:
+        """Ranked (doc_id, score) pairs, or None when the index is unavailable"""
+        if not await self.ensure_ready():
+            return None
+        index = self.indexes.get(kind)
+        if index is None:
+            return None
+        return index.search(query, limit)
+
+    async def prefix_terms(self, kind: str, prefix: str, limit: int) -> Optional[List[Tuple[str, int]]]:
+        """Vocabulary completions for prefix, or None when the index is unavailable"""
+        if not await self.ensure_ready():
+            return None
+        index = self.indexes.get(kind)
+        if index is None:
+            return None
+        return index.prefix_terms(fold_text(prefix), limit)
+
+    def upsert(self, kind: str, doc: Dict):
+        """Incrementally index a created/updated document"""
+        doc_id = doc.get("id")
+        if not doc_id:
+            return
+        if self._pending_ops is not None:
+            self._pending_ops.append((kind, doc_id, doc))
+        index = self.indexes.get(kind)
+        if index is not None:
+            index.add(doc_id, doc)
+
+    def remove(self, kind: str, doc_id: str):
+        """Incrementally drop a deleted document"""
+        if self._pending_ops is not None:
+            self._pending_ops.append((kind, doc_id, None))
+        index = self.indexes.get(kind)
+        if index is not None:
+            index.remove(doc_id)
+
+    def get_stats(self) -> Dict:
+        return {
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+            "documents": {kind: len(index) for kind, index in self.indexes.items()},
+            "terms": {kind: len(index.postings) for kind, index in self.indexes.items()},
+        }
+
+
+# Global instance
+search_index = None
+
+
+def init_search_index(db):
+    """Initialize search index manager (built lazily on first search)"""
+    global search_index
+    search_index = SearchIndexManager(db)
+    return search_index
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response, UploadFile, File, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response, UploadFile, File, Query, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
@@ -11,13 +11,14 @@ import uuid
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set, Tuple, Callable
 import uuid
 from datetime import datetime, timedelta, date, timedelta
 import random
 import asyncio
 import re
 import hashlib
+from functools import lru_cache
 import json
 import aiohttp
 import httpx
@@ -48,8 +49,8 @@ from models import (
     Message, MessageCreate, Conversation, ConversationResponse,
     UserUpdate, PasswordChange, UserSettings,
     Comment, CommentCreate, CommentUpdate, CommentResponse, CommentLike,
-    Story, StoryCreate, StoryView, StoryResponse, StoriesGroupResponse,
-    Follow, FollowCreate, FollowResponse, FollowStatus, FollowingList, FollowersList,
+    Story, StoryCreate, StoryView, StoryViewsBatch, StoryResponse, StoriesGroupResponse,
+    Follow, FollowCreate, FollowResponse, FollowStatus, FollowingList, FollowersList, FollowListUser,
     LoginAttempt, UserDevice, UserSession, SecurityNotification,
     Poll, PollCreate, PollResponse, PollOption, Vote, VoteCreate, PollLike, Music, MentionedUser,
     UploadType, FileType, UploadedFile, UploadResponse,
@@ -63,8 +64,9 @@ from models import (
     ChatRequest, ChatRequestCreate, ChatRequestResponse, ChatRequestAction, ChatRequestStatus
 )
 from auth import (
-    verify_password, get_password_hash, create_access_token, 
-    verify_token, ACCESS_TOKEN_EXPIRE_MINUTES
+    create_access_token, verify_token, ACCESS_TOKEN_EXPIRE_MINUTES,
+    verify_password_async, get_password_hash_async, verify_and_update_password,
+    password_pool, PasswordHashingBusy
 )
 
 # Import configuration
@@ -96,6 +98,41 @@ try:
 except Exception as e:
     print(f"⚠️  Feed optimizer initialization failed: {e}")
 
+# Initialize Search Index (in-process inverted index, built lazily)
+from search_index import init_search_index
+search_index = init_search_index(db)
+
+# Initialize Autocomplete Engine (in-memory prefix index, built lazily)
+from autocomplete_index import init_autocomplete_engine
+autocomplete_engine = init_autocomplete_engine(db)
+
+# Initialize Hashtag Statistics (materialized `hashtags` collection)
+from hashtag_stats import init_hashtag_stats
+hashtag_stats = init_hashtag_stats(db)
+
+# Initialize Fuzzy User Index (trigram index for typo-tolerant user search)
+from fuzzy_index import init_fuzzy_user_index, trigram_similarity
+fuzzy_user_index = init_fuzzy_user_index(db)
+
+# Initialize Search Result Cache (viewer-independent results, TTL + write invalidation)
+from search_cache import init_search_cache
+search_cache = init_search_cache()
+
+# Initialize Activity Inbox (append-only notification stream, batched background writes)
+from activity_feed import init_activity_feed
+activity_feed = init_activity_feed(db)
+
+# Initialize Social Graph queries (keyset-paginated follower/following lists)
+from social_graph import init_social_graph, init_follow_graph
+social_graph = init_social_graph(db)
+
+# Initialize Messaging queries (keyset-paginated inbox, batched participant lookups)
+from messaging import (
+    init_messaging, CONVERSATIONS_DEFAULT_LIMIT, CONVERSATIONS_MAX_LIMIT,
+    MESSAGES_DEFAULT_LIMIT, MESSAGES_MAX_LIMIT
+)
+messaging = init_messaging(db)
+
 # Custom JSON encoder to handle datetime with UTC timezone
 def custom_json_serializer(obj):
     """Custom JSON serializer that adds 'Z' suffix to UTC datetime objects"""
@@ -129,6 +166,23 @@ class CustomJSONResponse(FastAPIJSONResponse):
 # Set as default response class
 app.router.default_response_class = CustomJSONResponse
 
+# Initialize Comment Threads (ancestor paths, stored reply counts, keyset pages)
+from comment_threads import (
+    init_comment_threads, ROOT_COMMENTS_MAX_LIMIT, REPLIES_DEFAULT_LIMIT, REPLIES_MAX_LIMIT
+)
+comment_threads = init_comment_threads(db)
+
+# Initialize Stories Tray (projected stories query, batched views/users, concurrent music)
+from stories_tray import init_stories_tray, init_story_expiry
+stories_tray = init_stories_tray(db)
+story_expiry = init_story_expiry(db)
+from login_guard import init_login_guard
+login_guard = init_login_guard(db)
+
+# Initialize Real-time gateway (WebSocket fan-out, pluggable pub/sub backend)
+from realtime import init_realtime
+realtime = init_realtime(json_default=custom_json_serializer)
+
 # Initialize Fast Upload System
 try:
     from fast_upload_endpoints import fast_upload_router
@@ -152,29 +206,22 @@ UPLOAD_DIR = config.UPLOAD_BASE_DIR
 # Mount static files to serve uploads
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
-# Cache for iTunes API responses to improve performance
-itunes_cache = {}
-follow_status_cache = {}
-CACHE_EXPIRY_HOURS = 24  # Cache iTunes data for 24 hours
-FOLLOW_CACHE_EXPIRY_MINUTES = 10  # Cache follow status for 10 minutes
+# Shared iTunes HTTP client (pooled, circuit breaker, coalesced lookups)
+from itunes_client import init_itunes_client, ITunesUnavailable
+itunes_client = init_itunes_client()
+
+FOLLOW_CACHE_EXPIRY_MINUTES = 10  # Reload cached following sets after 10 minutes
 
-def is_cache_valid(cached_item):
-    """Check if cached item is still valid"""
-    if not cached_item:
-        return False
-    return (datetime.utcnow() - cached_item['cached_at']).total_seconds() < (CACHE_EXPIRY_HOURS * 3600)
+# In-process follow graph (per-user following sets) for follow checks
+follow_graph = init_follow_graph(db, ttl_seconds=FOLLOW_CACHE_EXPIRY_MINUTES * 60)
 
-def is_follow_cache_valid(cached_item):
-    """Check if follow cache item is still valid"""
-    if not cached_item:
-        return False
-    return (datetime.utcnow() - cached_item['cached_at']).total_seconds() < (FOLLOW_CACHE_EXPIRY_MINUTES * 60)
 
 # Create a router with configurable prefix
 api_router = APIRouter(prefix=config.API_PREFIX)
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 # Authentication dependency
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> UserResponse:
@@ -199,6 +246,15 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     
     return UserResponse(**user_data)
 
+async def get_optional_user_id(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> Optional[str]:
+    """Viewer id from a valid bearer token, None for anonymous requests"""
+    if not credentials:
+        return None
+    payload = verify_token(credentials.credentials)
+    return payload.get("sub") if payload else None
+
 # =============  SECURITY UTILITIES =============
 
 async def track_login_attempt(email: str, ip_address: str, user_agent: str, success: bool, failure_reason: Optional[str] = None):
@@ -210,42 +266,34 @@ async def track_login_attempt(email: str, ip_address: str, user_agent: str, succ
         success=success,
         failure_reason=failure_reason
     )
-    await db.login_attempts.insert_one(attempt.dict())
+    if not success:
+        await login_guard.record_failure(email, ip_address)
+    # Audit trail is written in batches by the background writer
+    login_guard.audit(attempt.dict())
 
 async def check_rate_limit(email: str, ip_address: str) -> bool:
-    """Check if user has exceeded login attempt limits"""
-    # Check failed attempts in last 15 minutes
-    time_threshold = datetime.utcnow() - timedelta(minutes=15)
-    
-    # Count failed attempts by email
-    email_failures = await db.login_attempts.count_documents({
-        "email": email,
-        "success": False,
-        "created_at": {"$gte": time_threshold}
-    })
-    
-    # Count failed attempts by IP
-    ip_failures = await db.login_attempts.count_documents({
-        "ip_address": ip_address,
-        "success": False,
-        "created_at": {"$gte": time_threshold}
-    })
-    
-    # Rate limits: 5 attempts per email, 10 per IP in 15 minutes
-    return email_failures < 5 and ip_failures < 10
+    """Check if user has exceeded login attempt limits (sliding window per email and IP)"""
+    return await login_guard.allowed(email, ip_address)
 
-def parse_user_agent(user_agent_string: str) -> Dict[str, str]:
-    """Parse user agent string to extract device information"""
+# Parsed user agents (a handful of distinct strings cover most logins)
+USER_AGENT_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=USER_AGENT_CACHE_SIZE)
+def _parse_user_agent_cached(user_agent_string: str) -> Tuple[Tuple[str, str], ...]:
     user_agent = parse(user_agent_string)
-    return {
-        "browser": f"{user_agent.browser.family} {user_agent.browser.version_string}",
-        "os": f"{user_agent.os.family} {user_agent.os.version_string}",
-        "device_type": "mobile" if user_agent.is_mobile else "tablet" if user_agent.is_tablet else "desktop",
-        "device_name": user_agent.device.family
-    }
+    return (
+        ("browser", f"{user_agent.browser.family} {user_agent.browser.version_string}"),
+        ("os", f"{user_agent.os.family} {user_agent.os.version_string}"),
+        ("device_type", "mobile" if user_agent.is_mobile else "tablet" if user_agent.is_tablet else "desktop"),
+        ("device_name", user_agent.device.family)
+    )
 
-async def get_or_create_device(user_id: str, ip_address: str, user_agent: str) -> UserDevice:
-    """Get existing device or create new one"""
+def parse_user_agent(user_agent_string: str) -> Dict[str, str]:
+    """Parse user agent string to extract device information (memoized)"""
+    return dict(_parse_user_agent_cached(user_agent_string))
+
+def build_device(user_id: str, ip_address: str, user_agent: str) -> UserDevice:
+    """Device for a user agent; the id is a fingerprint, so no lookup is needed"""
     device_info = parse_user_agent(user_agent)
     
     # Create device fingerprint
@@ -253,35 +301,32 @@ async def get_or_create_device(user_id: str, ip_address: str, user_agent: str) -
         f"{device_info['browser']}{device_info['os']}{user_agent}".encode()
     ).hexdigest()
     
-    # Try to find existing device
-    existing_device = await db.user_devices.find_one({
-        "user_id": user_id,
-        "id": device_fingerprint  # Use fingerprint as device ID
-    })
-    
-    if existing_device:
-        # Update last used
-        await db.user_devices.update_one(
-            {"id": device_fingerprint},
-            {"$set": {"last_used": datetime.utcnow(), "ip_address": ip_address}}
-        )
-        return UserDevice(**existing_device)
-    else:
-        # Create new device
-        device = UserDevice(
-            id=device_fingerprint,
-            user_id=user_id,
-            device_name=device_info["device_name"],
-            device_type=device_info["device_type"],
-            browser=device_info["browser"],
-            os=device_info["os"],
-            ip_address=ip_address,
-            user_agent=user_agent,
-            is_trusted=False  # New devices are not trusted by default
-        )
-        
-        await db.user_devices.insert_one(device.dict())
-        return device
+    return UserDevice(
+        id=device_fingerprint,
+        user_id=user_id,
+        device_name=device_info["device_name"],
+        device_type=device_info["device_type"],
+        browser=device_info["browser"],
+        os=device_info["os"],
+        ip_address=ip_address,
+        user_agent=user_agent,
+        is_trusted=False  # New devices are not trusted by default
+    )
+
+async def get_or_create_device(user_id: str, ip_address: str, user_agent: str) -> UserDevice:
+    """Get existing device or create new one (single upsert round trip)"""
+    device = build_device(user_id, ip_address, user_agent)
+    device_doc = device.dict()
+    touched = {"last_used": device_doc.pop("last_used"), "ip_address": device_doc.pop("ip_address")}
+    
+    existing_device = await db.user_devices.find_one_and_update(
+        {"user_id": user_id, "id": device.id},  # Use fingerprint as device ID
+        {"$set": touched, "$setOnInsert": device_doc},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    return UserDevice(**existing_device) if existing_device else device
 
 async def create_security_notification(user_id: str, notification_type: str, title: str, message: str, metadata: Dict = None):
     """Create a security notification for the user"""
@@ -294,9 +339,9 @@ async def create_security_notification(user_id: str, notification_type: str, tit
     )
     await db.security_notifications.insert_one(notification.dict())
 
-async def create_session(user_id: str, device_id: str, ip_address: str, user_agent: str) -> str:
+async def create_session(user_id: str, device_id: str, ip_address: str, user_agent: str, session_token: Optional[str] = None) -> str:
     """Create a new user session"""
-    session_token = str(uuid.uuid4())
+    session_token = session_token or str(uuid.uuid4())
     expires_at = datetime.utcnow() + timedelta(days=7)  # 7 days expiry
     
     session = UserSession(
@@ -311,12 +356,76 @@ async def create_session(user_id: str, device_id: str, ip_address: str, user_age
     await db.user_sessions.insert_one(session.dict())
     return session_token
 
+# Post-login writes still running (referenced so they are not garbage collected)
+login_background_tasks: Set[asyncio.Task] = set()
+
+def run_login_task(coro, description: str):
+    """Run a post-login write without delaying the response; failures are logged"""
+    async def run():
+        try:
+            await coro
+        except Exception as e:
+            logger.error(f"Error {description}: {str(e)}")
+    
+    task = asyncio.create_task(run())
+    login_background_tasks.add(task)
+    task.add_done_callback(login_background_tasks.discard)
+
+async def _record_login(
+    user_id: str, email: str, ip_address: str, user_agent: str,
+    notifications: Callable[[UserDevice, str], List[Tuple[str, str, str, Dict]]],
+    update_last_login: bool
+):
+    session_token = str(uuid.uuid4())
+    writes = [
+        get_or_create_device(user_id, ip_address, user_agent),
+        track_login_attempt(email, ip_address, user_agent, True),
+    ]
+    if update_last_login:
+        writes.append(db.users.update_one({"id": user_id}, {"$set": {"last_login": datetime.utcnow()}}))
+    device, *_ = await asyncio.gather(*writes)
+    
+    pending = [
+        SecurityNotification(
+            user_id=user_id, notification_type=notification_type,
+            title=title, message=message, metadata=metadata
+        ).dict()
+        for notification_type, title, message, metadata in notifications(device, session_token)
+    ]
+    await asyncio.gather(
+        create_session(user_id, device.id, ip_address, user_agent, session_token),
+        db.security_notifications.insert_many(pending) if pending else asyncio.sleep(0)
+    )
+
+def record_login(
+    user_id: str, email: str, ip_address: str, user_agent: str,
+    notifications: Callable[[UserDevice, str], List[Tuple[str, str, str, Dict]]],
+    update_last_login: bool = False
+):
+    """
+    Device, session, audit and security notification writes for a successful
+    login, run concurrently after the token is returned. `notifications` maps
+    (device, session_token) to (type, title, message, metadata) tuples.
+    """
+    run_login_task(
+        _record_login(user_id, email, ip_address, user_agent, notifications, update_last_login),
+        f"recording login for {user_id}"
+    )
+
+async def record_hashtag_stats(old_poll: Optional[Dict], new_poll: Optional[Dict]):
+    """Hashtag counters are derived data: never fail a poll write that already committed"""
+    try:
+        await hashtag_stats.record_poll(old_poll, new_poll)
+    except Exception as e:
+        logger.error(f"Error updating hashtag statistics: {str(e)}")
+
 def get_client_ip(request: Request) -> str:
-    """Get client IP address from request"""
-    x_forwarded_for = request.headers.get('x-forwarded-for')
-    if x_forwarded_for:
-        return x_forwarded_for.split(',')[0]
-    return request.client.host
+    """Get client IP address from request (X-Forwarded-For only via trusted proxies)"""
+    from admission_control import resolve_client_ip
+    return resolve_client_ip(
+        request.client.host if request.client else None,
+        request.headers.get('x-forwarded-for')
+    )
 
 # =============  GOOGLE OAUTH UTILITIES =============
 
@@ -382,6 +491,10 @@ async def create_or_get_oauth_user(oauth_data: Dict, ip_address: str, user_agent
         )
         
         await db.users.insert_one(user.dict())
+        search_index.upsert("users", user.dict())
+        fuzzy_user_index.upsert(user.dict())
+        search_cache.invalidate_for(user.dict())
+        autocomplete_engine.upsert_user(user.dict())
         
         # Create user profile
         profile = UserProfile(id=user.id, username=user.username)
@@ -615,49 +728,139 @@ async def search_itunes_track(artist: str, track: str):
     try:
         # Construct search query
         query = f"{artist} {track}".strip()
-        url = "https://itunes.apple.com/search"
-        params = {
-            'term': query,
-            'media': 'music',
-            'entity': 'song',
-            'limit': 1,
-            'country': 'US',  # Can be changed to ES for Spanish market
-            'callback': ''  # Disable JSONP to get pure JSON
-        }
+        results = await itunes_client.search(query, limit=1)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                if response.status == 200:
-                    # Get text and parse as JSON (iTunes returns JSONP by default)
-                    text = await response.text()
-                    
-                    # If it starts with a function call, extract JSON
-                    if text.strip().startswith('(') or 'callback' in text:
-                        # Find JSON part
-                        start = text.find('{')
-                        end = text.rfind('}') + 1
-                        if start >= 0 and end > start:
-                            text = text[start:end]
-                    
-                    import json
-                    data = json.loads(text)
-                    
-                    if data.get('results') and len(data['results']) > 0:
-                        result = data['results'][0]
-                        return {
-                            'preview_url': result.get('previewUrl'),
-                            'artwork_url': result.get('artworkUrl100', '').replace('100x100', '400x400'),
-                            'artist_name': result.get('artistName'),
-                            'track_name': result.get('trackName'),
-                            'duration_ms': result.get('trackTimeMillis', 30000),
-                            'genre': result.get('primaryGenreName'),
-                            'iTunes_id': result.get('trackId')
-                        }
+        if results:
+            result = results[0]
+            return {
+                'preview_url': result.get('previewUrl'),
+                'artwork_url': result.get('artworkUrl100', '').replace('100x100', '400x400'),
+                'artist_name': result.get('artistName'),
+                'track_name': result.get('trackName'),
+                'duration_ms': result.get('trackTimeMillis', 30000),
+                'genre': result.get('primaryGenreName'),
+                'iTunes_id': result.get('trackId')
+            }
         return None
     except Exception as e:
         print(f"Error searching iTunes: {e}")
         return None
 
+def itunes_music_info(music_id: str, result: Dict) -> Dict:
+    """Music info for an iTunes lookup result"""
+    return {
+        'id': music_id,
+        'title': result.get('trackName'),
+        'artist': result.get('artistName'),
+        'duration': 30,  # iTunes previews are 30 seconds
+        'url': '',  # No local URL for iTunes tracks
+        'preview_url': result.get('previewUrl'),
+        'cover': result.get('artworkUrl100', '').replace('100x100bb.jpg', '400x400bb.jpg'),
+        'category': result.get('primaryGenreName', 'Music'),
+        'isOriginal': False,
+        'isTrending': False,
+        'uses': 0,  # Default for iTunes tracks
+        'source': 'iTunes'
+    }
+
+async def fetch_itunes_tracks(track_ids: List[str]) -> Dict[str, Dict]:
+    """iTunes track id -> music info, fetched with one lookup?id=a,b,c request per batch"""
+    results = await itunes_client.lookup_many(track_ids)
+    return {track_id: itunes_music_info(f"itunes_{track_id}", result) for track_id, result in results.items()}
+
+# iTunes music metadata: per-worker LRU over the persistent `music_metadata` collection
+from music_cache import init_music_cache
+music_cache = init_music_cache(db, fetch_itunes_tracks)
+
+USER_AUDIO_UUID_PATTERN = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+
+def user_audio_id_for(music_id: str) -> Optional[str]:
+    """user_audio id behind a music_id: user_audio_<uuid>, or a bare UUID (older posts)"""
+    if music_id.startswith('user_audio_'):
+        return music_id.replace('user_audio_', '')
+    if USER_AUDIO_UUID_PATTERN.match(music_id):
+        return music_id
+    return None
+
+def user_audio_music_info(music_id: str, user_audio: Dict) -> Dict:
+    """Music info for a user-uploaded audio document"""
+    return {
+        'id': music_id,  # Keep original ID for consistency
+        'title': user_audio.get('title'),
+        'artist': user_audio.get('artist'),
+        'duration': user_audio.get('duration', 0),
+        'url': user_audio.get('public_url'),
+        'preview_url': user_audio.get('public_url'),
+        'cover': user_audio.get('cover_url'),  # May be None
+        'category': 'User Audio',
+        'isOriginal': True,
+        'isTrending': False,
+        'uses': user_audio.get('uses_count', 0),
+        'source': 'User Upload',
+        'isUserUploaded': True,
+        'uploader': {
+            'id': user_audio.get('uploader_id'),
+            'username': user_audio.get('artist'),  # Artist is usually the uploader's display name
+        }
+    }
+
+async def fetch_user_audio_infos(music_ids_by_audio_id: Dict[str, str]) -> Dict[str, Dict]:
+    """music_id -> music info for user audios, in one $in query"""
+    user_audios = await db.user_audio.find(
+        {"id": {"$in": list(music_ids_by_audio_id)}}, {"_id": 0}
+    ).to_list(len(music_ids_by_audio_id))
+    return {
+        music_ids_by_audio_id[user_audio["id"]]: user_audio_music_info(music_ids_by_audio_id[user_audio["id"]], user_audio)
+        for user_audio in user_audios
+    }
+
+async def get_music_info_batch(music_ids) -> Dict[str, Dict]:
+    """
+    music_id -> music info for a page of polls/stories. Uncached iTunes ids are
+    fetched together in one lookup?id=a,b,c request, user audios with one $in
+    query; static library ids resolve concurrently.
+    """
+    unique_ids = list(dict.fromkeys(music_id for music_id in music_ids if music_id))
+    itunes_ids = {
+        music_id.replace('itunes_', ''): music_id for music_id in unique_ids if music_id.startswith('itunes_')
+    }
+    user_audio_ids = {}
+    library_ids = []
+    for music_id in unique_ids:
+        if music_id.startswith('itunes_'):
+            continue
+        user_audio_id = user_audio_id_for(music_id)
+        if user_audio_id:
+            user_audio_ids[user_audio_id] = music_id
+        else:
+            library_ids.append(music_id)
+    
+    lookups = [get_music_info(music_id) for music_id in library_ids]
+    if user_audio_ids:
+        lookups.append(fetch_user_audio_infos(user_audio_ids))
+    if itunes_ids:
+        lookups.append(music_cache.get_many(itunes_ids.keys()))
+    results = await asyncio.gather(*lookups, return_exceptions=True)
+    
+    music_by_id = {}
+    for music_id, music_info in zip(library_ids, results):
+        if music_info and not isinstance(music_info, Exception):
+            music_by_id[music_id] = music_info
+    results = results[len(library_ids):]
+    if user_audio_ids:
+        user_audio_infos = results.pop(0)
+        if isinstance(user_audio_infos, Exception):
+            print(f"❌ Error fetching user audios: {str(user_audio_infos)}")
+        else:
+            music_by_id.update(user_audio_infos)
+    if itunes_ids:
+        if isinstance(results[0], Exception):
+            print(f"❌ Error fetching iTunes tracks: {str(results[0])}")
+        else:
+            for itunes_track_id, music_info in results[0].items():
+                music_by_id[itunes_ids[itunes_track_id]] = music_info
+    return music_by_id
+
 async def get_music_info(music_id: str):
     """
     Get music information by ID with automatic iTunes preview fetching
@@ -672,72 +875,19 @@ async def get_music_info(music_id: str):
             # Extract iTunes track ID
             itunes_track_id = music_id.replace('itunes_', '')
             
-            # Check cache first
-            if itunes_track_id in itunes_cache and is_cache_valid(itunes_cache[itunes_track_id]):
-                print(f"🎵 Using cached iTunes track info for ID: {itunes_track_id}")
-                return itunes_cache[itunes_track_id]['data']
-            
-            print(f"🎵 Fetching iTunes track info for ID: {itunes_track_id}")
-            
-            # Fetch track info directly from iTunes API using track ID
-            url = f"https://itunes.apple.com/lookup?id={itunes_track_id}"
+            # Memory / MongoDB cache, iTunes only when missing (stale entries refresh in background)
+            music_info = (await music_cache.get_many([itunes_track_id])).get(itunes_track_id)
+            if not music_info:
+                print(f"❌ No results found for iTunes track ID: {itunes_track_id}")
+                return None
             
-            import httpx
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, timeout=10.0)
-                if response.status_code == 200:
-                    data = response.json()
-                    results = data.get('results', [])
-                    if results:
-                        result = results[0]
-                        music_info = {
-                            'id': music_id,
-                            'title': result.get('trackName'),
-                            'artist': result.get('artistName'),
-                            'duration': 30,  # iTunes previews are 30 seconds
-                            'url': '',  # No local URL for iTunes tracks
-                            'preview_url': result.get('previewUrl'),
-                            'cover': result.get('artworkUrl100', '').replace('100x100bb.jpg', '400x400bb.jpg'),
-                            'category': result.get('primaryGenreName', 'Music'),
-                            'isOriginal': False,
-                            'isTrending': False,
-                            'uses': 0,  # Default for iTunes tracks
-                            'source': 'iTunes'
-                        }
-                        print(f"✅ Successfully fetched iTunes track: {music_info['title']} - {music_info['artist']}")
-                        
-                        # Cache the result
-                        itunes_cache[itunes_track_id] = {
-                            'data': music_info,
-                            'cached_at': datetime.utcnow()
-                        }
-                        
-                        return music_info
-                    else:
-                        print(f"❌ No results found for iTunes track ID: {itunes_track_id}")
-                        return None
-                else:
-                    print(f"❌ iTunes API error: {response.status_code}")
-                    return None
+            return music_info
         except Exception as e:
             print(f"❌ Error fetching iTunes track {music_id}: {str(e)}")
             return None
     
-    # Check if this is a user audio ID (format: user_audio_XXXXX)
-    user_audio_id = None
-    
-    if music_id.startswith('user_audio_'):
-        # New format with prefix - extract UUID
-        user_audio_id = music_id.replace('user_audio_', '')
-        print(f"🎵 Fetching user audio info for prefixed ID: {user_audio_id}")
-    else:
-        # Check if this looks like a UUID (backward compatibility)
-        # UUID format: xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx (36 chars with 4 hyphens)
-        import re
-        uuid_pattern = r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$'
-        if re.match(uuid_pattern, music_id):
-            user_audio_id = music_id
-            print(f"🔄 Detected bare UUID (backward compatibility): {user_audio_id}")
+    # Check if this is a user audio ID (format: user_audio_XXXXX, or a bare UUID)
+    user_audio_id = user_audio_id_for(music_id)
     
     if user_audio_id:
         try:
@@ -746,26 +896,7 @@ async def get_music_info(music_id: str):
             print(f"🔍 Database query result: {user_audio is not None}")
             
             if user_audio:
-                print(f"📝 Found user audio: {user_audio.get('title')} by {user_audio.get('artist')}")
-                music_info = {
-                    'id': music_id,  # Keep original ID for consistency
-                    'title': user_audio.get('title'),
-                    'artist': user_audio.get('artist'),
-                    'duration': user_audio.get('duration', 0),
-                    'url': user_audio.get('public_url'),
-                    'preview_url': user_audio.get('public_url'),
-                    'cover': user_audio.get('cover_url'),  # May be None
-                    'category': 'User Audio',
-                    'isOriginal': True,
-                    'isTrending': False,
-                    'uses': user_audio.get('uses_count', 0),
-                    'source': 'User Upload',
-                    'isUserUploaded': True,
-                    'uploader': {
-                        'id': user_audio.get('uploader_id'),
-                        'username': user_audio.get('artist'),  # Artist is usually the uploader's display name
-                    }
-                }
+                music_info = user_audio_music_info(music_id, user_audio)
                 print(f"✅ Successfully fetched user audio: {music_info['title']} - {music_info['artist']}")
                 return music_info
             else:
@@ -1030,19 +1161,7 @@ async def search_music_realtime(
             }
         
         # Use iTunes Search API with more flexible search
-        url = "https://itunes.apple.com/search"
-        params = {
-            'term': query,
-            'media': 'music',
-            'entity': 'song',
-            'limit': limit,
-            'country': 'US'  # Can be changed to support different countries
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+        data = {'results': await itunes_client.search(query, limit=limit)}
         
         results = []
         if 'results' in data:
@@ -1083,6 +1202,12 @@ async def search_music_realtime(
             'message': 'Search timeout - please try again',
             'results': []
         }
+    except ITunesUnavailable:
+        return {
+            'success': False,
+            'message': 'Music search is temporarily unavailable - please try again',
+            'results': []
+        }
     except Exception as e:
         print(f"Error in real-time music search: {e}")
         return {
@@ -1370,19 +1495,8 @@ async def check_chat_permission(sender_id: str, receiver_id: str) -> bool:
     Check if users can chat directly or need permission
     Returns True if they can chat directly, False if permission is needed
     """
-    # Check if users are following each other (mutual follow = can chat directly)
-    sender_follows_receiver = await db.follows.find_one({
-        "follower_id": sender_id,
-        "following_id": receiver_id
-    })
-    
-    receiver_follows_sender = await db.follows.find_one({
-        "follower_id": receiver_id,
-        "following_id": sender_id
-    })
-    
-    # If they follow each other, they can chat directly
-    if sender_follows_receiver and receiver_follows_sender:
+    # Mutual follow = can chat directly (answered from the in-memory follow graph)
+    if await follow_graph.is_mutual(sender_id, receiver_id):
         return True
     
     # Check if there's an existing accepted chat request
@@ -1401,13 +1515,9 @@ async def check_chat_permission(sender_id: str, receiver_id: str) -> bool:
 
 # =============  NOTIFICATION UTILITIES =============
 
-async def send_mention_notifications(mentioned_users: List[str], poll_id: str, current_user: UserResponse):
-    """Send notifications to mentioned users"""
-    # TODO: Implement notification system for mentioned users
-    # This is a placeholder function that will be implemented later
-    # For now, we'll just log the mentions
-    print(f"Sending mention notifications to {mentioned_users} for poll {poll_id} by user {current_user.username}")
-    pass
+async def send_mention_notifications(mentioned_users: List[str], poll: Dict, current_user: UserResponse):
+    """Send notifications to mentioned users (queued into their activity inbox)"""
+    activity_feed.record_mentions(poll, mentioned_users)
 
 # Basic API endpoint
 @api_router.get("/")
@@ -1447,7 +1557,7 @@ async def register(user_data: UserCreate, request: Request):
         )
     
     # Create user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     user = User(
         email=user_data.email,
         username=user_data.username,
@@ -1458,6 +1568,10 @@ async def register(user_data: UserCreate, request: Request):
     
     # Insert user
     await db.users.insert_one(user.dict())
+    search_index.upsert("users", user.dict())
+    fuzzy_user_index.upsert(user.dict())
+    search_cache.invalidate_for(user.dict())
+    autocomplete_engine.upsert_user(user.dict())
     
     # Create user profile
     profile = UserProfile(
@@ -1468,30 +1582,23 @@ async def register(user_data: UserCreate, request: Request):
     )
     await db.user_profiles.insert_one(profile.dict())
     
-    # Get or create device for registration
-    device = await get_or_create_device(user.id, ip_address, user_agent)
-    
-    # Track successful registration
-    await track_login_attempt(user_data.email, ip_address, user_agent, True)
+    # Device, session, audit and welcome notification are written after the response
+    record_login(
+        user.id, user_data.email, ip_address, user_agent,
+        lambda device, session_token: [(
+            "account_created",
+            "Welcome!",
+            f"Your account has been created successfully from {device.device_name}",
+            {
+                "device_id": device.id,
+                "ip_address": ip_address
+            }
+        )]
+    )
     
     # Generate token
     access_token = create_access_token(data={"sub": user.id})
     
-    # Create session
-    session_token = await create_session(user.id, device.id, ip_address, user_agent)
-    
-    # Create welcome notification
-    await create_security_notification(
-        user.id,
-        "account_created",
-        "Welcome!",
-        f"Your account has been created successfully from {device.device_name}",
-        {
-            "device_id": device.id,
-            "ip_address": ip_address
-        }
-    )
-    
     return Token(
         access_token=access_token,
         token_type="bearer",
@@ -1529,7 +1636,12 @@ async def login(login_data: UserLogin, request: Request):
         )
     
     # Verify password (skip for OAuth users)
-    if user_data.get("hashed_password") and not verify_password(login_data.password, user_data["hashed_password"]):
+    password_valid, upgraded_hash = False, None
+    if user_data.get("hashed_password"):
+        password_valid, upgraded_hash = await verify_and_update_password(
+            login_data.password, user_data["hashed_password"]
+        )
+    if user_data.get("hashed_password") and not password_valid:
         await track_login_attempt(
             login_data.email, ip_address, user_agent,
             False, "Invalid password"
@@ -1548,51 +1660,51 @@ async def login(login_data: UserLogin, request: Request):
             detail="This account uses social login. Please use Google sign-in."
         )
     
-    # Get or create device
-    device = await get_or_create_device(user_data["id"], ip_address, user_agent)
+    # Hash made with outdated parameters: store the upgraded one (compare-and-set)
+    if upgraded_hash:
+        run_login_task(
+            db.users.update_one(
+                {"id": user_data["id"], "hashed_password": user_data["hashed_password"]},
+                {"$set": {"hashed_password": upgraded_hash}}
+            ),
+            f"upgrading password hash for {user_data['id']}"
+        )
     
-    # Check if this is a new device
-    if not device.is_trusted:
-        await create_security_notification(
-            user_data["id"],
-            "new_device",
-            "New Device Login",
-            f"Login detected from new device: {device.device_name} ({device.browser})",
+    def login_notifications(device: UserDevice, session_token: str):
+        notifications = []
+        # Check if this is a new device
+        if not device.is_trusted:
+            notifications.append((
+                "new_device",
+                "New Device Login",
+                f"Login detected from new device: {device.device_name} ({device.browser})",
+                {
+                    "device_id": device.id,
+                    "ip_address": ip_address,
+                    "location": "Unknown"  # You could add IP geolocation here
+                }
+            ))
+        notifications.append((
+            "new_login",
+            "New Login",
+            f"Successful login from {device.device_name} ({device.browser})",
             {
                 "device_id": device.id,
                 "ip_address": ip_address,
-                "location": "Unknown"  # You could add IP geolocation here
+                "session_token": session_token
             }
-        )
+        ))
+        return notifications
     
-    # Update last login
-    await db.users.update_one(
-        {"id": user_data["id"]},
-        {"$set": {"last_login": datetime.utcnow()}}
+    # Device, last login, session, audit and notifications are written after the response
+    record_login(
+        user_data["id"], login_data.email, ip_address, user_agent,
+        login_notifications, update_last_login=True
     )
     
-    # Track successful login
-    await track_login_attempt(login_data.email, ip_address, user_agent, True)
-    
     # Generate token
     access_token = create_access_token(data={"sub": user_data["id"]})
     
-    # Create session
-    session_token = await create_session(user_data["id"], device.id, ip_address, user_agent)
-    
-    # Create login notification
-    await create_security_notification(
-        user_data["id"],
-        "new_login",
-        "New Login",
-        f"Successful login from {device.device_name} ({device.browser})",
-        {
-            "device_id": device.id,
-            "ip_address": ip_address,
-            "session_token": session_token
-        }
-    )
-    
     return Token(
         access_token=access_token,
         token_type="bearer", 
@@ -1620,46 +1732,39 @@ async def oauth_google_callback(session_id: str, request: Request):
         # Create or get existing user
         user = await create_or_get_oauth_user(oauth_data, ip_address, user_agent)
         
-        # Get or create device
-        device = await get_or_create_device(user.id, ip_address, user_agent)
-        
-        # Check if this is a new device
-        if not device.is_trusted:
-            await create_security_notification(
-                user.id,
-                "new_device",
-                "New Device Login",
-                f"Google login from new device: {device.device_name} ({device.browser})",
+        def login_notifications(device: UserDevice, session_token: str):
+            notifications = []
+            # Check if this is a new device
+            if not device.is_trusted:
+                notifications.append((
+                    "new_device",
+                    "New Device Login",
+                    f"Google login from new device: {device.device_name} ({device.browser})",
+                    {
+                        "device_id": device.id,
+                        "ip_address": ip_address,
+                        "oauth_provider": "google"
+                    }
+                ))
+            notifications.append((
+                "new_login", 
+                "Google Login",
+                f"Successful Google login from {device.device_name} ({device.browser})",
                 {
                     "device_id": device.id,
                     "ip_address": ip_address,
-                    "oauth_provider": "google"
+                    "oauth_provider": "google",
+                    "session_token": session_token
                 }
-            )
+            ))
+            return notifications
         
-        # Track successful login
-        await track_login_attempt(user.email, ip_address, user_agent, True)
+        # Device, session, audit and notifications are written after the response
+        record_login(user.id, user.email, ip_address, user_agent, login_notifications)
         
         # Generate JWT token
         access_token = create_access_token(data={"sub": user.id})
         
-        # Create session
-        session_token = await create_session(user.id, device.id, ip_address, user_agent)
-        
-        # Create login notification
-        await create_security_notification(
-            user.id,
-            "new_login", 
-            "Google Login",
-            f"Successful Google login from {device.device_name} ({device.browser})",
-            {
-                "device_id": device.id,
-                "ip_address": ip_address,
-                "oauth_provider": "google",
-                "session_token": session_token
-            }
-        )
-        
         return Token(
             access_token=access_token,
             token_type="bearer",
@@ -1832,6 +1937,10 @@ async def update_profile(
     
     # Return updated user
     updated_user = await db.users.find_one({"id": current_user.id})
+    search_index.upsert("users", updated_user)
+    fuzzy_user_index.upsert(updated_user)
+    search_cache.invalidate_for(current_user.dict(), updated_user)
+    autocomplete_engine.upsert_user(updated_user)
     return UserResponse(**updated_user)
 
 @api_router.put("/auth/password")
@@ -1857,11 +1966,11 @@ async def change_password(
         )
     
     # Verify current password
-    if not verify_password(password_data.current_password, user_data["hashed_password"]):
+    if not await verify_password_async(password_data.current_password, user_data["hashed_password"]):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
     # Hash new password
-    new_hashed_password = get_password_hash(password_data.new_password)
+    new_hashed_password = await get_password_hash_async(password_data.new_password)
     
     # Update password in database
     result = await db.users.update_one(
@@ -2136,14 +2245,13 @@ async def search_users(q: str = "", current_user: UserResponse = Depends(get_cur
 
 # =============  UNIVERSAL SEARCH ENDPOINTS =============
 
-from difflib import SequenceMatcher
 import re
 
 def calculate_similarity(a, b):
-    """Calculate similarity between two strings for fuzzy search"""
+    """Calculate similarity between two strings for fuzzy search (trigram Dice coefficient)"""
     if not a or not b:
         return 0.0
-    return SequenceMatcher(None, str(a).lower(), str(b).lower()).ratio()
+    return trigram_similarity(str(a), str(b))
 
 def extract_hashtags_from_text(text):
     """Extract hashtags from text content"""
@@ -2200,50 +2308,18 @@ async def universal_search(
     if len(query) > config.SEARCH_CONFIG['MAX_QUERY_LENGTH']:
         return {"success": False, "error": "Query too long"}
         
-    query_lower = query.lower()
-    results = []
-    
     try:
-        # OPTIMIZATION: Run searches concurrently for better performance
-        import asyncio
-        
-        tasks = []
-        
-        # Search Users
-        if filter_type in [config.SEARCH_CONFIG['DEFAULT_FILTER'], config.SEARCH_CONFIG['AVAILABLE_FILTERS'][1]]:
-            tasks.append(search_users_optimized(query_lower, current_user.id, limit))
-        
-        # Search Posts  
-        if filter_type in [config.SEARCH_CONFIG['DEFAULT_FILTER'], config.SEARCH_CONFIG['AVAILABLE_FILTERS'][2]]:
-            tasks.append(search_posts_optimized(query_lower, current_user.id, limit))
-        
-        # Search Hashtags
-        if filter_type in [config.SEARCH_CONFIG['DEFAULT_FILTER'], config.SEARCH_CONFIG['AVAILABLE_FILTERS'][3]]:
-            tasks.append(search_hashtags_optimized(query_lower, current_user.id, limit))
-        
-        # Search Sounds/Music
-        if filter_type in [config.SEARCH_CONFIG['DEFAULT_FILTER'], config.SEARCH_CONFIG['AVAILABLE_FILTERS'][4]]:
-            tasks.append(search_sounds_optimized(query, current_user.id, limit))
-        
-        # Execute all searches concurrently
-        if tasks:
-            search_results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Combine results from all successful searches
-            for result in search_results:
-                if isinstance(result, list):  # Only process successful results
-                    results.extend(result)
-        
-        # Sort results
-        if sort_by == "popularity":
-            results.sort(key=lambda x: x.get("popularity_score", 0), reverse=True)
-        elif sort_by == "recent":
-            results.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-        else:  # relevance
-            results.sort(key=lambda x: x.get("relevance_score", 0), reverse=True)
+        # Shared across viewers: computed without the viewer, who is filtered out below
+        shared_results = await search_cache.get_or_compute(
+            "universal", query, (filter_type, sort_by, limit),
+            lambda: compute_universal_results(query, filter_type, sort_by, limit)
+        )
         
         # Limit final results
-        results = results[:limit]
+        results = [
+            r for r in shared_results
+            if not (r.get("type") == "user" and r.get("id") == current_user.id)
+        ][:limit]
         
         return {
             "success": True,
@@ -2258,20 +2334,75 @@ async def universal_search(
         logger.error(f"Error in universal search: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
 
+async def compute_universal_results(query: str, filter_type: str, sort_by: str, limit: int):
+    """Viewer-independent universal search results (limit + 1, so removing the viewer still fills the page)"""
+    query_lower = query.lower()
+    results = []
+    # No viewer to exclude - the caller filters its own user out
+    anonymous_viewer = ""
+    
+    # OPTIMIZATION: Run searches concurrently for better performance
+    tasks = []
+    
+    # Search Users
+    if filter_type in [config.SEARCH_CONFIG['DEFAULT_FILTER'], config.SEARCH_CONFIG['AVAILABLE_FILTERS'][1]]:
+        tasks.append(search_users_optimized(query_lower, anonymous_viewer, limit + 1))
+    
+    # Search Posts  
+    if filter_type in [config.SEARCH_CONFIG['DEFAULT_FILTER'], config.SEARCH_CONFIG['AVAILABLE_FILTERS'][2]]:
+        tasks.append(search_posts_optimized(query_lower, anonymous_viewer, limit))
+    
+    # Search Hashtags
+    if filter_type in [config.SEARCH_CONFIG['DEFAULT_FILTER'], config.SEARCH_CONFIG['AVAILABLE_FILTERS'][3]]:
+        tasks.append(search_hashtags_optimized(query_lower, anonymous_viewer, limit))
+    
+    # Search Sounds/Music
+    if filter_type in [config.SEARCH_CONFIG['DEFAULT_FILTER'], config.SEARCH_CONFIG['AVAILABLE_FILTERS'][4]]:
+        tasks.append(search_sounds_optimized(query, anonymous_viewer, limit))
+    
+    # Execute all searches concurrently
+    if tasks:
+        search_results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        # Combine results from all successful searches
+        for result in search_results:
+            if isinstance(result, list):  # Only process successful results
+                results.extend(result)
+    
+    # Sort results
+    if sort_by == "popularity":
+        results.sort(key=lambda x: x.get("popularity_score", 0), reverse=True)
+    elif sort_by == "recent":
+        results.sort(key=lambda x: x.get("created_at", ""), reverse=True)
+    else:  # relevance
+        results.sort(key=lambda x: x.get("relevance_score", 0), reverse=True)
+    
+    return results[:limit + 1]
+
 # =============  OPTIMIZED SEARCH FUNCTIONS =============
 
 async def search_posts_optimized(query: str, current_user_id: str, limit: int):
     """Optimized post search with minimal database operations"""
     try:
+        # Full-text index lookup; escaped regex only if the index is unavailable
+        ranked = await search_index.search("posts", query, limit * 2)
+        if ranked is not None:
+            index_scores = dict(ranked)
+            match_stage = {"id": {"$in": list(index_scores)}}
+        else:
+            index_scores = None
+            escaped_query = re.escape(query)
+            match_stage = {
+                "$or": [
+                    {"title": {"$regex": escaped_query, "$options": "i"}},
+                    {"content": {"$regex": escaped_query, "$options": "i"}}
+                ]
+            }
+        
         # Use aggregation pipeline for better performance
         pipeline = [
             {
-                "$match": {
-                    "$or": [
-                        {"title": {"$regex": query, "$options": "i"}},
-                        {"content": {"$regex": query, "$options": "i"}}
-                    ]
-                }
+                "$match": match_stage
             },
             {
                 "$limit": limit * 2  # Get more to ensure we have enough after processing
@@ -2315,13 +2446,18 @@ async def search_posts_optimized(query: str, current_user_id: str, limit: int):
         ]
         
         posts = await db.polls.aggregate(pipeline).to_list(limit * 2)
+        if index_scores is not None:
+            posts.sort(key=lambda p: index_scores.get(p["id"], 0), reverse=True)
         
         results = []
         for post in posts[:limit]:  # Limit results after processing
-            # Calculate simple relevance score
-            title_score = 2 if query in post.get("title", "").lower() else 0
-            content_score = 1 if query in post.get("content", "").lower() else 0
-            relevance_score = title_score + content_score
+            if index_scores is not None:
+                relevance_score = round(index_scores.get(post["id"], 0), 4)
+            else:
+                # Calculate simple relevance score
+                title_score = 2 if query in post.get("title", "").lower() else 0
+                content_score = 1 if query in post.get("content", "").lower() else 0
+                relevance_score = title_score + content_score
             
             # Get first image for thumbnail from poll options
             image_url = None
@@ -2419,18 +2555,32 @@ async def search_posts_optimized(query: str, current_user_id: str, limit: int):
 async def search_users_optimized(query: str, current_user_id: str, limit: int):
     """Optimized user search with minimal database operations"""
     try:
+        # Full-text index lookup; escaped regex only if the index is unavailable
+        ranked = await search_index.search("users", query, limit + 1)
+        if ranked is not None:
+            index_scores = {user_id: score for user_id, score in ranked if user_id != current_user_id}
+            if not index_scores:
+                # No exact/prefix hit: typo-tolerant trigram matches instead
+                fuzzy = await fuzzy_user_index.search(query, limit + 1)
+                index_scores = {user_id: score for user_id, score in fuzzy or [] if user_id != current_user_id}
+            name_match = {"id": {"$in": list(index_scores)}}
+        else:
+            index_scores = None
+            escaped_query = re.escape(query)
+            name_match = {
+                "$or": [
+                    {"username": {"$regex": escaped_query, "$options": "i"}},
+                    {"display_name": {"$regex": escaped_query, "$options": "i"}}
+                ]
+            }
+        
         # Use aggregation pipeline for better performance
         pipeline = [
             {
                 "$match": {
                     "$and": [
                         {"id": {"$ne": current_user_id}},
-                        {
-                            "$or": [
-                                {"username": {"$regex": query, "$options": "i"}},
-                                {"display_name": {"$regex": query, "$options": "i"}}
-                            ]
-                        }
+                        name_match
                     ]
                 }
             },
@@ -2463,13 +2613,18 @@ async def search_users_optimized(query: str, current_user_id: str, limit: int):
         ]
         
         users = await db.users.aggregate(pipeline).to_list(limit)
+        if index_scores is not None:
+            users.sort(key=lambda u: index_scores.get(u["id"], 0), reverse=True)
         
         results = []
         for user in users:
-            # Calculate simple relevance score
-            username_score = 2 if query in user.get("username", "").lower() else 0
-            display_name_score = 1.5 if query in user.get("display_name", "").lower() else 0
-            relevance_score = username_score + display_name_score
+            if index_scores is not None:
+                relevance_score = round(index_scores.get(user["id"], 0), 4)
+            else:
+                # Calculate simple relevance score
+                username_score = 2 if query in user.get("username", "").lower() else 0
+                display_name_score = 1.5 if query in user.get("display_name", "").lower() else 0
+                relevance_score = username_score + display_name_score
             
             results.append({
                 "type": "user",
@@ -2497,19 +2652,28 @@ async def search_hashtags_optimized(query: str, current_user_id: str, limit: int
         hashtag_query = query if query.startswith("#") else f"#{query}"
         query_without_hash = query.replace("#", "").strip()
         
+        # Hashtag terms (tags + #words in title/description) from the full-text index
+        ranked = await search_index.search("posts", f"#{query_without_hash}", limit * 2)
+        if ranked is not None:
+            index_scores = dict(ranked)
+            match_stage = {"id": {"$in": list(index_scores)}}
+        else:
+            index_scores = None
+            match_stage = {
+                "$or": [
+                    # Search in tags array (exact or partial match)
+                    {"tags": {"$regex": re.escape(query_without_hash), "$options": "i"}},
+                    # Search in title for hashtags
+                    {"title": {"$regex": re.escape(hashtag_query), "$options": "i"}},
+                    # Search in content field if exists
+                    {"content": {"$regex": re.escape(hashtag_query), "$options": "i"}}
+                ]
+            }
+        
         # Use aggregation pipeline similar to search_posts_optimized
         pipeline = [
             {
-                "$match": {
-                    "$or": [
-                        # Search in tags array (exact or partial match)
-                        {"tags": {"$regex": query_without_hash, "$options": "i"}},
-                        # Search in title for hashtags
-                        {"title": {"$regex": hashtag_query, "$options": "i"}},
-                        # Search in content field if exists
-                        {"content": {"$regex": hashtag_query, "$options": "i"}}
-                    ]
-                }
+                "$match": match_stage
             },
             {
                 "$limit": limit * 2  # Get more to ensure we have enough after processing
@@ -2554,17 +2718,22 @@ async def search_hashtags_optimized(query: str, current_user_id: str, limit: int
         ]
         
         posts = await db.polls.aggregate(pipeline).to_list(limit * 2)
+        if index_scores is not None:
+            posts.sort(key=lambda p: index_scores.get(p["id"], 0), reverse=True)
         
         results = []
         for post in posts[:limit]:  # Limit results after processing
-            # Calculate relevance score based on hashtag match
-            relevance_score = 0
-            if query_without_hash.lower() in [tag.lower() for tag in post.get("tags", [])]:
-                relevance_score += 3  # Higher score for exact tag match
-            if hashtag_query.lower() in post.get("title", "").lower():
-                relevance_score += 2
-            if hashtag_query.lower() in post.get("content", "").lower():
-                relevance_score += 1
+            if index_scores is not None:
+                relevance_score = round(index_scores.get(post["id"], 0), 4)
+            else:
+                # Calculate relevance score based on hashtag match
+                relevance_score = 0
+                if query_without_hash.lower() in [tag.lower() for tag in post.get("tags", [])]:
+                    relevance_score += 3  # Higher score for exact tag match
+                if hashtag_query.lower() in post.get("title", "").lower():
+                    relevance_score += 2
+                if hashtag_query.lower() in post.get("content", "").lower():
+                    relevance_score += 1
             
             # Get first image for thumbnail from poll options
             image_url = None
@@ -2654,21 +2823,90 @@ async def search_hashtags_optimized(query: str, current_user_id: str, limit: int
         logger.error(f"Error in optimized hashtag search: {str(e)}")
         return []
 
+async def count_polls_by_audio(audio_ids: List[str]) -> Dict[str, int]:
+    """Posts using each audio, in one grouped aggregation instead of a count per sound"""
+    if not audio_ids:
+        return {}
+    wanted = set(audio_ids)
+    music_ids = audio_ids + [f"user_audio_{audio_id}" for audio_id in audio_ids]
+    pipeline = [
+        {"$match": {"$or": [
+            {"music.id": {"$in": audio_ids}},
+            {"music_id": {"$in": music_ids}},
+            {"user_audio_id": {"$in": audio_ids}}
+        ]}},
+        {"$group": {
+            "_id": {"music": "$music.id", "music_id": "$music_id", "user_audio_id": "$user_audio_id"},
+            "count": {"$sum": 1}
+        }}
+    ]
+    counts = {audio_id: 0 for audio_id in audio_ids}
+    async for group in db.polls.aggregate(pipeline):
+        refs = group["_id"]
+        music_id = refs.get("music_id")
+        if isinstance(music_id, str) and music_id.startswith("user_audio_"):
+            music_id = music_id[len("user_audio_"):]
+        # A poll referencing the same audio through several fields counts once
+        for audio_id in {refs.get("music"), music_id, refs.get("user_audio_id")} & wanted:
+            counts[audio_id] += group["count"]
+    return counts
+
+# Most used poll music with resolved info, shared by every sound search until it expires
+popular_poll_music = {"entries": [], "expires_at": datetime.min}
+popular_poll_music_lock = asyncio.Lock()
+
+async def get_popular_poll_music() -> List[Dict]:
+    """
+    [{music_id, count, info}] for the music most used in polls, by post count.
+    The grouped aggregation over polls runs at most once per TTL per worker and
+    the ids are resolved together with get_music_info_batch.
+    """
+    if datetime.utcnow() < popular_poll_music["expires_at"]:
+        return popular_poll_music["entries"]
+    async with popular_poll_music_lock:
+        if datetime.utcnow() < popular_poll_music["expires_at"]:
+            return popular_poll_music["entries"]
+        music_limit = config.SEARCH_CONFIG['POPULAR_MUSIC_LIMIT']
+        music_groups = await db.polls.aggregate([
+            {"$match": {"music_id": {"$exists": True, "$ne": None}}},
+            {"$group": {"_id": "$music_id", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": music_limit}
+        ]).to_list(music_limit)
+        music_by_id = await get_music_info_batch(group["_id"] for group in music_groups if group["_id"])
+        popular_poll_music["entries"] = [
+            {"music_id": group["_id"], "count": group["count"], "info": music_by_id[group["_id"]]}
+            for group in music_groups if group["_id"] in music_by_id
+        ]
+        popular_poll_music["expires_at"] = datetime.utcnow() + timedelta(
+            seconds=config.SEARCH_CONFIG['POPULAR_MUSIC_TTL_SECONDS']
+        )
+        return popular_poll_music["entries"]
+
 async def search_sounds_optimized(query: str, current_user_id: str, limit: int):
     """Optimized sound search - searches both user_audio and music used in posts"""
     try:
         results = []
         query_lower = query.lower()
         
-        # 1. Search in user_audio collection (user uploaded audios)
+        # 1. Search in user_audio collection (user uploaded audios) via full-text index
+        ranked = await search_index.search("sounds", query, limit)
+        if ranked is not None:
+            index_scores = dict(ranked)
+            match_stage = {"id": {"$in": list(index_scores)}}
+        else:
+            index_scores = None
+            escaped_query = re.escape(query)
+            match_stage = {
+                "$or": [
+                    {"title": {"$regex": escaped_query, "$options": "i"}},
+                    {"artist": {"$regex": escaped_query, "$options": "i"}}
+                ]
+            }
+        
         pipeline = [
             {
-                "$match": {
-                    "$or": [
-                        {"title": {"$regex": query, "$options": "i"}},
-                        {"artist": {"$regex": query, "$options": "i"}}
-                    ]
-                }
+                "$match": match_stage
             },
             {
                 "$limit": limit
@@ -2689,21 +2927,18 @@ async def search_sounds_optimized(query: str, current_user_id: str, limit: int):
         ]
         
         sounds = await db.user_audio.aggregate(pipeline).to_list(limit)
+        posts_counts = await count_polls_by_audio([sound["id"] for sound in sounds])
         
         for sound in sounds:
-            # Calculate relevance score
-            title_score = 2 if query_lower in sound.get("title", "").lower() else 0
-            artist_score = 1.5 if query_lower in sound.get("artist", "").lower() else 0
-            relevance_score = title_score + artist_score
+            if index_scores is not None:
+                relevance_score = round(index_scores.get(sound["id"], 0), 4)
+            else:
+                # Calculate relevance score
+                title_score = 2 if query_lower in sound.get("title", "").lower() else 0
+                artist_score = 1.5 if query_lower in sound.get("artist", "").lower() else 0
+                relevance_score = title_score + artist_score
             
-            # Count posts using this audio
-            posts_count = await db.polls.count_documents({
-                "$or": [
-                    {"music.id": sound["id"]},
-                    {"music_id": sound["id"]},
-                    {"user_audio_id": sound["id"]}
-                ]
-            })
+            posts_count = posts_counts.get(sound["id"], 0)
             
             # Get cover image
             cover_url = sound.get("cover_url") or sound.get("cover_image") or sound.get("waveform_url", "")
@@ -2728,30 +2963,23 @@ async def search_sounds_optimized(query: str, current_user_id: str, limit: int):
         
         # 2. If user_audio results are less than limit, search in polls for system music
         if len(results) < limit:
-            # Get unique music from polls - search by music_id field
-            polls_with_music = await db.polls.find({
-                "music_id": {"$exists": True, "$ne": None}
-            }).to_list(500)  # Get more to filter
+            # Music used in polls with post counts and info (cached aggregate)
+            seen_ids = {r["id"] for r in results} | {f"user_audio_{r['id']}" for r in results}
             
-            # Collect unique music IDs and their info
             music_usage = {}
-            for poll in polls_with_music:
-                music_id = poll.get("music_id")
-                if music_id and music_id not in [r["id"] for r in results]:
-                    # Get music info for this ID
-                    music_info = await get_music_info(music_id)
-                    if music_info:
-                        title = music_info.get("title", "")
-                        artist = music_info.get("artist", "")
-                        
-                        # Check if matches search query
-                        if query_lower in title.lower() or query_lower in artist.lower():
-                            if music_id not in music_usage:
-                                music_usage[music_id] = {
-                                    "info": music_info,
-                                    "count": 0
-                                }
-                            music_usage[music_id]["count"] += 1
+            for entry in await get_popular_poll_music():
+                if entry["music_id"] in seen_ids:
+                    continue
+                music_info = entry["info"]
+                title = music_info.get("title", "")
+                artist = music_info.get("artist", "")
+                
+                # Check if matches search query
+                if query_lower in title.lower() or query_lower in artist.lower():
+                    music_usage[entry["music_id"]] = {
+                        "info": music_info,
+                        "count": entry["count"]
+                    }
             
             # Convert music_usage to results
             for music_id, data in music_usage.items():
@@ -2803,41 +3031,42 @@ async def search_sounds_optimized(query: str, current_user_id: str, limit: int):
         return []
 
 async def search_users_advanced(query: str, current_user_id: str, limit: int):
-    """Advanced user search with fuzzy matching"""
-    search_regex = {"$regex": query, "$options": "i"}
+    """Advanced user search with fuzzy matching (trigram index candidates, bounded by MAX_FUZZY_RESULTS)"""
+    candidate_limit = min(
+        limit * config.SEARCH_CONFIG['FUZZY_SEARCH_MULTIPLIER'],
+        config.SEARCH_CONFIG['MAX_FUZZY_RESULTS']
+    )
+    fuzzy = await fuzzy_user_index.search(query, candidate_limit + 1)
+    if fuzzy is not None:
+        similarity = {user_id: score for user_id, score in fuzzy if user_id != current_user_id}
+        users = await db.users.find({"id": {"$in": list(similarity)}}).to_list(len(similarity))
+    else:
+        similarity = {}
+        search_regex = {"$regex": re.escape(query), "$options": "i"}
+        users = await db.users.find({
+            "$and": [
+                {"id": {"$ne": current_user_id}},
+                {"$or": [{"username": search_regex}, {"display_name": search_regex}]}
+            ]
+        }).limit(candidate_limit).to_list(candidate_limit)
     
-    # Find users matching query
-    users = await db.users.find({
-        "$and": [
-            {"id": {"$ne": current_user_id}},
-            {
-                "$or": [
-                    {"username": search_regex},
-                    {"display_name": search_regex},
-                    {"bio": search_regex}
-                ]
-            }
-        ]
-    }).limit(limit * config.SEARCH_CONFIG['FUZZY_SEARCH_MULTIPLIER']).to_list(limit * config.SEARCH_CONFIG['FUZZY_SEARCH_MULTIPLIER'])  # Get more for fuzzy filtering
+    # Batch profile and follow lookups instead of one query per candidate
+    user_ids = [user["id"] for user in users]
+    profiles = await db.user_profiles.find(
+        {"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "followers_count": 1}
+    ).to_list(len(user_ids))
+    followers_by_id = {p["id"]: p.get("followers_count", 0) for p in profiles}
+    followed_ids = await follow_graph.following_among(current_user_id, user_ids) if current_user_id else set()
     
     results = []
     for user in users:
         # Calculate relevance score with configurable multipliers
         username_sim = calculate_similarity(query, user.get("username", "")) * config.SEARCH_CONFIG['MULTIPLIERS']['USERNAME_MATCH']
         display_name_sim = calculate_similarity(query, user.get("display_name", "")) * config.SEARCH_CONFIG['MULTIPLIERS']['DISPLAY_NAME_MATCH']
-        bio_sim = calculate_similarity(query, user.get("bio", "")) * config.SEARCH_CONFIG['MULTIPLIERS']['BIO_MATCH']
-        
-        relevance_score = max(username_sim, display_name_sim, bio_sim)
-        
-        # Get user profile for additional data
-        profile = await db.user_profiles.find_one({"id": user["id"]})
-        followers_count = profile.get("followers_count", 0) if profile else 0
+        relevance_score = max(username_sim, display_name_sim, similarity.get(user["id"], 0.0))
         
-        # Check if current user follows this user
-        is_following = await db.follows.find_one({
-            "follower_id": current_user_id,
-            "following_id": user["id"]
-        }) is not None
+        followers_count = followers_by_id.get(user["id"], 0)
+        is_following = user["id"] in followed_ids
         
         results.append({
             "type": "user",
@@ -3063,25 +3292,12 @@ async def get_search_suggestions_helper(current_user_id: str = None):
     }
     
     try:
-        # Get popular hashtags from recent posts
-        pipeline = [
-            {"$match": {"created_at": {"$gte": (datetime.utcnow() - timedelta(days=7)).isoformat()}}},
-            {"$project": {"content": 1}},
-            {"$limit": 1000}
+        # Get top trending hashtags (last 7 days) from materialized statistics
+        trending = await hashtag_stats.top("7d", 10)
+        suggestions["trending_hashtags"] = [
+            {"hashtag": h.get("display") or h["tag"], "count": h["count_7d"]} for h in trending
         ]
         
-        recent_posts = await db.polls.aggregate(pipeline).to_list(1000)
-        hashtag_counts = {}
-        
-        for post in recent_posts:
-            hashtags = extract_hashtags_from_text(post.get("content", ""))
-            for hashtag in hashtags:
-                hashtag_counts[hashtag] = hashtag_counts.get(hashtag, 0) + 1
-        
-        # Get top trending hashtags
-        trending = sorted(hashtag_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-        suggestions["trending_hashtags"] = [{"hashtag": h[0], "count": h[1]} for h in trending]
-        
         # Get suggested users (users with high follower count)
         pipeline = [
             {"$sort": {"followers_count": -1}},
@@ -3089,8 +3305,14 @@ async def get_search_suggestions_helper(current_user_id: str = None):
         ]
         
         top_profiles = await db.user_profiles.aggregate(pipeline).to_list(5)
+        profile_ids = [profile["id"] for profile in top_profiles if profile.get("id")]
+        users = await db.users.find(
+            {"id": {"$in": profile_ids}},
+            {"_id": 0, "id": 1, "username": 1, "display_name": 1, "avatar_url": 1}
+        ).to_list(len(profile_ids))
+        users_by_id = {user["id"]: user for user in users}
         for profile in top_profiles:
-            user = await db.users.find_one({"id": profile["user_id"]})
+            user = users_by_id.get(profile.get("id"))
             if user and user["id"] != current_user_id:
                 suggestions["suggested_users"].append({
                     "id": user["id"],
@@ -3114,22 +3336,27 @@ async def get_search_suggestions_endpoint(current_user: UserResponse = Depends(g
 async def get_trending_content(current_user_id: str):
     """Get trending content for discovery section"""
     try:
-        # Get trending posts (high engagement in last 24 hours)
-        recent_time = (datetime.utcnow() - timedelta(hours=24)).isoformat()
-        
-        pipeline = [
-            {"$match": {"created_at": {"$gte": recent_time}}},
-            {"$addFields": {"votes_count": {"$size": "$votes"}}},
-            {"$sort": {"votes_count": -1}},
-            {"$limit": 10}
-        ]
-        
-        trending_posts = await db.polls.aggregate(pipeline).to_list(10)
+        # Get trending posts (high engagement in last 24 hours) using maintained counters
+        recent_time = datetime.utcnow() - timedelta(hours=24)
+        
+        trending_posts = await db.polls.find(
+            {"created_at": {"$gte": recent_time}},
+            {"_id": 0, "id": 1, "title": 1, "content": 1, "image_url": 1, "author_id": 1,
+             "total_votes": 1, "comments_count": 1, "created_at": 1}
+        ).sort("total_votes", -1).limit(5).to_list(5)
+        
+        # One batched author lookup for all posts
+        author_ids = list({post.get("author_id") for post in trending_posts if post.get("author_id")})
+        authors = await db.users.find(
+            {"id": {"$in": author_ids}},
+            {"_id": 0, "id": 1, "username": 1, "display_name": 1, "avatar_url": 1}
+        ).to_list(len(author_ids))
+        authors_by_id = {author["id"]: author for author in authors}
         
         results = []
         for post in trending_posts:
-            author = await db.users.find_one({"id": post["user_id"]})
-            comments_count = await db.comments.count_documents({"poll_id": post["id"]})
+            author = authors_by_id.get(post.get("author_id"))
+            comments_count = post.get("comments_count", 0)
             
             results.append({
                 "type": "trending_post",
@@ -3137,7 +3364,7 @@ async def get_trending_content(current_user_id: str):
                 "title": post.get("title", ""),
                 "content": post.get("content", "")[:100],
                 "image_url": post.get("image_url"),
-                "votes_count": len(post.get("votes", [])),
+                "votes_count": post.get("total_votes", 0),
                 "comments_count": comments_count,
                 "author": {
                     "username": author.get("username", "") if author else "",
@@ -3153,6 +3380,26 @@ async def get_trending_content(current_user_id: str):
         logger.error(f"Error getting trending content: {str(e)}")
         return []
 
+async def compute_autocomplete_suggestions(query: str, limit: int):
+    """Viewer-independent suggestions (one spare user slot for the viewer filter)"""
+    # In-memory prefix index (users, hashtags, sounds) - no MongoDB round trip
+    suggestions = await autocomplete_engine.complete(query, limit + 2)
+    if suggestions is not None:
+        return suggestions
+    
+    # Index unavailable - hashtags still come from an indexed top-K read
+    if query.startswith("@"):
+        return []
+    return [
+        {
+            "type": "hashtag",
+            "text": h.get("display") or h["tag"],
+            "display": f"{h.get('display') or h['tag']} ({h['count']} posts)",
+            "count": h["count"]
+        }
+        for h in await hashtag_stats.suggest(query, 3)
+    ]
+
 @api_router.get("/search/autocomplete")
 async def search_autocomplete(
     q: str = "",
@@ -3171,56 +3418,22 @@ async def search_autocomplete(
         return {"suggestions": []}
     
     query = q.lower().strip()
-    suggestions = []
     
     try:
-        # User suggestions
-        users = await db.users.find({
-            "$and": [
-                {"id": {"$ne": current_user.id}},
-                {
-                    "$or": [
-                        {"username": {"$regex": f"^{query}", "$options": "i"}},
-                        {"display_name": {"$regex": f"^{query}", "$options": "i"}}
-                    ]
-                }
-            ]
-        }).limit(limit // 2).to_list(limit // 2)
-        
-        for user in users:
-            suggestions.append({
-                "type": "user",
-                "text": f"@{user['username']}",
-                "display": f"{user.get('display_name', user['username'])} (@{user['username']})",
-                "avatar": user.get("avatar")
-            })
+        shared_suggestions = await search_cache.get_or_compute(
+            "autocomplete", query, (limit,),
+            lambda: compute_autocomplete_suggestions(query, limit)
+        )
         
-        # Hashtag suggestions
-        if query.startswith("#") or not query.startswith("@"):
-            hashtag_query = query if query.startswith("#") else f"#{query}"
-            pipeline = [
-                {"$match": {"content": {"$regex": hashtag_query, "$options": "i"}}},
-                {"$limit": 100}
-            ]
-            
-            posts = await db.polls.aggregate(pipeline).to_list(100)
-            hashtag_counts = {}
-            
-            for post in posts:
-                hashtags = extract_hashtags_from_text(post.get("content", ""))
-                for hashtag in hashtags:
-                    if hashtag.lower().startswith(query.lower()):
-                        hashtag_counts[hashtag] = hashtag_counts.get(hashtag, 0) + 1
-            
-            # Get top hashtags
-            top_hashtags = sorted(hashtag_counts.items(), key=lambda x: x[1], reverse=True)[:3]
-            for hashtag, count in top_hashtags:
-                suggestions.append({
-                    "type": "hashtag",
-                    "text": hashtag,
-                    "display": f"{hashtag} ({count} posts)",
-                    "count": count
-                })
+        # Drop the viewer's own account, keeping at most limit // 2 users
+        suggestions = []
+        users_left = limit // 2
+        for suggestion in shared_suggestions:
+            if suggestion.get("type") == "user":
+                if suggestion.get("id") == current_user.id or users_left <= 0:
+                    continue
+                users_left -= 1
+            suggestions.append(suggestion)
         
         return {"suggestions": suggestions[:8]}  # Limit to 8 suggestions
         
@@ -3252,6 +3465,8 @@ async def update_follow_counts(user_id: str):
             upsert=True  # Create profile if doesn't exist
         )
         
+        autocomplete_engine.set_user_followers(user_id, followers_count)
+        
         print(f"✅ Updated follow counts for user {user_id}: {followers_count} followers, {following_count} following")
         
     except Exception as e:
@@ -3286,21 +3501,13 @@ async def follow_user(user_id: str, current_user: UserResponse = Depends(get_cur
     result = await db.follows.insert_one(follow_data.model_dump())
     if not result.inserted_id:
         raise HTTPException(status_code=500, detail="Failed to follow user")
+    follow_graph.add_follow(current_user.id, user_id)
+    activity_feed.record_follow(current_user.id, user_id, follow_data.created_at)
     
     # Update follow counts for both users
     await update_follow_counts(user_id)  # Update followed user's follower count
     await update_follow_counts(current_user.id)  # Update current user's following count
     
-    # Clear cache for this relationship
-    cache_key = f"{current_user.id}:{user_id}"
-    if cache_key in follow_status_cache:
-        del follow_status_cache[cache_key]
-    
-    # Also clear reverse cache (for the followed user's perspective)
-    reverse_cache_key = f"{user_id}:{current_user.id}"
-    if reverse_cache_key in follow_status_cache:
-        del follow_status_cache[reverse_cache_key]
-    
     return {"message": "Successfully followed user", "follow_id": follow_data.id}
 
 @api_router.delete("/users/{user_id}/follow")
@@ -3314,87 +3521,86 @@ async def unfollow_user(user_id: str, current_user: UserResponse = Depends(get_c
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Follow relationship not found")
+    follow_graph.remove_follow(current_user.id, user_id)
+    activity_feed.retract_follow(current_user.id, user_id)
     
     # Update follow counts for both users
     await update_follow_counts(user_id)  # Update unfollowed user's follower count
     await update_follow_counts(current_user.id)  # Update current user's following count
     
-    # Clear cache for this relationship
-    cache_key = f"{current_user.id}:{user_id}"
-    if cache_key in follow_status_cache:
-        del follow_status_cache[cache_key]
-    
-    # Also clear reverse cache (for the followed user's perspective)
-    reverse_cache_key = f"{user_id}:{current_user.id}"
-    if reverse_cache_key in follow_status_cache:
-        del follow_status_cache[reverse_cache_key]
-    
     return {"message": "Successfully unfollowed user"}
 
 @api_router.get("/users/{user_id}/follow-status")
 async def get_follow_status(user_id: str, current_user: UserResponse = Depends(get_current_user)):
-    """Get follow status for a specific user with caching"""
-    
-    # Check cache first
-    cache_key = f"{current_user.id}:{user_id}"
-    if cache_key in follow_status_cache and is_follow_cache_valid(follow_status_cache[cache_key]):
-        return follow_status_cache[cache_key]['data']
-    
-    follow_relationship = await db.follows.find_one({
-        "follower_id": current_user.id,
-        "following_id": user_id
-    })
-    
-    result = FollowStatus(
+    """Get follow status for a specific user (answered from the in-memory follow graph)"""
+    if not await follow_graph.is_following(current_user.id, user_id):
+        return FollowStatus(is_following=False, follow_id=None)
+    
+    # Only existing relationships need the edge document for its id
+    follow_relationship = await db.follows.find_one(
+        {"follower_id": current_user.id, "following_id": user_id},
+        {"_id": 0, "id": 1}
+    )
+    return FollowStatus(
         is_following=follow_relationship is not None,
         follow_id=follow_relationship["id"] if follow_relationship else None
     )
-    
-    # Cache the result
-    follow_status_cache[cache_key] = {
-        'data': result,
-        'cached_at': datetime.utcnow()
-    }
-    
-    return result
+
+# Follow lists default to the previous 1000-entry cap; clients may page with limit + cursor
+FOLLOW_LIST_MAX_LIMIT = 1000
+
+def flags_of(item: Dict) -> Dict:
+    """Viewer relationship flags of a social graph list item"""
+    return {key: item[key] for key in ("is_following", "follows_you", "is_mutual")}
 
 @api_router.get("/users/following")
-async def get_following_users(current_user: UserResponse = Depends(get_current_user)):
+async def get_following_users(
+    limit: int = FOLLOW_LIST_MAX_LIMIT,
+    cursor: Optional[str] = None,
+    current_user: UserResponse = Depends(get_current_user)
+):
     """Get list of users that current user is following"""
-    follows = await db.follows.find({"follower_id": current_user.id}).to_list(1000)
-    
-    following_ids = [follow["following_id"] for follow in follows]
-    users = await db.users.find({"id": {"$in": following_ids}}).to_list(1000)
-    
+    page = await social_graph.list_page(
+        current_user.id, "following", max(1, min(limit, FOLLOW_LIST_MAX_LIMIT)), cursor, viewer_id=current_user.id
+    )
     return FollowingList(
-        following=[UserResponse(**user) for user in users],
-        total=len(users)
+        following=[FollowListUser(**item["user"], **flags_of(item)) for item in page["items"]],
+        total=page["total"],
+        next_cursor=page["next_cursor"]
     )
 
 @api_router.get("/users/{user_id}/followers")
-async def get_user_followers(user_id: str):
+async def get_user_followers(
+    user_id: str,
+    limit: int = FOLLOW_LIST_MAX_LIMIT,
+    cursor: Optional[str] = None,
+    viewer_id: Optional[str] = Depends(get_optional_user_id)
+):
     """Get list of users following the specified user"""
-    follows = await db.follows.find({"following_id": user_id}).to_list(1000)
-    
-    follower_ids = [follow["follower_id"] for follow in follows]
-    users = await db.users.find({"id": {"$in": follower_ids}}).to_list(1000)
-    
+    page = await social_graph.list_page(
+        user_id, "followers", max(1, min(limit, FOLLOW_LIST_MAX_LIMIT)), cursor, viewer_id=viewer_id
+    )
     return FollowersList(
-        followers=[UserResponse(**user) for user in users],
-        total=len(users)
+        followers=[FollowListUser(**item["user"], **flags_of(item)) for item in page["items"]],
+        total=page["total"],
+        next_cursor=page["next_cursor"]
     )
 
 @api_router.get("/users/{user_id}/following")
-async def get_user_following(user_id: str):
+async def get_user_following(
+    user_id: str,
+    limit: int = FOLLOW_LIST_MAX_LIMIT,
+    cursor: Optional[str] = None,
+    viewer_id: Optional[str] = Depends(get_optional_user_id)
+):
     """Get list of users that specified user is following"""
-    follows = await db.follows.find({"follower_id": user_id}).to_list(1000)
-    
-    following_ids = [follow["following_id"] for follow in follows]
-    users = await db.users.find({"id": {"$in": following_ids}}).to_list(1000)
-    
+    page = await social_graph.list_page(
+        user_id, "following", max(1, min(limit, FOLLOW_LIST_MAX_LIMIT)), cursor, viewer_id=viewer_id
+    )
     return FollowingList(
-        following=[UserResponse(**user) for user in users],
-        total=len(users)
+        following=[FollowListUser(**item["user"], **flags_of(item)) for item in page["items"]],
+        total=page["total"],
+        next_cursor=page["next_cursor"]
     )
 
 # =============  MESSAGING ENDPOINTS =============
@@ -3467,6 +3673,8 @@ async def send_message(message: MessageCreate, current_user: UserResponse = Depe
         # Create new conversation
         conversation = Conversation(
             participants=[current_user.id, message.recipient_id],
+            last_message=message.content,
+            last_message_at=datetime.utcnow(),
             unread_count={
                 current_user.id: 0,
                 message.recipient_id: 1
@@ -3474,10 +3682,11 @@ async def send_message(message: MessageCreate, current_user: UserResponse = Depe
         )
         await db.conversations.insert_one(conversation.dict())
         conversation_id = conversation.id
+        recipient_unread = 1
     else:
         conversation_id = conversation_data["id"]
         # Update unread count for recipient
-        await db.conversations.update_one(
+        updated_conversation = await db.conversations.find_one_and_update(
             {"id": conversation_id},
             {
                 "$inc": {f"unread_count.{message.recipient_id}": 1},
@@ -3486,8 +3695,11 @@ async def send_message(message: MessageCreate, current_user: UserResponse = Depe
                     "last_message_at": datetime.utcnow(),
                     "updated_at": datetime.utcnow()
                 }
-            }
+            },
+            projection={"_id": 0, "unread_count": 1},
+            return_document=ReturnDocument.AFTER
         )
+        recipient_unread = (updated_conversation or {}).get("unread_count", {}).get(message.recipient_id, 1)
     
     # Create message
     new_message = Message(
@@ -3503,6 +3715,29 @@ async def send_message(message: MessageCreate, current_user: UserResponse = Depe
     
     # Prepare complete message response with sender info
     sender_user = await db.users.find_one({"id": current_user.id})
+    sender_info = {
+        "id": current_user.id,
+        "username": sender_user.get("username") if sender_user else current_user.username,
+        "display_name": sender_user.get("display_name") if sender_user else current_user.display_name,
+        "avatar_url": sender_user.get("avatar_url") if sender_user else current_user.avatar_url
+    }
+    
+    recipient_total_unread = await messaging.unread.increment(message.recipient_id)
+    
+    # Push to connected participants (sender's other devices included) without delaying the response
+    realtime.publish_in_background(
+        [message.recipient_id, current_user.id],
+        {"type": "message", "conversation_id": conversation_id, "message": {**new_message.dict(), "sender": sender_info}}
+    )
+    realtime.publish_in_background(
+        [message.recipient_id],
+        {
+            "type": "unread",
+            "conversation_id": conversation_id,
+            "unread_count": recipient_unread,
+            "total_unread": recipient_total_unread
+        }
+    )
     
     return {
         "success": True,
@@ -3511,33 +3746,63 @@ async def send_message(message: MessageCreate, current_user: UserResponse = Depe
         "timestamp": new_message.created_at.isoformat() if hasattr(new_message.created_at, 'isoformat') else new_message.created_at,
         "content": new_message.content,
         "sender_id": current_user.id,
-        "sender": {
-            "id": current_user.id,
-            "username": sender_user.get("username") if sender_user else current_user.username,
-            "display_name": sender_user.get("display_name") if sender_user else current_user.display_name,
-            "avatar_url": sender_user.get("avatar_url") if sender_user else current_user.avatar_url
-        }
+        "sender": sender_info
     }
 
+@api_router.websocket("/ws")
+async def realtime_socket(websocket: WebSocket, token: Optional[str] = None):
+    """
+    Real-time events for the authenticated user: {"type": "message" | "unread", ...}.
+    Browsers cannot set headers on WebSockets, so the JWT is passed as ?token=.
+    Clients may send "ping" to keep the connection alive; other frames,
+    binary included, are ignored.
+    """
+    payload = verify_token(token) if token else None
+    user = await db.users.find_one({"id": payload["sub"]}, {"_id": 0, "id": 1}) if payload else None
+    if not user:
+        await websocket.close(code=4401)
+        return
+    
+    await realtime.connect(user["id"], websocket)
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                break
+            if frame.get("text") == "ping" or frame.get("bytes") == b"ping":
+                await websocket.send_text("pong")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        realtime.disconnect(user["id"], websocket)
+
 @api_router.get("/conversations")
-async def get_conversations(current_user: UserResponse = Depends(get_current_user)):
-    """Get user's conversations including pending chat requests"""
-    # Get regular conversations
-    conversations = await db.conversations.find({
-        "participants": current_user.id,
-        "is_active": True
-    }).sort("last_message_at", -1).to_list(50)
+async def get_conversations(
+    response: Response,
+    limit: int = CONVERSATIONS_DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """
+    Get user's conversations including pending chat requests (first page only).
+    Older pages: pass the X-Next-Cursor header of the previous response as `cursor`.
+    """
+    items, users_by_id, next_cursor = await messaging.conversations_page(
+        current_user.id, max(1, min(limit, CONVERSATIONS_MAX_LIMIT)), cursor
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     result = []
-    for conv_data in conversations:
+    for conv_data in items:
+        if conv_data.get("is_chat_request"):
+            continue
         # Get participant info
-        participant_ids = [p for p in conv_data["participants"] if p != current_user.id]
-        participants = []
-        
-        for participant_id in participant_ids:
-            user_data = await db.users.find_one({"id": participant_id})
-            if user_data:
-                participants.append(UserResponse(**user_data))
+        participants = [
+            UserResponse(**users_by_id[participant_id])
+            for participant_id in conv_data["participants"]
+            if participant_id != current_user.id and participant_id in users_by_id
+        ]
         
         # Get unread count for current user
         unread_count = conv_data.get("unread_count", {}).get(current_user.id, 0)
@@ -3552,17 +3817,14 @@ async def get_conversations(current_user: UserResponse = Depends(get_current_use
         }
         result.append(conversation_response)
     
-    # Get pending chat requests where current user is the SENDER only
+    # Pending chat requests where current user is the SENDER only
     # Receivers will see these in the separate "Solicitudes de mensajes" section
-    pending_requests = await db.chat_requests.find({
-        "sender_id": current_user.id,
-        "status": "pending"
-    }).sort("created_at", -1).to_list(50)
+    pending_requests = [item for item in items if item.get("is_chat_request")]
     
     # Convert chat requests to conversation-like format
     for req in pending_requests:
         # Get receiver user info
-        other_user_data = await db.users.find_one({"id": req["receiver_id"]})
+        other_user_data = users_by_id.get(req["receiver_id"])
         if not other_user_data:
             continue
         
@@ -3594,55 +3856,45 @@ async def get_conversations(current_user: UserResponse = Depends(get_current_use
 @api_router.get("/conversations/{conversation_id}/messages")
 async def get_conversation_messages(
     conversation_id: str,
-    limit: int = 50,
+    response: Response,
+    limit: int = MESSAGES_DEFAULT_LIMIT,
+    before: Optional[str] = None,
     current_user: UserResponse = Depends(get_current_user)
 ):
-    """Get messages from a conversation"""
+    """
+    Get messages from a conversation, oldest first.
+    Older history: pass the X-Next-Cursor header of the previous response as `before`.
+    """
     # Verify user is participant in conversation
-    conversation = await db.conversations.find_one({
-        "id": conversation_id,
-        "participants": current_user.id
-    })
+    conversation = await db.conversations.find_one(
+        {"id": conversation_id, "participants": current_user.id},
+        {"_id": 0, "id": 1, "participants": 1, "unread_count": 1}
+    )
     
     if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    
-    # Get messages
-    messages = await db.messages.find({
-        "conversation_id": conversation_id
-    }).sort("created_at", -1).limit(limit).to_list(limit)
-    
-    # Mark messages as read
-    await db.messages.update_many(
-        {
-            "conversation_id": conversation_id,
-            "recipient_id": current_user.id,
-            "is_read": False
-        },
-        {"$set": {"is_read": True}}
-    )
+        raise HTTPException(status_code=404, detail="Conversation not found")
     
-    # Reset unread count for current user
-    await db.conversations.update_one(
-        {"id": conversation_id},
-        {"$set": {f"unread_count.{current_user.id}": 0}}
+    # Messages page, participants (resolved once) and read-marking when needed
+    messages, participants_by_id, next_cursor, unread_total = await messaging.messages_page(
+        conversation, current_user.id, max(1, min(limit, MESSAGES_MAX_LIMIT)), before
     )
-    
-    # Reverse to get chronological order (oldest first)
-    messages.reverse()
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if unread_total is not None:
+        # Keep the reader's other devices in sync
+        realtime.publish_in_background(
+            [current_user.id],
+            {"type": "unread", "conversation_id": conversation_id, "unread_count": 0, "total_unread": unread_total}
+        )
     
     # Enrich messages with sender information
     enriched_messages = []
     for msg in messages:
-        # Get sender user info
-        sender = await db.users.find_one({"id": msg["sender_id"]})
-        
-        # Remove MongoDB _id field if present (not JSON serializable)
-        msg_dict = {k: v for k, v in msg.items() if k != "_id"}
+        sender = participants_by_id.get(msg["sender_id"])
         
         # Build enriched message object
         enriched_msg = {
-            **msg_dict,
+            **msg,
             "sender": {
                 "id": msg["sender_id"],
                 "username": sender.get("username") if sender else "unknown",
@@ -3656,18 +3908,8 @@ async def get_conversation_messages(
 
 @api_router.get("/messages/unread")
 async def get_unread_count(current_user: UserResponse = Depends(get_current_user)):
-    """Get total unread message count"""
-    conversations = await db.conversations.find({
-        "participants": current_user.id,
-        "is_active": True
-    }).to_list(100)
-    
-    total_unread = sum(
-        conv.get("unread_count", {}).get(current_user.id, 0) 
-        for conv in conversations
-    )
-    
-    return {"unread_count": total_unread}
+    """Get total unread message count (per-user counter document)"""
+    return {"unread_count": await messaging.unread.get(current_user.id)}
 
 @api_router.get("/chat-requests/{request_id}/messages")
 async def get_chat_request_messages(
@@ -3976,25 +4218,25 @@ async def get_recent_followers(current_user: UserResponse = Depends(get_current_
         # Calculate 7 days ago
         seven_days_ago = datetime.utcnow() - timedelta(days=7)
         
-        # Find recent follows where current user is the followed user
-        recent_follows = await db.follows.find({
-            "following_id": current_user.id,  # FIXED: Changed from followed_id to following_id
-            "created_at": {"$gte": seven_days_ago}
-        }).sort("created_at", -1).limit(50).to_list(50)
+        # Recent follows of the current user, hydrated in one batched lookup
+        page = await social_graph.list_page(
+            current_user.id, "followers", 50,
+            viewer_id=current_user.id, since=seven_days_ago, with_total=False
+        )
         
-        # Get follower details
         followers = []
-        for follow in recent_follows:
-            follower = await db.users.find_one({"id": follow["follower_id"]})
-            if follower:
-                followers.append({
-                    "id": follower["id"],
-                    "username": follower["username"],
-                    "display_name": follower.get("display_name", follower["username"]),
-                    "avatar_url": follower.get("avatar_url"),  # Usar foto de perfil real
-                    "followed_at": follow["created_at"],
-                    "is_verified": follower.get("is_verified", False)
-                })
+        for item in page["items"]:
+            follower = item["user"]
+            followers.append({
+                "id": follower["id"],
+                "username": follower["username"],
+                "display_name": follower.get("display_name", follower["username"]),
+                "avatar_url": follower.get("avatar_url"),  # Usar foto de perfil real
+                "followed_at": item["follow"]["created_at"],
+                "is_verified": follower.get("is_verified", False),
+                "is_following": item["is_following"],  # Already following back
+                "is_mutual": item["is_mutual"]
+            })
         
         return followers
         
@@ -4005,193 +4247,13 @@ async def get_recent_followers(current_user: UserResponse = Depends(get_current_
 
 @api_router.get("/users/activity/recent")
 async def get_recent_activity(current_user: UserResponse = Depends(get_current_user)):
-    """Get recent activity (likes, comments, mentions on user's content)"""
+    """Get recent activity (likes, comments, votes, follows, mentions on user's content)"""
     try:
-        # Get recent activity from last 7 days
-        seven_days_ago = datetime.utcnow() - timedelta(days=7)
-        activities = []
-        
-        # Get user's polls first
-        user_polls = await db.polls.find({
-            "author_id": current_user.id
-        }).to_list(1000)
-        
-        user_poll_ids = [poll["id"] for poll in user_polls]
-        print(f"DEBUG Activity: User has {len(user_poll_ids)} polls")
-        
-        # Get recent likes on user's polls using poll_id
-        likes = await db.poll_likes.find({
-            "poll_id": {"$in": user_poll_ids},
-            "user_id": {"$ne": current_user.id},  # Exclude self-likes
-            "created_at": {"$gte": seven_days_ago}
-        }).sort("created_at", -1).limit(20).to_list(20)
-        
-        print(f"DEBUG Activity: Found {len(likes)} likes on user's polls")
-        
-        for like in likes:
-            user = await db.users.find_one({"id": like["user_id"]})
-            poll = await db.polls.find_one({"id": like["poll_id"]})
-            if user and poll:
-                activities.append({
-                    "id": f"like-{like['id']}",
-                    "type": "like",
-                    "user": {
-                        "id": user["id"],
-                        "username": user["username"],
-                        "display_name": user.get("display_name", user["username"]),
-                        "avatar_url": user.get("avatar_url")  # Incluir avatar_url
-                    },
-                    "content_type": "poll",
-                    "content_preview": poll.get("question", "")[:50],
-                    "created_at": like["created_at"],
-                    "unread": True
-                })
-        
-        # Get recent comments on user's polls using poll_id
-        comments = await db.comments.find({
-            "$and": [
-                {"poll_id": {"$in": user_poll_ids}},
-                {"author_id": {"$ne": current_user.id}},  # Exclude self-comments
-                {"created_at": {"$gte": seven_days_ago}}
-            ]
-        }).sort("created_at", -1).limit(20).to_list(20)
-        
-        print(f"DEBUG Activity: Found {len(comments)} comments on user's polls")
-        
-        for comment in comments:
-            user = await db.users.find_one({"id": comment["author_id"]})
-            if user:
-                activities.append({
-                    "id": f"comment-{comment['id']}",
-                    "type": "comment",
-                    "user": {
-                        "id": user["id"],
-                        "username": user["username"],
-                        "display_name": user.get("display_name", user["username"]),
-                        "avatar_url": user.get("avatar_url")  # Incluir avatar_url
-                    },
-                    "content_type": "poll",
-                    "comment_preview": comment.get("content", "")[:100],
-                    "created_at": comment["created_at"],
-                    "unread": True
-                })
-        
-        # Get recent votes on user's polls using poll_id
-        votes = await db.votes.find({
-            "$and": [
-                {"poll_id": {"$in": user_poll_ids}},
-                {"user_id": {"$ne": current_user.id}},  # Exclude self-votes
-                {"created_at": {"$gte": seven_days_ago}}
-            ]
-        }).sort("created_at", -1).limit(20).to_list(20)
-        
-        print(f"DEBUG Activity: Found {len(votes)} votes on user's polls")
-        
-        for vote in votes:
-            user = await db.users.find_one({"id": vote["user_id"]})
-            poll = await db.polls.find_one({"id": vote["poll_id"]})
-            option = None
-            
-            # Find the option that was voted for
-            if poll and poll.get("options"):
-                for opt in poll["options"]:
-                    if opt.get("id") == vote["option_id"]:
-                        option = opt
-                        break
-            
-            if user and poll and option:
-                activities.append({
-                    "id": f"vote-{vote['id']}",
-                    "type": "vote",
-                    "user": {
-                        "id": user["id"],
-                        "username": user["username"],
-                        "display_name": user.get("display_name", user["username"]),
-                        "avatar_url": user.get("avatar_url")  # Incluir avatar_url
-                    },
-                    "content_type": "poll",
-                    "content_preview": poll.get("title", "")[:50],
-                    "vote_option": option.get("text", ""),
-                    "created_at": vote["created_at"],
-                    "unread": True
-                })
-        
-        # Get recent mentions - find polls where user is mentioned
-        print(f"DEBUG Activity: Looking for mentions of user {current_user.id}")
-        
-        # Search in mentioned_users (poll level mentions)
-        polls_with_general_mentions = await db.polls.find({
-            "mentioned_users": current_user.id,
-            "author_id": {"$ne": current_user.id},  # Exclude own polls
-            "created_at": {"$gte": seven_days_ago}
-        }).sort("created_at", -1).limit(20).to_list(20)
-        
-        print(f"DEBUG Activity: Found {len(polls_with_general_mentions)} polls with general mentions")
-        
-        for poll in polls_with_general_mentions:
-            author = await db.users.find_one({"id": poll["author_id"]})
-            if author:
-                activities.append({
-                    "id": f"mention-general-{poll['id']}",
-                    "type": "mention",
-                    "user": {
-                        "id": author["id"],
-                        "username": author["username"],
-                        "display_name": author.get("display_name", author["username"]),
-                        "avatar_url": author.get("avatar_url")
-                    },
-                    "content_type": "poll",
-                    "content_preview": poll.get("title", "")[:50],
-                    "mention_type": "general",
-                    "created_at": poll["created_at"],
-                    "unread": True
-                })
-        
-        # Search in option-specific mentions
-        polls_with_option_mentions = await db.polls.find({
-            "options.mentioned_users.id": current_user.id,
-            "author_id": {"$ne": current_user.id},  # Exclude own polls
-            "created_at": {"$gte": seven_days_ago}
-        }).sort("created_at", -1).limit(20).to_list(20)
-        
-        print(f"DEBUG Activity: Found {len(polls_with_option_mentions)} polls with option mentions")
-        
-        for poll in polls_with_option_mentions:
-            author = await db.users.find_one({"id": poll["author_id"]})
-            if author:
-                # Find which option mentioned the user
-                mentioned_option = None
-                for option in poll.get("options", []):
-                    for mentioned_user in option.get("mentioned_users", []):
-                        if mentioned_user.get("id") == current_user.id:
-                            mentioned_option = option.get("text", "")
-                            break
-                    if mentioned_option:
-                        break
-                
-                activities.append({
-                    "id": f"mention-option-{poll['id']}",
-                    "type": "mention", 
-                    "user": {
-                        "id": author["id"],
-                        "username": author["username"],
-                        "display_name": author.get("display_name", author["username"]),
-                        "avatar_url": author.get("avatar_url")
-                    },
-                    "content_type": "poll",
-                    "content_preview": poll.get("title", "")[:50],
-                    "mention_type": "option",
-                    "mention_option": mentioned_option,
-                    "created_at": poll["created_at"],
-                    "unread": True
-                })
-        
-        # Sort all activities by date
-        activities.sort(key=lambda x: x["created_at"], reverse=True)
-        
-        return activities[:30]  # Return max 30 activities
+        # Precomputed inbox: one ranged query on (recipient_id, created_at) + one batched user lookup
+        return await activity_feed.recent(current_user.id, limit=30, days=7)
         
     except Exception as e:
+        logger.error(f"Error getting recent activity: {str(e)}")
         # Return empty list if error
         return []
 
@@ -4209,11 +4271,12 @@ async def create_comment(
         raise HTTPException(status_code=400, detail="Poll ID mismatch")
     
     # Si es una respuesta, verificar que el comentario padre existe
+    parent_comment = None
     if comment_data.parent_comment_id:
-        parent_comment = await db.comments.find_one({
-            "id": comment_data.parent_comment_id,
-            "poll_id": poll_id
-        })
+        parent_comment = await db.comments.find_one(
+            {"id": comment_data.parent_comment_id, "poll_id": poll_id},
+            {"_id": 0, "id": 1, "ancestor_ids": 1}
+        )
         if not parent_comment:
             raise HTTPException(status_code=404, detail="Parent comment not found")
     
@@ -4227,103 +4290,98 @@ async def create_comment(
         poll_id=poll_id,
         user_id=current_user.id,
         content=comment_data.content.strip(),
-        parent_comment_id=comment_data.parent_comment_id
+        parent_comment_id=comment_data.parent_comment_id,
+        ancestor_ids=comment_threads.ancestors_for(parent_comment)
     )
     
     # Insertar en la base de datos
     await db.comments.insert_one(comment.dict())
     
+    # Contar la respuesta en todos sus ancestros
+    await comment_threads.add_reply(comment.ancestor_ids)
+    
     # Incrementar el contador de comentarios en el poll
     await db.polls.update_one(
         {"id": poll_id},
         {"$inc": {"comments_count": 1}}
     )
+    activity_feed.record_comment(poll, comment.dict())
     
     # Retornar el comentario creado con información del usuario
     return CommentResponse(
         **comment.dict(),
         user=current_user,
         replies=[],
-        reply_count=0,
         user_liked=False
     )
 
+def build_comment_tree(
+    roots: List[Dict],
+    replies: List[Dict],
+    users_by_id: Dict[str, Dict],
+    liked_ids: set
+) -> List[CommentResponse]:
+    """Nest replies under their parents; comments whose author no longer exists are skipped"""
+    responses = {}
+    for comment_data in roots + replies:
+        user_data = users_by_id.get(comment_data["user_id"])
+        if not user_data:
+            continue
+        responses[comment_data["id"]] = CommentResponse(
+            **{**comment_data, "replies": [], "user_liked": comment_data["id"] in liked_ids},
+            user=UserResponse(**user_data)
+        )
+    
+    for comment_data in replies:
+        parent = responses.get(comment_data.get("parent_comment_id"))
+        child = responses.get(comment_data["id"])
+        if parent and child:
+            parent.replies.append(child)
+    
+    return [responses[root["id"]] for root in roots if root["id"] in responses]
+
 @api_router.get("/polls/{poll_id}/comments")
 async def get_poll_comments(
     poll_id: str,
+    response: Response,
     limit: int = 50,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    include_replies: bool = True,
     current_user: UserResponse = Depends(get_current_user)
 ):
-    """Get comments for a specific poll with nested structure"""
-    
-    # Obtener todos los comentarios del poll
-    comments_cursor = db.comments.find({
-        "poll_id": poll_id
-    }).sort("created_at", 1)  # Orden cronológico
-    
-    all_comments = await comments_cursor.to_list(1000)  # Límite alto para obtener todos
-    
-    if not all_comments:
-        return []
-    
-    # Obtener información de usuarios únicos
-    user_ids = list(set(comment["user_id"] for comment in all_comments))
-    users_cursor = db.users.find({"id": {"$in": user_ids}})
-    users_list = await users_cursor.to_list(len(user_ids))
-    users_dict = {user["id"]: UserResponse(**user) for user in users_list}
-    
-    # Obtener likes del usuario actual para cada comentario
-    comment_ids = [comment["id"] for comment in all_comments]
-    user_likes = await db.comment_likes.find({
-        "comment_id": {"$in": comment_ids},
-        "user_id": current_user.id
-    }).to_list(len(comment_ids))
-    
-    liked_comments = set(like["comment_id"] for like in user_likes)
-    
-    # Crear diccionario de comentarios
-    comments_dict = {}
-    root_comments = []
-    
-    # Construir estructura anidada
-    for comment_data in all_comments:
-        comment_resp = CommentResponse(
-            **comment_data,
-            user=users_dict.get(comment_data["user_id"]),
-            replies=[],
-            reply_count=0,
-            user_liked=comment_data["id"] in liked_comments
-        )
-        
-        comments_dict[comment_data["id"]] = comment_resp
-        
-        if comment_data["parent_comment_id"] is None:
-            root_comments.append(comment_resp)
-    
-    # Construir jerarquía de respuestas
-    for comment_data in all_comments:
-        if comment_data["parent_comment_id"]:
-            parent = comments_dict.get(comment_data["parent_comment_id"])
-            child = comments_dict.get(comment_data["id"])
-            if parent and child:
-                parent.replies.append(child)
-    
-    # Calcular conteos de respuestas anidadas recursivamente
-    def calculate_reply_count(comment):
-        count = len(comment.replies)
-        for reply in comment.replies:
-            count += calculate_reply_count(reply)
-        comment.reply_count = count
-        return count
-    
-    for comment in root_comments:
-        calculate_reply_count(comment)
+    """
+    Root comments of a poll, oldest first, each with its stored reply_count.
+    Pages by keyset: pass the X-Next-Cursor header as `cursor` (offset still works without it).
+    include_replies=false returns roots only; replies are then loaded per comment
+    from /comments/{comment_id}/replies.
+    """
+    roots, replies, next_cursor = await comment_threads.root_page(
+        poll_id, max(1, min(limit, ROOT_COMMENTS_MAX_LIMIT)), cursor, max(0, offset), include_replies
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
-    # Aplicar paginación solo a comentarios raíz
-    paginated_comments = root_comments[offset:offset + limit]
+    users_by_id, liked_ids = await comment_threads.hydrate(roots + replies, current_user.id)
+    return build_comment_tree(roots, replies, users_by_id, liked_ids)
+
+@api_router.get("/comments/{comment_id}/replies")
+async def get_comment_replies(
+    comment_id: str,
+    response: Response,
+    limit: int = REPLIES_DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Direct replies of a comment, oldest first (each with its own reply_count for further expansion)"""
+    replies, next_cursor = await comment_threads.replies_page(
+        comment_id, max(1, min(limit, REPLIES_MAX_LIMIT)), cursor
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
-    return paginated_comments
+    users_by_id, liked_ids = await comment_threads.hydrate(replies, current_user.id)
+    return build_comment_tree(replies, [], users_by_id, liked_ids)
 
 @api_router.put("/comments/{comment_id}", response_model=CommentResponse)
 async def update_comment(
@@ -4361,11 +4419,8 @@ async def update_comment(
     updated_comment = await db.comments.find_one({"id": comment_id})
     
     return CommentResponse(
-        **updated_comment,
-        user=current_user,
-        replies=[],
-        reply_count=0,
-        user_liked=False
+        **{**updated_comment, "replies": [], "user_liked": False},
+        user=current_user
     )
 
 @api_router.delete("/comments/{comment_id}")
@@ -4384,44 +4439,15 @@ async def delete_comment(
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found or not authorized")
     
-    # Guardar el poll_id para actualizar el contador después
-    poll_id = comment.get("poll_id")
-    
-    # Eliminar el comentario y todas sus respuestas recursivamente
-    # La función retorna el número de comentarios eliminados
-    deleted_count = await delete_comment_recursive(comment_id)
-    
-    # Decrementar el contador de comentarios en el poll
-    if poll_id:
-        await db.polls.update_one(
-            {"id": poll_id},
-            {"$inc": {"comments_count": -deleted_count}}
-        )
+    # Eliminar el comentario, todas sus respuestas (vía ancestor_ids) y sus likes en lote;
+    # los contadores del poll y de los ancestros se ajustan en la misma operación
+    deleted_ids, poll = await comment_threads.delete_subtree(comment)
+    if poll:
+        for deleted_id in deleted_ids:
+            activity_feed.retract_comment(poll.get("author_id"), deleted_id)
     
     return {"message": "Comment deleted successfully"}
 
-async def delete_comment_recursive(comment_id: str) -> int:
-    """Función auxiliar para eliminar comentarios de forma recursiva
-    Retorna el número de comentarios eliminados (incluyendo hijos)"""
-    
-    # Encontrar todos los comentarios hijos
-    child_comments = await db.comments.find({"parent_comment_id": comment_id}).to_list(1000)
-    
-    # Contador de comentarios eliminados
-    deleted_count = 1  # El comentario actual
-    
-    # Eliminar recursivamente los comentarios hijos
-    for child in child_comments:
-        deleted_count += await delete_comment_recursive(child["id"])
-    
-    # Eliminar likes del comentario
-    await db.comment_likes.delete_many({"comment_id": comment_id})
-    
-    # Eliminar el comentario principal
-    await db.comments.delete_one({"id": comment_id})
-    
-    return deleted_count
-
 @api_router.post("/comments/{comment_id}/like")
 async def toggle_comment_like(
     comment_id: str,
@@ -4490,56 +4516,20 @@ async def get_comment(
 ):
     """Get a specific comment with its replies"""
     
-    comment = await db.comments.find_one({"id": comment_id})
+    comment = await db.comments.find_one({"id": comment_id}, {"_id": 0})
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found")
     
-    # Obtener información del usuario
-    user_data = await db.users.find_one({"id": comment["user_id"]})
-    if not user_data:
-        raise HTTPException(status_code=404, detail="Comment author not found")
-    
-    user = UserResponse(**user_data)
-    
-    # Verificar si el usuario actual le dio like
-    user_like = await db.comment_likes.find_one({
-        "comment_id": comment_id,
-        "user_id": current_user.id
-    })
-    
-    # Obtener respuestas directas
-    replies_cursor = db.comments.find({
-        "parent_comment_id": comment_id
-    }).sort("created_at", 1)
+    # Respuestas directas (primera página) e información de usuarios/likes en lote
+    replies_data, _ = await comment_threads.replies_page(comment_id, REPLIES_MAX_LIMIT)
+    users_by_id, liked_ids = await comment_threads.hydrate([comment] + replies_data, current_user.id)
     
-    replies_data = await replies_cursor.to_list(100)
-    
-    # Procesar respuestas
-    replies = []
-    for reply_data in replies_data:
-        reply_user_data = await db.users.find_one({"id": reply_data["user_id"]})
-        if reply_user_data:
-            reply_user_like = await db.comment_likes.find_one({
-                "comment_id": reply_data["id"],
-                "user_id": current_user.id
-            })
-            
-            reply = CommentResponse(
-                **reply_data,
-                user=UserResponse(**reply_user_data),
-                replies=[],  # Por ahora solo 2 niveles
-                reply_count=0,
-                user_liked=bool(reply_user_like)
-            )
-            replies.append(reply)
+    if comment["user_id"] not in users_by_id:
+        raise HTTPException(status_code=404, detail="Comment author not found")
     
-    return CommentResponse(
-        **comment,
-        user=user,
-        replies=replies,
-        reply_count=len(replies),
-        user_liked=bool(user_like)
-    )
+    comment_response = build_comment_tree([comment], [], users_by_id, liked_ids)[0]
+    comment_response.replies = build_comment_tree(replies_data, [], users_by_id, liked_ids)
+    return comment_response
 
 # =============  FILE UPLOAD UTILITIES =============
 
@@ -5057,13 +5047,11 @@ async def get_polls(
     authors_list = await authors_cursor.to_list(len(author_ids))
     authors_dict = {user["id"]: UserResponse(**user) for user in authors_list}
     
-    # Batch get follow status for all authors to reduce DB queries
-    follow_relationships_cursor = db.follows.find({
-        "follower_id": current_user.id,
-        "following_id": {"$in": author_ids}
-    })
-    follow_relationships = await follow_relationships_cursor.to_list(len(author_ids))
-    following_dict = {rel["following_id"]: rel for rel in follow_relationships}
+    # Follow status for all authors from the in-memory follow graph
+    following_dict = {
+        author_id: {"following_id": author_id, "follower_id": current_user.id}
+        for author_id in await follow_graph.following_among(current_user.id, author_ids)
+    }
     
     # Get user votes and likes
     poll_ids = [poll["id"] for poll in polls]
@@ -5082,6 +5070,9 @@ async def get_polls(
     user_likes = await user_likes_cursor.to_list(len(poll_ids))
     liked_poll_ids = set(like["poll_id"] for like in user_likes)
     
+    # Music for the whole page (uncached iTunes ids in one lookup request)
+    music_by_id = await get_music_info_batch(poll.get("music_id") for poll in polls)
+    
     # Build response
     result = []
     for poll_data in polls:
@@ -5155,7 +5146,7 @@ async def get_polls(
             continue
         
         # Get music info if available
-        music_info = await get_music_info(poll_data.get("music_id")) if poll_data.get("music_id") else None
+        music_info = music_by_id.get(poll_data.get("music_id"))
         
         # Resolve mentioned users to user objects
         mentioned_users_data = []
@@ -5214,6 +5205,7 @@ async def get_polls(
 
 @api_router.get("/polls/fast")
 async def get_fast_polls(
+    request: Request,
     limit: int = 10,
     offset: int = 0,
     lightweight: bool = True,
@@ -5247,7 +5239,7 @@ async def get_fast_polls(
                 load_thumbnails=False  # Skip for speed
             )
         
-        return {
+        payload = {
             "polls": polls,
             "total": len(polls),
             "offset": offset,
@@ -5256,6 +5248,18 @@ async def get_fast_polls(
             "cache_enabled": True
         }
         
+        if lightweight:
+            # Lightweight feed is cached - serve a pre-compressed body while unchanged
+            from response_compression import precompressed_response
+            return precompressed_response(
+                request,
+                payload,
+                cache_key=f"polls_fast_{current_user.id}_{limit}_{offset}",
+                response_class=CustomJSONResponse
+            )
+        
+        return payload
+        
     except Exception as e:
         print(f"❌ Fast feed error: {str(e)}")
         # Fallback to original endpoint
@@ -5414,6 +5418,8 @@ async def get_performance_stats(
     try:
         from database_optimizer import db_optimizer
         from optimized_feed import feed_optimizer
+        from response_compression import get_compression_stats
+        from admission_control import get_admission_stats
         
         stats = {
             "database_optimizer": {
@@ -5424,6 +5430,21 @@ async def get_performance_stats(
                 "initialized": feed_optimizer is not None, 
                 "cache_stats": feed_optimizer.getCacheStats() if feed_optimizer else None
             },
+            "response_compression": get_compression_stats(),
+            "admission_control": get_admission_stats(),
+            "search_index": search_index.get_stats(),
+            "autocomplete": autocomplete_engine.get_stats(),
+            "fuzzy_user_index": fuzzy_user_index.get_stats(),
+            "search_cache": search_cache.get_stats(),
+            "activity_feed": activity_feed.get_stats(),
+            "follow_graph": follow_graph.get_stats(),
+            "realtime": realtime.get_stats(),
+            "unread_counters": messaging.unread.get_stats(),
+            "story_expiry": story_expiry.get_stats(),
+            "login_guard": login_guard.get_stats(),
+            "itunes_client": itunes_client.get_stats(),
+            "music_cache": music_cache.get_stats(),
+            "password_hashing": password_pool.get_stats(),
             "performance_endpoints": {
                 "ultra_fast_feed": "/api/polls/ultra-fast",
                 "fast_feed": "/api/polls/fast", 
@@ -5436,7 +5457,8 @@ async def get_performance_stats(
                 "caching": True,
                 "batch_processing": True,
                 "lazy_loading": True,
-                "video_optimization": True
+                "video_optimization": True,
+                "response_compression": True
             }
         }
         
@@ -5581,17 +5603,11 @@ async def get_following_polls(
     """Get polls from users that the current user follows"""
     
     # Get users that current user follows
-    follow_relationships_cursor = db.follows.find({
-        "follower_id": current_user.id
-    })
-    follow_relationships = await follow_relationships_cursor.to_list(None)
+    following_user_ids = await follow_graph.following_ids(current_user.id)
     
-    if not follow_relationships:
+    if not following_user_ids:
         return []
     
-    # Extract following user IDs
-    following_user_ids = [rel["following_id"] for rel in follow_relationships]
-    
     # Build filter query to only include polls from followed users
     filter_query = {
         "is_active": True,
@@ -5632,6 +5648,9 @@ async def get_following_polls(
     user_likes = await user_likes_cursor.to_list(len(poll_ids))
     liked_poll_ids = set(like["poll_id"] for like in user_likes)
     
+    # Music for the whole page (uncached iTunes ids in one lookup request)
+    music_by_id = await get_music_info_batch(poll.get("music_id") for poll in polls)
+    
     # Build response (same logic as get_polls but for followed users only)
     result = []
     for poll_data in polls:
@@ -5687,9 +5706,7 @@ async def get_following_polls(
         total_votes = sum(opt["votes"] for opt in poll_data.get("options", []))
         
         # Get music information
-        music_info = None
-        if poll_data.get("music_id"):
-            music_info = await get_music_info(poll_data["music_id"])
+        music_info = music_by_id.get(poll_data.get("music_id"))
         
         # Resolve mentioned users to user objects
         mentioned_users_data = []
@@ -5786,12 +5803,10 @@ async def get_user_mentioned_polls(
         authors_dict = {user["id"]: UserResponse(**user) for user in authors_list}
         
         # Check following status for all authors
-        following_cursor = db.follows.find({
-            "follower_id": current_user.id,
-            "following_id": {"$in": author_ids}
-        })
-        following_list = await following_cursor.to_list(len(author_ids))
-        following_dict = {follow["following_id"]: follow for follow in following_list}
+        following_dict = {
+            author_id: {"following_id": author_id, "follower_id": current_user.id}
+            for author_id in await follow_graph.following_among(current_user.id, author_ids)
+        }
         
         # Get user votes and likes for these polls
         poll_ids = [poll["id"] for poll in polls]
@@ -5982,6 +5997,10 @@ async def create_poll(
     
     # Insert into database
     await db.polls.insert_one(poll.model_dump())  # Pydantic v2
+    search_index.upsert("posts", poll.model_dump())
+    search_cache.invalidate_for(poll.model_dump())
+    autocomplete_engine.update_poll_hashtags(None, poll.model_dump())
+    await record_hashtag_stats(None, poll.model_dump())
     
     # Send notifications to mentioned users (both general and option-specific)
     all_mentioned_users = set(poll_data.mentioned_users)
@@ -5991,7 +6010,7 @@ async def create_poll(
         all_mentioned_users.update(option.mentioned_users)
     
     if all_mentioned_users:
-        await send_mention_notifications(list(all_mentioned_users), poll.id, current_user)
+        await send_mention_notifications(list(all_mentioned_users), poll.model_dump(), current_user)
     
     # Return poll response
     options_response = []
@@ -6117,6 +6136,7 @@ async def vote_on_poll(
     
     if result.modified_count == 0:
         raise HTTPException(status_code=400, detail="Invalid option ID")
+    activity_feed.record_vote(poll, current_user.id, vote_data.option_id)
     
     # Update user profiles after vote
     try:
@@ -6128,11 +6148,6 @@ async def vote_on_poll(
         if poll_author_id:
             await ensure_user_profile(poll_author_id)
             
-        # Clear follow status cache for affected users
-        cache_keys_to_clear = [key for key in follow_status_cache.keys() if current_user.id in key or poll_author_id in key]
-        for key in cache_keys_to_clear:
-            follow_status_cache.pop(key, None)
-            
     except Exception as e:
         print(f"Error updating profiles after vote: {e}")
     
@@ -6180,6 +6195,7 @@ async def toggle_poll_like(
             "poll_id": poll_id,
             "user_id": current_user.id
         })
+        activity_feed.retract_like(poll, current_user.id)
         
         # Decrement like count
         await db.polls.update_one(
@@ -6200,11 +6216,6 @@ async def toggle_poll_like(
             if poll_author_id:
                 await ensure_user_profile(poll_author_id)
                 
-            # Clear follow status cache for affected users
-            cache_keys_to_clear = [key for key in follow_status_cache.keys() if current_user.id in key or poll_author_id in key]
-            for key in cache_keys_to_clear:
-                follow_status_cache.pop(key, None)
-                
         except Exception as e:
             print(f"Error updating profiles after like removal: {e}")
         
@@ -6220,6 +6231,7 @@ async def toggle_poll_like(
         )
         
         await db.poll_likes.insert_one(like.dict())
+        activity_feed.record_like(poll, current_user.id, like.created_at)
         
         # Increment like count
         await db.polls.update_one(
@@ -6240,11 +6252,6 @@ async def toggle_poll_like(
             if poll_author_id:
                 await ensure_user_profile(poll_author_id)
                 
-            # Clear follow status cache for affected users
-            cache_keys_to_clear = [key for key in follow_status_cache.keys() if current_user.id in key or poll_author_id in key]
-            for key in cache_keys_to_clear:
-                follow_status_cache.pop(key, None)
-                
         except Exception as e:
             print(f"Error updating profiles after like addition: {e}")
         
@@ -6497,6 +6504,9 @@ async def upload_audio(
             result = await db.user_audio.insert_one(audio_data.dict())
             if not result.inserted_id:
                 raise HTTPException(status_code=500, detail="Failed to save audio to database")
+            search_index.upsert("sounds", audio_data.dict())
+            search_cache.invalidate_for(audio_data.dict())
+            autocomplete_engine.upsert_sound(audio_data.dict())
             
             # Obtener información del usuario
             uploader_response = UserResponse(
@@ -6717,6 +6727,9 @@ async def update_audio(
         
         # Obtener audio actualizado
         updated_audio = await db.user_audio.find_one({"id": audio_id})
+        search_index.upsert("sounds", updated_audio)
+        search_cache.invalidate_for(audio_data, updated_audio)
+        autocomplete_engine.upsert_sound(updated_audio)
         uploader_response = UserResponse(
             id=current_user.id,
             username=current_user.username,
@@ -6775,6 +6788,9 @@ async def delete_audio(
         
         if result.modified_count == 0:
             raise HTTPException(status_code=500, detail="Failed to delete audio")
+        search_index.remove("sounds", audio_id)
+        search_cache.invalidate_for(audio_data)
+        autocomplete_engine.remove_sound(audio_id)
         
         # Opcional: Eliminar archivo físico
         try:
@@ -6830,6 +6846,7 @@ async def use_audio_in_post(
             {"id": audio_id},
             {"$inc": {"uses_count": 1}}
         )
+        autocomplete_engine.set_sound_uses(audio_id, audio_data.get("uses_count", 0) + 1)
         
         return {
             "success": True,
@@ -7226,6 +7243,9 @@ async def get_posts_using_audio(
         poll_responses = []
         logger.info(f"🏗️ Construyendo respuesta para {len(polls)} posts")
         
+        # Música de toda la página (ids de iTunes sin caché en una sola petición lookup)
+        music_by_id = await get_music_info_batch(poll.get("music_id") for poll in polls)
+        
         for i, poll_data in enumerate(polls):
             try:
                 logger.info(f"📝 Procesando post {i+1}: {poll_data.get('id', 'unknown')}")
@@ -7269,12 +7289,7 @@ async def get_posts_using_audio(
                         options.append(option_dict)
                 
                 # Get music info if available
-                music_info = None
-                if poll_data.get("music_id"):
-                    try:
-                        music_info = await get_music_info(poll_data.get("music_id"))
-                    except Exception as music_error:
-                        logger.error(f"❌ Error obteniendo info de música para {poll_data.get('music_id')}: {str(music_error)}")
+                music_info = music_by_id.get(poll_data.get("music_id"))
                 
                 # Calcular time_ago
                 created_at_dt = poll_data.get("created_at")
@@ -7585,6 +7600,9 @@ async def get_user_favorites(
         total = await db.audio_favorites.count_documents({"user_id": current_user.id})
         
         # Enrich favorites with current audio details
+        system_music = await get_music_info_batch(
+            fav["audio_id"] for fav in favorites if fav["audio_type"] == "system"
+        )
         enriched_favorites = []
         for fav in favorites:
             favorite_response = AudioFavoriteResponse(
@@ -7599,7 +7617,7 @@ async def get_user_favorites(
             
             # Try to get current audio details
             if fav["audio_type"] == "system":
-                music_info = await get_music_info(fav["audio_id"])
+                music_info = system_music.get(fav["audio_id"])
                 if music_info:
                     favorite_response.audio_details = music_info
             elif fav["audio_type"] == "user":
@@ -7704,6 +7722,10 @@ async def update_poll(
         if updated_poll:
             # Remove MongoDB ObjectId field to avoid serialization issues
             updated_poll.pop('_id', None)
+            search_index.upsert("posts", updated_poll)
+            search_cache.invalidate_for(poll, updated_poll)
+            autocomplete_engine.update_poll_hashtags(poll, updated_poll)
+            await record_hashtag_stats(poll, updated_poll)
         return updated_poll
         
     except HTTPException:
@@ -7739,6 +7761,12 @@ async def delete_poll(
         if result.deleted_count == 0:
             raise HTTPException(status_code=400, detail="Failed to delete poll")
         
+        search_index.remove("posts", poll_id)
+        search_cache.invalidate_for(poll)
+        autocomplete_engine.update_poll_hashtags(poll, None)
+        await record_hashtag_stats(poll, None)
+        activity_feed.retract_poll(poll_id)
+        
         return {"message": "Poll deleted successfully"}
         
     except HTTPException:
@@ -8183,6 +8211,9 @@ async def get_saved_polls(
             user_likes = await user_likes_cursor.to_list(len(poll_ids))
             liked_poll_ids = set(like["poll_id"] for like in user_likes)
             
+            # Music for the whole page (uncached iTunes ids in one lookup request)
+            music_by_id = await get_music_info_batch(poll.get("music_id") for poll in polls_dict.values())
+            
             for record in saved_records:
                 if record["poll_id"] in polls_dict:
                     poll_data = polls_dict[record["poll_id"]]
@@ -8235,7 +8266,7 @@ async def get_saved_polls(
                         continue
                     
                     # Get music info if available
-                    music_info = await get_music_info(poll_data.get("music_id")) if poll_data.get("music_id") else None
+                    music_info = music_by_id.get(poll_data.get("music_id"))
                     
                     # Build enriched poll response similar to regular polls endpoint
                     enriched_poll = {
@@ -8487,6 +8518,20 @@ async def get_user_social_links_by_id(
         logger.error(f"Error getting user social links: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.exception_handler(PasswordHashingBusy)
+async def password_hashing_busy_handler(request: Request, exc: PasswordHashingBusy):
+    """Pool de hashing saturado: rechazar rápido en vez de encolar sin límite"""
+    return FastAPIJSONResponse(
+        status_code=503,
+        content={"detail": "Authentication is temporarily overloaded. Please try again."},
+        headers={"Retry-After": "1"}
+    )
+
+# Control de admisión (rate limit / load shedding); queda dentro de CORS para
+# que las respuestas 429/503 lleven cabeceras CORS
+from admission_control import AdmissionControlMiddleware
+app.add_middleware(AdmissionControlMiddleware)
+
 # Agregar middleware CORS ANTES de incluir routers
 app.add_middleware(
     CORSMiddleware,
@@ -8494,8 +8539,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After"],  # Cursor de paginación / control de admisión
 )
 
+# Compresión de respuestas (gzip / br / zstd negociado con Accept-Encoding)
+from response_compression import CompressionMiddleware
+app.add_middleware(CompressionMiddleware)
+
 # =============  SEARCH HISTORY ENDPOINTS =============
 
 @api_router.get("/search/recent")
@@ -8746,142 +8796,14 @@ async def get_stories(
 ):
     """Get stories from followed users (grouped by user)"""
     try:
-        # Get followed users from follows collection
-        follows_cursor = db.follows.find({"follower_id": current_user.id})
-        follows_docs = await follows_cursor.to_list(length=1000)
-        following_ids = [doc["following_id"] for doc in follows_docs]
-        
-        logger.info(f"📖 [STORIES] User {current_user.id} is following {len(following_ids)} users: {following_ids}")
-        
-        # Add current user to see their own stories
+        # Followed users (in-memory follow graph) plus the current user's own stories
+        following_ids = await follow_graph.following_ids(current_user.id)
         all_user_ids = following_ids + [current_user.id]
         
-        logger.info(f"📖 [STORIES] Searching for stories from {len(all_user_ids)} users (including self)")
-        
-        # Get active stories from followed users
-        current_time = datetime.utcnow()
-        
-        # First, let's check how many stories exist in total for these users
-        total_stories_count = await db.stories.count_documents({
-            "user_id": {"$in": all_user_ids}
-        })
-        logger.info(f"📖 [STORIES] Total stories in DB for these users: {total_stories_count}")
-        
-        # Check active stories count
-        active_stories_count = await db.stories.count_documents({
-            "user_id": {"$in": all_user_ids},
-            "is_active": True
-        })
-        logger.info(f"📖 [STORIES] Active stories: {active_stories_count}")
-        
-        # Check non-expired stories count
-        non_expired_count = await db.stories.count_documents({
-            "user_id": {"$in": all_user_ids},
-            "is_active": True,
-            "expires_at": {"$gt": current_time}
-        })
-        logger.info(f"📖 [STORIES] Non-expired active stories: {non_expired_count}")
-        
-        stories_cursor = db.stories.find({
-            "user_id": {"$in": all_user_ids},
-            "is_active": True,
-            "expires_at": {"$gt": current_time}
-        }).sort("created_at", -1)
-        
-        stories = await stories_cursor.to_list(length=1000)
-        
-        logger.info(f"📖 [STORIES] Retrieved {len(stories)} stories from database")
-        
-        # Log user IDs that have stories
-        if stories:
-            unique_user_ids = set(story["user_id"] for story in stories)
-            logger.info(f"📖 [STORIES] Stories found for user IDs: {unique_user_ids}")
-        
-        if not stories:
-            logger.info(f"📖 [STORIES] No stories found, returning empty list")
-            return []
-        
-        # Get story views for current user
-        story_ids = [story["id"] for story in stories]
-        views_cursor = db.story_views.find({
-            "story_id": {"$in": story_ids},
-            "user_id": current_user.id
-        })
-        viewed_story_ids = set([view["story_id"] async for view in views_cursor])
-        
-        # Group stories by user
-        stories_by_user = {}
-        for story in stories:
-            user_id = story["user_id"]
-            if user_id not in stories_by_user:
-                stories_by_user[user_id] = []
-            stories_by_user[user_id].append(story)
-        
-        # Get user info for all users
-        user_ids = list(stories_by_user.keys())
-        users_cursor = db.users.find({"id": {"$in": user_ids}})
-        users_dict = {user["id"]: user async for user in users_cursor}
-        
-        # Get music data for stories that have music_id using get_music_info helper
-        music_ids = [story.get("music_id") for story in stories if story.get("music_id")]
-        music_dict = {}
-        if music_ids:
-            logger.info(f"📖 [STORIES] Fetching music data for {len(set(music_ids))} unique music IDs")
-            for music_id in set(music_ids):  # Remove duplicates
-                try:
-                    music_info = await get_music_info(music_id)
-                    if music_info:
-                        music_dict[music_id] = music_info
-                        logger.info(f"   ✅ Got music: {music_info.get('title')} - {music_info.get('artist')}")
-                    else:
-                        logger.warning(f"   ⚠️ No music found for ID: {music_id}")
-                except Exception as e:
-                    logger.error(f"   ❌ Error fetching music {music_id}: {str(e)}")
-        
-        # Build response
-        result = []
-        for user_id, user_stories in stories_by_user.items():
-            user_data = users_dict.get(user_id)
-            if not user_data:
-                continue
-            
-            user_response = UserResponse(**user_data)
-            
-            # Convert stories to StoryResponse
-            story_responses = []
-            has_unviewed = False
-            for story in user_stories:
-                viewed_by_me = story["id"] in viewed_story_ids
-                if not viewed_by_me:
-                    has_unviewed = True
-                
-                # Get music data if story has music_id
-                music_data = None
-                if story.get("music_id"):
-                    music_data = music_dict.get(story["music_id"])
-                    
-                story_responses.append(StoryResponse(
-                    **story,
-                    user=user_response,
-                    viewed_by_me=viewed_by_me,
-                    music=music_data
-                ))
-            
-            result.append(StoriesGroupResponse(
-                user=user_response,
-                stories=story_responses,
-                total_stories=len(story_responses),
-                has_unviewed=has_unviewed
-            ))
-        
-        # Sort: unviewed stories first, then by most recent
-        result.sort(key=lambda x: (not x.has_unviewed, -x.stories[0].created_at.timestamp()))
+        groups = await stories_tray.groups(current_user.id, all_user_ids, get_music_info_batch)
         
-        logger.info(f"📖 [STORIES] Returning {len(result)} story groups to frontend")
-        for group in result:
-            logger.info(f"   - User {group.user.username} ({group.user.id}): {group.total_stories} stories, has_unviewed={group.has_unviewed}")
-        
-        return result
+        # Groups are already shaped like StoriesGroupResponse; skip per-story model validation
+        return CustomJSONResponse(content=groups)
         
     except Exception as e:
         logger.error(f"Error getting stories: {str(e)}")
@@ -8922,21 +8844,10 @@ async def get_user_stories(
         })
         viewed_story_ids = set([view["story_id"] async for view in views_cursor])
         
-        # Get music data for stories that have music_id using get_music_info helper
-        music_ids = [story.get("music_id") for story in stories if story.get("music_id")]
-        music_dict = {}
-        if music_ids:
-            logger.info(f"📖 [USER_STORIES] Fetching music data for {len(set(music_ids))} unique music IDs")
-            for music_id in set(music_ids):  # Remove duplicates
-                try:
-                    music_info = await get_music_info(music_id)
-                    if music_info:
-                        music_dict[music_id] = music_info
-                        logger.info(f"   ✅ Got music: {music_info.get('title')} - {music_info.get('artist')}")
-                    else:
-                        logger.warning(f"   ⚠️ No music found for ID: {music_id}")
-                except Exception as e:
-                    logger.error(f"   ❌ Error fetching music {music_id}: {str(e)}")
+        # Get music data for stories that have music_id (resolved in one batch)
+        music_dict = await stories_tray.resolve_music(
+            (story.get("music_id") for story in stories), get_music_info_batch
+        )
         
         # Convert stories to StoryResponse
         story_responses = []
@@ -8978,34 +8889,13 @@ async def view_story(
 ):
     """Mark a story as viewed"""
     try:
-        # Check if story exists
-        story = await db.stories.find_one({"id": story_id})
-        if not story:
+        result = await stories_tray.record_views(current_user.id, [story_id])
+        if result["not_found"]:
             raise HTTPException(status_code=404, detail="Story not found")
         
-        # Check if already viewed
-        existing_view = await db.story_views.find_one({
-            "story_id": story_id,
-            "user_id": current_user.id
-        })
-        
-        if existing_view:
+        if result["already_viewed"]:
             return {"success": True, "message": "Already viewed"}
         
-        # Create view record
-        view_doc = StoryView(
-            story_id=story_id,
-            user_id=current_user.id
-        )
-        
-        await db.story_views.insert_one(view_doc.dict())
-        
-        # Increment views count
-        await db.stories.update_one(
-            {"id": story_id},
-            {"$inc": {"views_count": 1}}
-        )
-        
         return {"success": True, "message": "Story viewed"}
         
     except HTTPException:
@@ -9014,6 +8904,20 @@ async def view_story(
         logger.error(f"Error viewing story: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to view story")
 
+@api_router.post("/stories/views", tags=["Stories"])
+async def view_stories_batch(
+    batch: StoryViewsBatch,
+    current_user: User = Depends(get_current_user)
+):
+    """Mark many stories as viewed at once (tapping through the tray)"""
+    try:
+        result = await stories_tray.record_views(current_user.id, batch.story_ids)
+        return {"success": True, **result}
+        
+    except Exception as e:
+        logger.error(f"Error viewing stories: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to view stories")
+
 @api_router.delete("/stories/{story_id}", tags=["Stories"])
 async def delete_story(
     story_id: str,
@@ -9164,6 +9068,108 @@ async def upload_story_media(
         logger.error(f"Error getting story viewers: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get story viewers")
 
+# =============  STARTUP / SHUTDOWN =============
+
+# Startup jobs still running (referenced so they are not garbage collected)
+startup_tasks: Set[asyncio.Task] = set()
+
+def run_startup_task(coro, name: str):
+    """Run a startup job in the background; failures are logged instead of lost"""
+    async def run():
+        try:
+            await coro
+        except Exception as e:
+            print(f"⚠️  {name} startup failed: {e}")
+    
+    task = asyncio.create_task(run())
+    startup_tasks.add(task)
+    task.add_done_callback(startup_tasks.discard)
+
+@app.on_event("startup")
+async def warm_in_memory_indexes():
+    """Build in-memory search structures in the background so the first query is fast"""
+    run_startup_task(search_index.ensure_ready(), "Search index")
+    run_startup_task(fuzzy_user_index.ensure_ready(), "Fuzzy user index")
+    run_startup_task(warm_hashtags_and_autocomplete(), "Hashtags / autocomplete")
+    run_startup_task(start_activity_feed(), "Activity feed")
+    run_startup_task(social_graph.initialize_indexes(), "Social graph")
+    run_startup_task(start_messaging(), "Messaging")
+    run_startup_task(start_comment_threads(), "Comment threads")
+    run_startup_task(start_stories_tray(), "Stories tray")
+    run_startup_task(start_story_expiry(), "Story expiry")
+    run_startup_task(start_realtime(), "Realtime")
+    run_startup_task(start_login_guard(), "Login guard")
+    run_startup_task(start_music_cache(), "Music cache")
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Close pooled outbound HTTP connections"""
+    await itunes_client.close()
+
+async def start_messaging():
+    """Inbox/history indexes and the unread counter reconciler"""
+    try:
+        await messaging.start()
+    except Exception as e:
+        print(f"⚠️  Messaging startup failed: {e}")
+
+async def start_comment_threads():
+    """Comment indexes and one-time ancestor path / reply count backfill"""
+    try:
+        await comment_threads.start()
+    except Exception as e:
+        print(f"⚠️  Comment threads startup failed: {e}")
+
+async def start_stories_tray():
+    """Tray indexes and the unique (story, viewer) index that deduplicates views"""
+    try:
+        await stories_tray.initialize_indexes()
+    except Exception as e:
+        print(f"⚠️  Stories tray startup failed (views deduplicated by lookup): {e}")
+
+async def start_story_expiry():
+    """Archive indexes and the expired story sweeper"""
+    try:
+        await story_expiry.start()
+    except Exception as e:
+        print(f"⚠️  Story expiry startup failed: {e}")
+
+async def start_music_cache():
+    """Music metadata index and prewarm of tracks used by active polls/stories"""
+    try:
+        await music_cache.start()
+    except Exception as e:
+        print(f"⚠️  Music cache startup failed: {e}")
+
+async def start_login_guard():
+    """Audit index, rate-limit windows seeded from recent failures, audit writer"""
+    try:
+        await login_guard.start()
+    except Exception as e:
+        print(f"⚠️  Login guard startup failed: {e}")
+
+async def start_realtime():
+    """Subscribe to the realtime pub/sub channel before the first publish"""
+    try:
+        await realtime.start()
+    except Exception as e:
+        print(f"⚠️  Realtime pub/sub startup failed: {e}")
+
+async def start_activity_feed():
+    """Inbox indexes, one-time backfill and the background writer"""
+    try:
+        await activity_feed.start()
+    except Exception as e:
+        print(f"⚠️  Activity inbox startup failed: {e}")
+
+async def warm_hashtags_and_autocomplete():
+    """Hashtag statistics first, so the autocomplete build can read them"""
+    try:
+        await hashtag_stats.start()
+    except Exception as e:
+        print(f"⚠️  Hashtag statistics startup failed: {e}")
+    await autocomplete_engine.ensure_ready()
+
 # Incluir el router en la aplicación
 app.include_router(api_router)
 
@@ -0,0 +1,330 @@
+"""
+Social Graph Queries for VotaTok
+Follower / following lists with keyset (created_at, id) cursors, one batched
+user hydration per page and viewer relationship flags computed in the same pass.
+FollowGraphCache keeps per-user following sets in memory for follow checks.
+"""
+import asyncio
+import base64
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# Fields never returned when hydrating users
+PRIVATE_USER_FIELDS = {"_id": 0, "hashed_password": 0}
+
+DIRECTIONS = {
+    # direction -> (field matching the user, field holding the listed user)
+    "followers": ("following_id", "follower_id"),
+    "following": ("follower_id", "following_id"),
+}
+
+
+def encode_cursor(created_at: datetime, follow_id: str) -> str:
+    raw = f"{created_at.isoformat()}|{follow_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, str]]:
+    """(created_at, follow_id) of the last edge of the previous page, None if malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, follow_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), follow_id
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class SocialGraph:
+    """Paginated follow edges hydrated with users and viewer flags"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def initialize_indexes(self):
+        await self.db.follows.create_index(
+            [("following_id", 1), ("created_at", -1), ("id", -1)], name="followers_keyset"
+        )
+        await self.db.follows.create_index(
+            [("follower_id", 1), ("created_at", -1), ("id", -1)], name="following_keyset"
+        )
+
+    async def relationship_flags(self, viewer_id: Optional[str], user_ids: List[str]) -> Dict[str, Dict[str, bool]]:
+        """{user_id: {is_following, follows_you, is_mutual}} for the viewer, two indexed queries"""
+        flags = {
+            user_id: {"is_following": False, "follows_you": False, "is_mutual": False}
+            for user_id in user_ids
+        }
+        if not viewer_id or not user_ids:
+            return flags
+
+        viewer_follows, follows_viewer = await asyncio.gather(
+            self.db.follows.find(
+                {"follower_id": viewer_id, "following_id": {"$in": user_ids}},
+                {"_id": 0, "following_id": 1}
+            ).to_list(len(user_ids)),
+            self.db.follows.find(
+                {"follower_id": {"$in": user_ids}, "following_id": viewer_id},
+                {"_id": 0, "follower_id": 1}
+            ).to_list(len(user_ids))
+        )
+        for follow in viewer_follows:
+            flags[follow["following_id"]]["is_following"] = True
+        for follow in follows_viewer:
+            flags[follow["follower_id"]]["follows_you"] = True
+        for user_flags in flags.values():
+            user_flags["is_mutual"] = user_flags["is_following"] and user_flags["follows_you"]
+        return flags
+
+    async def list_page(
+        self,
+        user_id: str,
+        direction: str,
+        limit: int,
+        cursor: Optional[str] = None,
+        viewer_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        with_total: bool = True
+    ) -> Dict:
+        """
+        One page of followers/following, newest first.
+        Returns {"items": [{"user", "follow", **flags}], "next_cursor", "total"}.
+        """
+        match_field, other_field = DIRECTIONS[direction]
+        query: Dict = {match_field: user_id}
+        if since is not None:
+            query["created_at"] = {"$gte": since}
+        position = decode_cursor(cursor) if cursor else None
+        if position is not None:
+            created_at, follow_id = position
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": follow_id}},
+            ]
+
+        follows_query = self.db.follows.find(query, {"_id": 0}).sort(
+            [("created_at", -1), ("id", -1)]
+        ).limit(limit + 1).to_list(limit + 1)
+        total_query = self.db.follows.count_documents({match_field: user_id}) if with_total else None
+
+        if total_query is not None:
+            follows, total = await asyncio.gather(follows_query, total_query)
+        else:
+            follows, total = await follows_query, None
+
+        has_more = len(follows) > limit
+        follows = follows[:limit]
+        other_ids = [follow[other_field] for follow in follows]
+
+        users, flags = await asyncio.gather(
+            self.db.users.find({"id": {"$in": other_ids}}, PRIVATE_USER_FIELDS).to_list(len(other_ids)),
+            self.relationship_flags(viewer_id, other_ids)
+        )
+        users_by_id = {user["id"]: user for user in users}
+
+        items = []
+        for follow in follows:
+            user = users_by_id.get(follow[other_field])
+            if user:
+                items.append({"user": user, "follow": follow, **flags[user["id"]]})
+
+        next_cursor = None
+        if has_more and follows:
+            last = follows[-1]
+            next_cursor = encode_cursor(last["created_at"], last["id"])
+
+        return {"items": items, "next_cursor": next_cursor, "total": total}
+
+
+class IdInterner:
+    """Maps string ids to dense ints (and back) so id sets are compact int arrays"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+
+    def intern(self, value: str) -> int:
+        number = self.ids.get(value)
+        if number is None:
+            number = self.ids[value] = len(self.names)
+            self.names.append(value)
+        return number
+
+    def lookup(self, value: str) -> Optional[int]:
+        return self.ids.get(value)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class FollowGraphCache:
+    """
+    In-process following sets: user -> sorted array('i') of interned followed ids.
+    Loaded lazily from `follows`, kept current by the follow/unfollow endpoints,
+    evicted LRU and reloaded after `ttl_seconds` to pick up writes from other processes.
+    """
+
+    def __init__(self, db, max_users: int = 50000, max_following: int = 20000, ttl_seconds: int = 600):
+        self.db = db
+        self.max_users = max_users
+        self.max_following = max_following  # Larger sets are not cached (queried directly)
+        self.ttl_seconds = ttl_seconds
+        self.interner = IdInterner()
+        # user int -> (loaded_at, sorted following ints)
+        self.following: "OrderedDict[int, Tuple[float, array]]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+        # Follow/unfollow applied while a load is in flight, replayed onto the loaded set
+        self._pending: Dict[int, List[Tuple[bool, int]]] = {}
+        self.hits = 0
+        self.loads = 0
+
+    async def _load(self, user: int) -> Optional[array]:
+        user_id = self.interner.names[user]
+        docs = await self.db.follows.find(
+            {"follower_id": user_id}, {"_id": 0, "following_id": 1}
+        ).limit(self.max_following + 1).to_list(self.max_following + 1)
+        self.loads += 1
+        if len(docs) > self.max_following:
+            return None
+        following = array("i", sorted({self.interner.intern(doc["following_id"]) for doc in docs}))
+        for add, target in self._pending.pop(user, []):
+            self._apply(following, add, target)
+        return following
+
+    @staticmethod
+    def _apply(following: array, add: bool, target: int):
+        position = bisect_left(following, target)
+        present = position < len(following) and following[position] == target
+        if add and not present:
+            following.insert(position, target)
+        elif not add and present:
+            following.pop(position)
+
+    async def _following_of(self, user_id: str) -> Optional[array]:
+        """Sorted following array for a user, None when too large to cache"""
+        user = self.interner.intern(user_id)
+        cached = self.following.get(user)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl_seconds:
+            self.following.move_to_end(user)
+            self.hits += 1
+            return cached[1]
+
+        pending = self._loading.get(user)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user] = future
+        self._pending[user] = []
+        try:
+            following = await self._load(user)
+            if following is not None:
+                self.following[user] = (time.monotonic(), following)
+                self.following.move_to_end(user)
+                while len(self.following) > self.max_users:
+                    self.following.popitem(last=False)
+            future.set_result(following)
+            return following
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(user, None)
+            self._pending.pop(user, None)
+
+    async def is_following(self, follower_id: str, following_id: str) -> bool:
+        following = await self._following_of(follower_id)
+        if following is None:
+            return await self.db.follows.find_one(
+                {"follower_id": follower_id, "following_id": following_id}, {"_id": 1}
+            ) is not None
+        target = self.interner.lookup(following_id)
+        if target is None:
+            return False
+        position = bisect_left(following, target)
+        return position < len(following) and following[position] == target
+
+    async def following_ids(self, follower_id: str) -> List[str]:
+        """Every user id the user follows"""
+        following = await self._following_of(follower_id)
+        if following is None:
+            docs = await self.db.follows.find(
+                {"follower_id": follower_id}, {"_id": 0, "following_id": 1}
+            ).to_list(None)
+            return [doc["following_id"] for doc in docs]
+        names = self.interner.names
+        return [names[target] for target in following]
+
+    async def is_mutual(self, user_a: str, user_b: str) -> bool:
+        a_follows_b, b_follows_a = await asyncio.gather(
+            self.is_following(user_a, user_b), self.is_following(user_b, user_a)
+        )
+        return a_follows_b and b_follows_a
+
+    async def following_among(self, follower_id: str, candidate_ids: List[str]) -> set:
+        """Subset of candidate_ids the user follows"""
+        following = await self._following_of(follower_id)
+        if following is None:
+            docs = await self.db.follows.find(
+                {"follower_id": follower_id, "following_id": {"$in": candidate_ids}},
+                {"_id": 0, "following_id": 1}
+            ).to_list(len(candidate_ids))
+            return {doc["following_id"] for doc in docs}
+        result = set()
+        for candidate_id in candidate_ids:
+            target = self.interner.lookup(candidate_id)
+            if target is None:
+                continue
+            position = bisect_left(following, target)
+            if position < len(following) and following[position] == target:
+                result.add(candidate_id)
+        return result
+
+    def _update(self, follower_id: str, following_id: str, add: bool):
+        user = self.interner.lookup(follower_id)
+        if user is None:
+            return
+        target = self.interner.intern(following_id)
+        if user in self._pending:
+            self._pending[user].append((add, target))
+        cached = self.following.get(user)
+        if cached is not None:
+            self._apply(cached[1], add, target)
+
+    def add_follow(self, follower_id: str, following_id: str):
+        self._update(follower_id, following_id, True)
+
+    def remove_follow(self, follower_id: str, following_id: str):
+        self._update(follower_id, following_id, False)
+
+    def get_stats(self) -> Dict:
+        return {
+            "cached_users": len(self.following),
+            "interned_ids": len(self.interner),
+            "edges": sum(len(entry[1]) for entry in self.following.values()),
+            "hits": self.hits,
+            "loads": self.loads
+        }
+
+
+# Global instances
+social_graph = None
+follow_graph = None
+
+
+def init_social_graph(db):
+    """Initialize social graph queries (indexes created at startup)"""
+    global social_graph
+    social_graph = SocialGraph(db)
+    return social_graph
+
+
+def init_follow_graph(db, ttl_seconds: int = 600):
+    """Initialize in-process follow graph cache (loaded lazily per user)"""
+    global follow_graph
+    follow_graph = FollowGraphCache(db, ttl_seconds=ttl_seconds)
+    return follow_graph
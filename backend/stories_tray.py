@@ -0,0 +1,342 @@
+"""
+Stories Tray for VotaTok
+Builds the stories tray from one indexed, projected stories query, one batched
+views query, one batched user query and one batched music lookup
+(server.get_music_info_batch), run concurrently. Groups are
+returned as plain dicts shaped like StoriesGroupResponse, so a full tray is
+serialized directly instead of through one Pydantic model per story.
+
+Views are recorded in bulk: one insert_many(ordered=False) against a unique
+(story_id, user_id) index, which drops repeats, then one bulk_write of
+views_count increments for the views that were actually new.
+
+A background sweeper moves expired stories into a compact `stories_archive`
+collection and prunes their `story_views`, so the hot collections only hold
+roughly the last 24h of content.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from config import config
+from models import MAX_STORY_VIEWS_BATCH, StoryResponse, StoryView, UserResponse
+
+logger = logging.getLogger(__name__)
+
+STORIES_CONFIG = config.STORIES_CONFIG
+
+# Story fields the tray needs (StoryResponse minus derived fields) plus the owner
+STORY_PROJECTION = {
+    "_id": 0,
+    "user_id": 1,
+    **{field: 1 for field in StoryResponse.model_fields if field not in ("user", "music", "viewed_by_me")}
+}
+
+# Fields kept for archived stories
+ARCHIVE_FIELDS = (
+    "id", "user_id", "media_type", "media_url", "thumbnail_url", "music_id",
+    "views_count", "created_at", "expires_at"
+)
+
+DUPLICATE_KEY = 11000
+
+# music ids -> {music_id: music info} (server.get_music_info_batch)
+MusicResolver = Callable[[List[str]], Awaitable[Dict[str, Dict[str, Any]]]]
+
+
+def user_payload(user: Dict) -> Dict:
+    """UserResponse-shaped dict for a raw user document"""
+    return UserResponse(**user).model_dump()
+
+
+class StoriesTray:
+    """Active stories grouped by author for the viewer's tray"""
+
+    # Duplicate cleanup + unique index attempts before giving up (views racing the cleanup)
+    UNIQUE_VIEW_INDEX_ATTEMPTS = 3
+
+    def __init__(self, db):
+        self.db = db
+        # Until story_views_unique exists, record_views checks existing views itself
+        self.unique_views_ready = False
+
+    async def initialize_indexes(self):
+        await self.db.stories.create_index(
+            [("user_id", 1), ("is_active", 1), ("expires_at", 1), ("created_at", -1)],
+            name="stories_tray"
+        )
+        await self.db.story_views.create_index(
+            [("user_id", 1), ("story_id", 1)], name="story_views_viewer"
+        )
+        for attempt in range(1, self.UNIQUE_VIEW_INDEX_ATTEMPTS + 1):
+            try:
+                await self._create_unique_view_index()
+                self.unique_views_ready = True
+                return
+            except (DuplicateKeyError, OperationFailure):
+                if attempt == self.UNIQUE_VIEW_INDEX_ATTEMPTS:
+                    raise
+                # Repeated views recorded before the index existed
+                await self._drop_duplicate_views()
+
+    async def _create_unique_view_index(self):
+        await self.db.story_views.create_index(
+            [("story_id", 1), ("user_id", 1)], unique=True, name="story_views_unique"
+        )
+
+    async def _drop_duplicate_views(self):
+        duplicates = await self.db.story_views.aggregate([
+            {"$group": {"_id": {"story_id": "$story_id", "user_id": "$user_id"},
+                        "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ], allowDiskUse=True).to_list(None)
+        extra_ids = [doc_id for group in duplicates for doc_id in group["ids"][1:]]
+        for start in range(0, len(extra_ids), 1000):
+            await self.db.story_views.delete_many({"_id": {"$in": extra_ids[start:start + 1000]}})
+        print(f"🧹 Removed {len(extra_ids)} duplicate story views")
+
+    async def record_views(self, viewer_id: str, story_ids: List[str]) -> Dict:
+        """
+        Mark many stories viewed by one user (at most MAX_STORY_VIEWS_BATCH,
+        enforced by StoryViewsBatch; larger batches raise ValueError).
+        Returns {"viewed": [new], "already_viewed": [...], "not_found": [...]}.
+        """
+        story_ids = list(dict.fromkeys(story_ids))
+        if len(story_ids) > MAX_STORY_VIEWS_BATCH:
+            raise ValueError(f"At most {MAX_STORY_VIEWS_BATCH} stories per batch")
+        live = await self.db.stories.find(
+            {"id": {"$in": story_ids}, "is_active": True, "expires_at": {"$gt": datetime.utcnow()}},
+            {"_id": 0, "id": 1}
+        ).to_list(len(story_ids))
+        live_ids = {story["id"] for story in live}
+        candidates = [story_id for story_id in story_ids if story_id in live_ids]
+
+        to_insert = candidates
+        if candidates and not self.unique_views_ready:
+            # No unique index yet to reject repeats: skip stories already viewed
+            seen = await self.db.story_views.find(
+                {"story_id": {"$in": candidates}, "user_id": viewer_id}, {"_id": 0, "story_id": 1}
+            ).to_list(len(candidates))
+            seen_ids = {view["story_id"] for view in seen}
+            to_insert = [story_id for story_id in candidates if story_id not in seen_ids]
+
+        new_ids = list(to_insert)
+        if to_insert:
+            views = [StoryView(story_id=story_id, user_id=viewer_id).dict() for story_id in to_insert]
+            try:
+                await self.db.story_views.insert_many(views, ordered=False)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != DUPLICATE_KEY for error in errors):
+                    raise
+                duplicate_positions = {error["index"] for error in errors}
+                new_ids = [story_id for position, story_id in enumerate(to_insert)
+                           if position not in duplicate_positions]
+
+        if new_ids:
+            await self.db.stories.bulk_write(
+                [UpdateOne({"id": story_id}, {"$inc": {"views_count": 1}}) for story_id in new_ids],
+                ordered=False
+            )
+
+        new_set = set(new_ids)
+        return {
+            "viewed": new_ids,
+            "already_viewed": [story_id for story_id in candidates if story_id not in new_set],
+            "not_found": [story_id for story_id in story_ids if story_id not in live_ids]
+        }
+
+    async def resolve_music(self, music_ids: Iterable[str], resolver: MusicResolver) -> Dict[str, Dict]:
+        """music_id -> music info, resolved in one batch; failures are skipped"""
+        unique_ids = list(dict.fromkeys(music_id for music_id in music_ids if music_id))
+        if not unique_ids:
+            return {}
+        try:
+            return await resolver(unique_ids)
+        except Exception as e:
+            logger.error(f"Error fetching music for {len(unique_ids)} stories: {str(e)}")
+            return {}
+
+    async def _debug_counts(self, user_ids: List[str], now: datetime):
+        total, active, live = await asyncio.gather(
+            self.db.stories.count_documents({"user_id": {"$in": user_ids}}),
+            self.db.stories.count_documents({"user_id": {"$in": user_ids}, "is_active": True}),
+            self.db.stories.count_documents(
+                {"user_id": {"$in": user_ids}, "is_active": True, "expires_at": {"$gt": now}}
+            )
+        )
+        logger.info(f"📖 [STORIES] {len(user_ids)} users: total={total}, active={active}, non-expired={live}")
+
+    async def groups(self, viewer_id: str, author_ids: List[str], music_resolver: MusicResolver) -> List[Dict]:
+        """
+        Active stories of `author_ids`, grouped per author: unviewed groups first,
+        then by most recent story.
+        """
+        now = datetime.utcnow()
+        if STORIES_CONFIG['DEBUG_COUNTS']:
+            await self._debug_counts(author_ids, now)
+
+        max_stories = STORIES_CONFIG['MAX_TRAY_STORIES']
+        stories = await self.db.stories.find(
+            {"user_id": {"$in": author_ids}, "is_active": True, "expires_at": {"$gt": now}},
+            STORY_PROJECTION
+        ).sort("created_at", -1).limit(max_stories).to_list(max_stories)
+        if not stories:
+            return []
+
+        story_ids = [story["id"] for story in stories]
+        owner_ids = list({story["user_id"] for story in stories})
+        views, users, music = await asyncio.gather(
+            self.db.story_views.find(
+                {"user_id": viewer_id, "story_id": {"$in": story_ids}}, {"_id": 0, "story_id": 1}
+            ).to_list(len(story_ids)),
+            self.db.users.find({"id": {"$in": owner_ids}}, {"_id": 0, "hashed_password": 0}).to_list(len(owner_ids)),
+            self.resolve_music((story.get("music_id") for story in stories), music_resolver)
+        )
+        viewed_ids = {view["story_id"] for view in views}
+        users_by_id = {user["id"]: user_payload(user) for user in users}
+
+        groups: Dict[str, Dict] = {}
+        for story in stories:
+            user = users_by_id.get(story["user_id"])
+            if user is None:
+                continue
+            group = groups.get(story["user_id"])
+            if group is None:
+                group = groups[story["user_id"]] = {
+                    "user": user, "stories": [], "total_stories": 0, "has_unviewed": False
+                }
+            viewed_by_me = story["id"] in viewed_ids
+            group["stories"].append({
+                **{key: value for key, value in story.items() if key != "user_id"},
+                "user": user,
+                "viewed_by_me": viewed_by_me,
+                "music": music.get(story.get("music_id")) if story.get("music_id") else None,
+            })
+            group["total_stories"] += 1
+            group["has_unviewed"] = group["has_unviewed"] or not viewed_by_me
+
+        result = list(groups.values())
+        result.sort(key=lambda group: (not group["has_unviewed"], -group["stories"][0]["created_at"].timestamp()))
+
+        if STORIES_CONFIG['DEBUG_COUNTS']:
+            for group in result:
+                logger.info(
+                    f"   - User {group['user']['username']}: {group['total_stories']} stories, "
+                    f"has_unviewed={group['has_unviewed']}"
+                )
+        return result
+
+
+class StoryExpirySweeper:
+    """Archives expired stories, drops deleted ones and prunes their views, in batches"""
+
+    def __init__(self, db):
+        self.db = db
+        self._task: Optional[asyncio.Task] = None
+        self.archived = 0
+        self.removed = 0
+        self.views_pruned = 0
+        self.last_sweep: Optional[datetime] = None
+
+    async def initialize_indexes(self):
+        await self.db.stories.create_index([("expires_at", 1)], name="stories_expiry")
+        await self.db.stories.create_index(
+            [("is_active", 1)], partialFilterExpression={"is_active": False}, name="stories_deleted"
+        )
+        await self.db.stories_archive.create_index("id", unique=True, name="archive_story")
+        await self.db.stories_archive.create_index(
+            [("user_id", 1), ("created_at", -1)], name="archive_user"
+        )
+        retention_days = STORIES_CONFIG['ARCHIVE_RETENTION_DAYS']
+        if retention_days > 0:
+            await self.db.stories_archive.create_index(
+                [("archived_at", 1)], expireAfterSeconds=retention_days * 86400, name="archive_ttl"
+            )
+
+    async def sweep_once(self) -> int:
+        """One pass over everything expired or deleted; returns stories moved out of `stories`"""
+        batch_size = STORIES_CONFIG['SWEEP_BATCH_SIZE']
+        total = 0
+        while True:
+            now = datetime.utcnow()
+            batch = await self.db.stories.find(
+                {"$or": [{"expires_at": {"$lte": now}}, {"is_active": False}]},
+                {"_id": 0, "is_active": 1, **{field: 1 for field in ARCHIVE_FIELDS}}
+            ).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+
+            archive = [
+                {**{field: story.get(field) for field in ARCHIVE_FIELDS}, "archived_at": now}
+                for story in batch if story.get("is_active", True)
+            ]
+            if archive:
+                try:
+                    await self.db.stories_archive.insert_many(archive, ordered=False)
+                except BulkWriteError as e:
+                    # Already archived by an earlier, interrupted pass
+                    if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                        raise
+
+            story_ids = [story["id"] for story in batch]
+            stories_result, views_result = await asyncio.gather(
+                self.db.stories.delete_many({"id": {"$in": story_ids}}),
+                self.db.story_views.delete_many({"story_id": {"$in": story_ids}})
+            )
+            self.archived += len(archive)
+            self.removed += stories_result.deleted_count
+            self.views_pruned += views_result.deleted_count
+            total += len(batch)
+            if len(batch) < batch_size:
+                break
+            await asyncio.sleep(0)  # Yield to request handlers
+
+        self.last_sweep = datetime.utcnow()
+        if total:
+            print(f"🗄️  Story sweep: {total} stories moved out, {self.archived} archived so far")
+        return total
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep_once()
+            except Exception as e:
+                print(f"⚠️  Story expiry sweep failed: {str(e)}")
+            await asyncio.sleep(STORIES_CONFIG['SWEEP_INTERVAL_SECONDS'])
+
+    async def start(self):
+        await self.initialize_indexes()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def get_stats(self) -> Dict:
+        return {
+            "last_sweep": self.last_sweep.isoformat() if self.last_sweep else None,
+            "archived": self.archived,
+            "removed": self.removed,
+            "views_pruned": self.views_pruned
+        }
+
+
+# Global instances
+stories_tray = None
+story_expiry = None
+
+
+def init_stories_tray(db):
+    """Initialize stories tray (indexes created at startup)"""
+    global stories_tray
+    stories_tray = StoriesTray(db)
+    return stories_tray
+
+
+def init_story_expiry(db):
+    """Initialize expired story sweeper (started at startup)"""
+    global story_expiry
+    story_expiry = StoryExpirySweeper(db)
+    return story_expiry
@@ -0,0 +1,138 @@
+"""
+Admission control building blocks: token bucket refill, trusted-proxy client
+IP resolution, route classification, client keys and the shedding level.
+"""
+import pytest
+
+import admission_control
+from admission_control import (
+    ADMISSION_CONFIG, PRIORITY_LOW, PRIORITY_NORMAL, AdmissionController, TokenBuckets, resolve_client_ip
+)
+from auth import create_access_token
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission_control.time, "monotonic", clock)
+    return clock
+
+
+# ---- token buckets ----
+
+def test_bucket_allows_burst_then_reports_wait(clock):
+    buckets = TokenBuckets(max_entries=10)
+
+    assert [buckets.take("k", rate=2, burst=3) for _ in range(3)] == [0, 0, 0]
+    # Empty: the next token arrives in 1 / rate seconds
+    assert buckets.take("k", rate=2, burst=3) == pytest.approx(0.5)
+
+
+def test_bucket_refills_over_time_up_to_burst(clock):
+    buckets = TokenBuckets(max_entries=10)
+    for _ in range(3):
+        buckets.take("k", rate=2, burst=3)
+
+    clock.now += 0.5
+    assert buckets.take("k", rate=2, burst=3) == 0
+    assert buckets.take("k", rate=2, burst=3) > 0
+
+    # A long idle period refills to the burst, not beyond
+    clock.now += 60
+    assert [buckets.take("k", rate=2, burst=3) for _ in range(4)][-1] > 0
+
+
+def test_buckets_are_per_key_and_evict_oldest(clock):
+    buckets = TokenBuckets(max_entries=2)
+    buckets.take("a", rate=1, burst=1)
+    assert buckets.take("b", rate=1, burst=1) == 0  # Independent of "a"
+
+    buckets.take("a", rate=1, burst=1)  # "a" most recently seen
+    buckets.take("c", rate=1, burst=1)
+    assert list(buckets.buckets) == ["a", "c"]
+    # An evicted client starts again with a full bucket
+    assert buckets.take("b", rate=1, burst=1) == 0
+
+
+# ---- client IP ----
+
+def test_forwarded_for_from_untrusted_peer_is_ignored():
+    assert resolve_client_ip("198.51.100.7", "1.2.3.4") == "198.51.100.7"
+
+
+def test_spoofed_left_hops_behind_trusted_proxy_are_ignored():
+    # Client sent "X-Forwarded-For: 1.2.3.4"; the proxy appended the real peer
+    assert resolve_client_ip("10.0.0.5", "1.2.3.4, 198.51.100.7") == "198.51.100.7"
+
+
+def test_trusted_hops_are_skipped_right_to_left():
+    assert resolve_client_ip("10.0.0.5", "198.51.100.7, 192.168.1.10, 10.0.0.9") == "198.51.100.7"
+
+
+def test_all_trusted_chain_falls_back_to_left_most_hop():
+    assert resolve_client_ip("127.0.0.1", "10.0.0.1, 10.0.0.2") == "10.0.0.1"
+
+
+def test_missing_header_or_peer():
+    assert resolve_client_ip("10.0.0.5", None) == "10.0.0.5"
+    assert resolve_client_ip(None, "1.2.3.4") == "unknown"
+    # Garbage hops are never trusted, so they are taken as the client
+    assert resolve_client_ip("10.0.0.5", "not-an-ip") == "not-an-ip"
+
+
+# ---- classification and client keys ----
+
+def test_classify_routes():
+    controller = AdmissionController()
+    assert controller.classify("GET", "/api/uploads/images/a.png").name == "media"
+    assert controller.classify("POST", "/api/auth/login").name == "auth"
+    assert controller.classify("GET", "/api/system/health").name == "critical"
+    assert controller.classify("GET", "/api/auth/me").name != "auth"  # Rule is POST only
+    assert controller.classify("GET", "/api/whatever").name == "default"
+
+
+def scope(headers=(), client=("10.0.0.5", 1234)):
+    return {
+        "type": "http",
+        "headers": [(name.encode(), value.encode()) for name, value in headers],
+        "client": client,
+    }
+
+
+def test_client_key_prefers_authenticated_user():
+    token = create_access_token({"sub": "user-1"})
+    key = AdmissionController.client_key(scope([("authorization", f"Bearer {token}"), ("x-forwarded-for", "1.2.3.4")]))
+    assert key == "user:user-1"
+
+
+def test_client_key_falls_back_to_resolved_ip():
+    invalid = scope([("authorization", "Bearer not-a-jwt"), ("x-forwarded-for", "1.2.3.4")], ("198.51.100.7", 1))
+    assert AdmissionController.client_key(invalid) == "ip:198.51.100.7"
+    proxied = scope([("x-forwarded-for", "1.2.3.4")])
+    assert AdmissionController.client_key(proxied) == "ip:1.2.3.4"
+
+
+# ---- shedding ----
+
+def test_shed_level_by_in_flight_and_lag():
+    controller = AdmissionController()
+    assert controller.shed_level() == PRIORITY_LOW + 1
+
+    controller.in_flight = ADMISSION_CONFIG['SHED_LOW_PRIORITY_IN_FLIGHT']
+    assert controller.shed_level() == PRIORITY_LOW
+    controller.in_flight = ADMISSION_CONFIG['SHED_NORMAL_PRIORITY_IN_FLIGHT']
+    assert controller.shed_level() == PRIORITY_NORMAL
+
+    controller.in_flight = 0
+    controller.loop_lag_ms = ADMISSION_CONFIG['SHED_LOW_PRIORITY_LAG_MS']
+    assert controller.shed_level() == PRIORITY_LOW
+    controller.loop_lag_ms = ADMISSION_CONFIG['SHED_NORMAL_PRIORITY_LAG_MS']
+    assert controller.shed_level() == PRIORITY_NORMAL
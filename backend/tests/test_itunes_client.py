@@ -0,0 +1,191 @@
+"""
+ITunesClient against an httpx.MockTransport: lookup coalescing, multi-id
+batching, missing ids and the circuit breaker.
+"""
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from itunes_client import ITUNES_CONFIG, ITunesClient, ITunesUnavailable
+
+
+class FakeITunes:
+    """Lookup/search handler recording the ids of each request"""
+
+    def __init__(self, known_ids=("1", "2", "3"), delay: float = 0.05):
+        self.known_ids = set(known_ids)
+        self.delay = delay
+        self.status_code = 200
+        self.requests = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.delay)
+        if request.url.path == "/lookup":
+            ids = request.url.params["id"].split(",")
+            self.requests.append(ids)
+        else:
+            ids = []
+            self.requests.append(request.url.params.get("term"))
+        if self.status_code != 200:
+            return httpx.Response(self.status_code)
+        results = [
+            {"trackId": int(track_id), "trackName": f"Track {track_id}", "artistName": "Artist"}
+            for track_id in ids if track_id in self.known_ids
+        ]
+        return httpx.Response(200, text=json.dumps({"resultCount": len(results), "results": results}))
+
+
+def make_client(fake: FakeITunes, **overrides) -> ITunesClient:
+    settings = {**ITUNES_CONFIG, 'BASE_URL': "https://itunes.test", **overrides}
+    return ITunesClient(settings, transport=httpx.MockTransport(fake))
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_multi_id_lookup_uses_one_request():
+    fake = FakeITunes()
+    client = make_client(fake)
+
+    results = run(client.lookup_many(["1", "2", "3"]))
+
+    assert sorted(results) == ["1", "2", "3"]
+    assert results["2"]["trackName"] == "Track 2"
+    assert fake.requests == [["1", "2", "3"]]
+
+
+def test_lookup_is_split_into_batches():
+    fake = FakeITunes(known_ids=("1", "2", "3", "4", "5"))
+    client = make_client(fake, LOOKUP_BATCH_SIZE=2)
+
+    results = run(client.lookup_many(["1", "2", "3", "4", "5"]))
+
+    assert len(results) == 5
+    assert sorted(map(len, fake.requests)) == [1, 2, 2]
+
+
+def test_missing_ids_are_omitted():
+    fake = FakeITunes(known_ids=("1",))
+    client = make_client(fake)
+
+    async def scenario():
+        return await client.lookup_many(["1", "404"]), await client.lookup("404")
+
+    results, missing = run(scenario())
+
+    assert list(results) == ["1"]
+    assert missing is None
+    assert client.get_stats()["in_flight"] == 0
+
+
+def test_concurrent_lookups_are_coalesced():
+    fake = FakeITunes()
+    client = make_client(fake)
+
+    async def scenario():
+        return await asyncio.gather(
+            client.lookup_many(["1", "2"]),
+            client.lookup_many(["2", "3"]),
+            client.lookup("1")
+        )
+
+    first, second, single = run(scenario())
+
+    assert sorted(first) == ["1", "2"]
+    assert sorted(second) == ["2", "3"]
+    assert single["trackId"] == 1
+    # Each id was requested once; the overlapping callers waited on the same requests
+    requested = [track_id for ids in fake.requests for track_id in ids]
+    assert sorted(requested) == ["1", "2", "3"]
+    assert client.coalesced == 2
+
+
+def test_breaker_opens_after_consecutive_failures():
+    fake = FakeITunes(delay=0)
+    fake.status_code = 503
+    client = make_client(fake, BREAKER_FAILURE_THRESHOLD=3, BREAKER_RESET_SECONDS=60)
+
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(httpx.HTTPStatusError):
+                await client.search("song")
+        with pytest.raises(ITunesUnavailable):
+            await client.search("song")
+        # Lookups fail soft while open: no request, no results
+        return await client.lookup_many(["1"])
+
+    assert run(scenario()) == {}
+    assert client.breaker.state == "open"
+    assert len(fake.requests) == 3
+    assert client.short_circuited == 2
+
+
+def test_breaker_half_open_trial_closes_or_reopens():
+    fake = FakeITunes(delay=0)
+    fake.status_code = 500
+    client = make_client(fake, BREAKER_FAILURE_THRESHOLD=1, BREAKER_RESET_SECONDS=0.05)
+
+    async def scenario():
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.search("song")
+        assert client.breaker.state == "open"
+
+        # Failed trial after the cooldown reopens immediately
+        await asyncio.sleep(0.06)
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.search("song")
+        assert client.breaker.state == "open"
+        with pytest.raises(ITunesUnavailable):
+            await client.search("song")
+
+        # Successful trial closes the breaker
+        await asyncio.sleep(0.06)
+        fake.status_code = 200
+        await client.search("song")
+        assert client.breaker.state == "closed"
+        await client.search("song")
+
+    run(scenario())
+    assert len(fake.requests) == 4
+
+
+def test_half_open_allows_a_single_trial():
+    client = make_client(FakeITunes(), BREAKER_FAILURE_THRESHOLD=1, BREAKER_RESET_SECONDS=0)
+    breaker = client.breaker
+    breaker.record_failure()
+    breaker.opened_at = time.monotonic() - 1
+
+    assert breaker.allow() is True
+    assert breaker.state == "half_open"
+    assert breaker.allow() is False
+
+
+def test_cancelled_half_open_trial_is_released():
+    fake = FakeITunes(delay=0)
+    fake.status_code = 500
+    client = make_client(fake, BREAKER_FAILURE_THRESHOLD=1, BREAKER_RESET_SECONDS=0.05)
+
+    async def scenario():
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.search("song")
+        await asyncio.sleep(0.06)
+
+        # The trial request is cancelled mid-flight (client went away)
+        fake.status_code = 200
+        fake.delay = 1
+        trial = asyncio.create_task(client.search("song"))
+        await asyncio.sleep(0.05)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        # The next caller gets the trial and closes the breaker
+        fake.delay = 0
+        await client.search("song")
+        assert client.breaker.state == "closed"
+
+    run(scenario())
@@ -0,0 +1,126 @@
+"""
+Login throttling: the in-memory sliding window (expiry, eviction) and the
+per-email / per-IP limits of LoginGuard on top of it.
+"""
+import asyncio
+
+import pytest
+
+import login_guard
+from login_guard import LOGIN_RATE_LIMIT_CONFIG, InMemorySlidingWindow, LoginGuard
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(login_guard.time, "time", clock)
+    return clock
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_window_counts_recent_events(clock):
+    window = InMemorySlidingWindow(window_seconds=60, max_keys=10)
+
+    async def scenario():
+        for _ in range(3):
+            await window.add("k")
+        return await window.count("k"), await window.count("other")
+
+    assert run(scenario()) == (3, 0)
+
+
+def test_window_expires_old_events(clock):
+    window = InMemorySlidingWindow(window_seconds=60, max_keys=10)
+
+    async def scenario():
+        await window.add("k")
+        clock.now += 30
+        await window.add("k")
+        clock.now += 30  # First event is exactly one window old: expired
+        first = await window.count("k")
+        clock.now += 31
+        return first, await window.count("k")
+
+    assert run(scenario()) == (1, 0)
+    # Keys with no events left are dropped
+    assert window.tracked_keys() == 0
+
+
+def test_window_accepts_past_timestamps(clock):
+    window = InMemorySlidingWindow(window_seconds=60, max_keys=10)
+
+    async def scenario():
+        await window.add("k", clock.now - 59)
+        await window.add("k", clock.now - 61)  # Already outside the window
+        return await window.count("k")
+
+    # The expired event is trimmed on the next access of the key
+    assert run(scenario()) == 1
+
+
+def test_window_evicts_least_recently_used_keys(clock):
+    window = InMemorySlidingWindow(window_seconds=60, max_keys=2)
+
+    async def scenario():
+        await window.add("a")
+        await window.add("b")
+        await window.add("a")  # "a" is now the most recent
+        await window.add("c")
+        return [await window.count(key) for key in ("a", "b", "c")]
+
+    assert run(scenario()) == [2, 0, 1]
+
+
+def test_guard_limits_failures_per_email(clock):
+    guard = LoginGuard(db=None, backend=InMemorySlidingWindow(60, 100))
+    limit = LOGIN_RATE_LIMIT_CONFIG['MAX_FAILURES_PER_EMAIL']
+
+    async def scenario():
+        for attempt in range(limit):
+            # Different IPs, same account (email is case-insensitive)
+            await guard.record_failure("User@Example.com" if attempt % 2 else "user@example.com", f"10.0.0.{attempt}")
+        blocked = await guard.allowed("USER@example.com", "10.9.9.9")
+        other_account = await guard.allowed("someone@example.com", "10.9.9.9")
+        clock.now += 61
+        return blocked, other_account, await guard.allowed("user@example.com", "10.9.9.9")
+
+    assert run(scenario()) == (False, True, True)
+    assert guard.blocked == 1
+
+
+def test_guard_limits_failures_per_ip(clock):
+    guard = LoginGuard(db=None, backend=InMemorySlidingWindow(60, 100))
+    limit = LOGIN_RATE_LIMIT_CONFIG['MAX_FAILURES_PER_IP']
+
+    async def scenario():
+        for attempt in range(limit):
+            await guard.record_failure(f"user{attempt}@example.com", "203.0.113.7")
+        return (
+            await guard.allowed("fresh@example.com", "203.0.113.7"),
+            await guard.allowed("fresh@example.com", "203.0.113.8")
+        )
+
+    assert run(scenario()) == (False, True)
+
+
+def test_window_keeps_out_of_order_events_sorted(clock):
+    window = InMemorySlidingWindow(window_seconds=60, max_keys=10)
+
+    async def scenario():
+        await window.add("k")                 # live failure
+        await window.add("k", clock.now - 50)  # audit warm-up, older
+        clock.now += 15                       # warm-up event expires, live one stays
+        return await window.count("k")
+
+    assert run(scenario()) == 1
@@ -0,0 +1,124 @@
+"""
+InvertedIndex: BM25 ranking, AND semantics across query terms, prefix
+expansion of the last term and keeping the sorted vocabulary in step with
+adds and removes.
+"""
+from search_index import InvertedIndex, fold_text, tokenize, tokenize_tags
+
+WEIGHTS = {"title": 2.0, "description": 1.0, "tags": 1.5}
+
+
+def make_index(docs, bulk=False):
+    index = InvertedIndex(WEIGHTS, tag_fields=("tags",))
+    for doc_id, doc in docs.items():
+        index.add(doc_id, doc, bulk=bulk)
+    if bulk:
+        index.finish_bulk()
+    return index
+
+
+DOCS = {
+    "p1": {"title": "Mejor pizza de Madrid", "description": "pizza napolitana", "tags": ["comida"]},
+    "p2": {"title": "Pizza o hamburguesa", "description": "vota tu favorita"},
+    "p3": {"title": "Canción del verano", "description": "la mejor música", "tags": ["#musica"]},
+    "p4": {"title": "Pizzería nueva", "description": "abre en el centro"},
+}
+
+
+def ids(results):
+    return [doc_id for doc_id, _ in results]
+
+
+def test_tokenize_folds_accents_and_splits_hashtags():
+    assert fold_text("Canción ÑANDÚ") == "cancion nandu"
+    assert tokenize("Hola #Verano") == ["hola", "#verano", "verano"]
+    assert tokenize_tags(["#Música", "fútbol"]) == ["#musica", "#futbol"]
+
+
+def test_higher_term_frequency_ranks_first():
+    index = make_index(DOCS)
+
+    results = index.search("pizza", limit=10, prefix=False)
+
+    assert ids(results) == ["p1", "p2"]
+    assert results[0][1] > results[1][1] > 0
+
+
+def test_rare_terms_weigh_more():
+    index = make_index({
+        "a": {"title": "voto comun"},
+        "b": {"title": "voto comun"},
+        "c": {"title": "voto raro"},
+    })
+
+    common = dict(index.search("comun", limit=10, prefix=False))
+    rare = dict(index.search("raro", limit=10, prefix=False))
+
+    assert rare["c"] > common["a"]
+
+
+def test_all_terms_must_match():
+    index = make_index(DOCS)
+
+    assert ids(index.search("pizza madrid", limit=10)) == ["p1"]
+    assert index.search("pizza verano", limit=10) == []
+
+
+def test_last_term_matches_by_prefix():
+    index = make_index(DOCS)
+
+    results = index.search("pizz", limit=10)
+
+    # 'pizza' and 'pizzeria' both expand the partial last term
+    assert set(ids(results)) == {"p1", "p2", "p4"}
+    assert index.search("pizz", limit=10, prefix=False) == []
+
+
+def test_prefix_match_ranks_below_exact_match():
+    index = make_index({
+        "exact": {"title": "casa"},
+        "longer": {"title": "casamiento"},
+    })
+
+    results = index.search("casa", limit=10)
+
+    assert ids(results) == ["exact", "longer"]
+
+
+def test_query_is_folded_like_documents():
+    index = make_index(DOCS)
+
+    assert ids(index.search("CANCIÓN", limit=10)) == ["p3"]
+    assert ids(index.search("#música", limit=10)) == ["p3"]
+
+
+def test_prefix_terms_most_frequent_first():
+    index = make_index(DOCS)
+
+    assert index.prefix_terms("pizz", limit=5) == [("pizza", 2), ("pizzeria", 1)]
+    assert index.prefix_terms("pizz", limit=1) == [("pizza", 2)]
+    assert index.prefix_terms("zz", limit=5) == []
+
+
+def test_remove_and_readd_keep_vocabulary_sorted():
+    index = make_index(DOCS)
+
+    index.remove("p4")
+    assert "pizzeria" not in index.vocabulary
+    assert index.vocabulary == sorted(index.vocabulary)
+    assert index.search("pizzeria", limit=10) == []
+
+    # Re-indexing replaces the old terms
+    index.add("p2", {"title": "Tacos o burritos"})
+    assert "hamburguesa" not in index.vocabulary
+    assert index.vocabulary == sorted(index.vocabulary)
+    assert ids(index.search("pizza", limit=10, prefix=False)) == ["p1"]
+    assert len(index) == 3
+
+
+def test_bulk_build_matches_incremental_adds():
+    incremental = make_index(DOCS)
+    bulk = make_index(DOCS, bulk=True)
+
+    assert bulk.vocabulary == incremental.vocabulary
+    assert bulk.search("mejor", limit=10) == incremental.search("mejor", limit=10)
@@ -0,0 +1,154 @@
+"""
+StoriesTray.record_views accounting against a small fake database: new vs
+already viewed vs missing stories, duplicate-key positions mapped back to
+story ids, and the existing-views check used before the unique index exists.
+"""
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from models import MAX_STORY_VIEWS_BATCH
+from stories_tray import DUPLICATE_KEY, StoriesTray
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return list(self.docs)
+
+
+class FakeStories:
+    def __init__(self, live_ids):
+        self.live_ids = list(live_ids)
+        self.incremented = []
+
+    def find(self, query, projection=None):
+        wanted = query["id"]["$in"]
+        return Cursor([{"id": story_id} for story_id in self.live_ids if story_id in wanted])
+
+    async def bulk_write(self, operations, ordered=True):
+        self.incremented.extend(operation._filter["id"] for operation in operations)
+
+
+class FakeStoryViews:
+    """Views keyed by (story_id, user_id); duplicates fail like a unique index when `unique`"""
+
+    def __init__(self, unique=True):
+        self.unique = unique
+        self.views = set()
+        self.finds = 0
+        self.error_code = None
+
+    def find(self, query, projection=None):
+        self.finds += 1
+        wanted = query["story_id"]["$in"]
+        return Cursor([
+            {"story_id": story_id} for story_id, user_id in self.views
+            if story_id in wanted and user_id == query["user_id"]
+        ])
+
+    async def insert_many(self, documents, ordered=True):
+        errors = []
+        for position, document in enumerate(documents):
+            key = (document["story_id"], document["user_id"])
+            if self.error_code is not None:
+                errors.append({"index": position, "code": self.error_code})
+            elif self.unique and key in self.views:
+                errors.append({"index": position, "code": DUPLICATE_KEY})
+            else:
+                self.views.add(key)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+class FakeDB:
+    def __init__(self, live_ids, unique=True):
+        self.stories = FakeStories(live_ids)
+        self.story_views = FakeStoryViews(unique)
+
+
+def make_tray(live_ids, unique=True):
+    db = FakeDB(live_ids, unique)
+    tray = StoriesTray(db)
+    tray.unique_views_ready = unique
+    return tray, db
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_new_views_are_counted_once():
+    tray, db = make_tray(["s1", "s2"])
+
+    result = run(tray.record_views("u1", ["s1", "s2", "s1"]))
+
+    assert result == {"viewed": ["s1", "s2"], "already_viewed": [], "not_found": []}
+    assert db.stories.incremented == ["s1", "s2"]
+    # The unique index rejects repeats: no extra lookup
+    assert db.story_views.finds == 0
+
+
+def test_duplicate_positions_map_to_story_ids():
+    tray, db = make_tray(["s1", "s2", "s3", "s4"])
+    db.story_views.views = {("s2", "u1"), ("s4", "u1"), ("s1", "other")}
+
+    result = run(tray.record_views("u1", ["s1", "s2", "s3", "s4"]))
+
+    assert result["viewed"] == ["s1", "s3"]
+    assert result["already_viewed"] == ["s2", "s4"]
+    assert db.stories.incremented == ["s1", "s3"]
+
+
+def test_missing_and_expired_stories_are_not_found():
+    tray, db = make_tray(["s2"])
+
+    result = run(tray.record_views("u1", ["gone", "s2", "expired"]))
+
+    assert result == {"viewed": ["s2"], "already_viewed": [], "not_found": ["gone", "expired"]}
+    assert db.stories.incremented == ["s2"]
+
+
+def test_existing_views_checked_until_unique_index_exists():
+    tray, db = make_tray(["s1", "s2", "s3"], unique=False)
+    db.story_views.views = {("s1", "u1")}
+
+    result = run(tray.record_views("u1", ["s1", "s2", "s3"]))
+    again = run(tray.record_views("u1", ["s2", "s3"]))
+
+    assert result["viewed"] == ["s2", "s3"]
+    assert result["already_viewed"] == ["s1"]
+    assert again["viewed"] == []
+    assert again["already_viewed"] == ["s2", "s3"]
+    assert db.story_views.finds == 2
+    assert db.stories.incremented == ["s2", "s3"]
+
+
+def test_no_writes_when_nothing_new():
+    tray, db = make_tray(["s1"])
+    db.story_views.views = {("s1", "u1")}
+
+    result = run(tray.record_views("u1", ["s1"]))
+
+    assert result == {"viewed": [], "already_viewed": ["s1"], "not_found": []}
+    assert db.stories.incremented == []
+
+
+def test_other_write_errors_are_raised():
+    tray, db = make_tray(["s1"])
+    db.story_views.error_code = 121  # Document validation failure
+
+    with pytest.raises(BulkWriteError):
+        run(tray.record_views("u1", ["s1"]))
+    assert db.stories.incremented == []
+
+
+def test_oversized_batch_is_rejected():
+    tray, _ = make_tray([])
+    story_ids = [f"s{i}" for i in range(MAX_STORY_VIEWS_BATCH + 1)]
+
+    with pytest.raises(ValueError):
+        run(tray.record_views("u1", story_ids))